@@ -0,0 +1,60 @@
+
+import sys
+import argparse
+import random
+import timeit
+
+from PDC_client.submodules import io
+
+
+def make_study(n_files: int, n_cases: int, seed: int=1) -> dict:
+    ''' Make a synthetic DIA study with n_files files, one aliquot per file. '''
+    rng = random.Random(seed)
+    study_metadata = {'pdc_study_id': 'PDC999999',
+                      'experiment_type': 'Label Free',
+                      'analytical_fraction': 'Proteome'}
+    cases = [{'case_id': f'case_{i}',
+              'case_submitter_id': f'C{i:06}',
+              'demographic_id': f'demographic_{i}',
+              'ethnicity': 'Not Reported',
+              'gender': rng.choice(('Male', 'Female')),
+              'race': 'Not Reported',
+              'vital_status': None} for i in range(n_cases)]
+    files = []
+    aliquots = []
+    for i in range(n_files):
+        file_id = f'file_{i}'
+        files.append({'file_id': file_id,
+                      'file_name': f'file_{i}.raw',
+                      'file_size': str(rng.randint(1, 2 * 1024 ** 3)),
+                      'md5sum': f'{rng.getrandbits(128):032x}',
+                      'file_type': 'Proprietary',
+                      'file_format': 'vendor-specific'})
+        aliquots.append({'aliquot_id': f'aliquot_{i}',
+                         'aliquot_submitter_id': f'A{i:06}',
+                         'sample_id': f'sample_{i}',
+                         'sample_submitter_id': f'S{i:06}',
+                         'case_id': rng.choice(cases)['case_id'],
+                         'file_id_to_aliquot_run_metadata_id': {file_id: f'arm_{i}'}})
+    rng.shuffle(aliquots)
+    return {'study_metadata': study_metadata, 'files': files, 'aliquots': aliquots, 'cases': cases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark io.flatten_metadata on a synthetic study.')
+    parser.add_argument('-n', '--nFiles', dest='n_files', default=20000, type=int,
+                        help='Number of files in the study. 20000 is the default.')
+    parser.add_argument('-c', '--nCases', dest='n_cases', default=1000, type=int,
+                        help='Number of cases in the study. 1000 is the default.')
+    parser.add_argument('-r', '--repeat', default=5, type=int,
+                        help='Number of times to repeat the benchmark. 5 is the default.')
+    args = parser.parse_args()
+
+    data = make_study(args.n_files, args.n_cases)
+    times = timeit.repeat(lambda: io.flatten_metadata(**data), number=1, repeat=args.repeat)
+    sys.stdout.write(f'flatten_metadata: {args.n_files} files, {args.n_cases} cases\n')
+    sys.stdout.write(f'best: {min(times):.4f}s, mean: {sum(times) / len(times):.4f}s\n')
+
+
+if __name__ == '__main__':
+    main()
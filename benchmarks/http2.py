@@ -0,0 +1,199 @@
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import threading
+import subprocess
+import ssl
+from tempfile import TemporaryDirectory
+
+import h11
+import h2.config
+import h2.connection
+import h2.events
+
+from PDC_client.submodules import json_codec
+from PDC_client.submodules.api import Client, http2_available
+
+# Response to every request. The same shape as a studyCatalog query so Client.async_get_study_id can parse it.
+PAYLOAD = json_codec.dumps({'data': {'studyCatalog': [
+    {'versions': [{'study_id': '00000000-0000-0000-0000-000000000000', 'is_latest_version': 'yes'}]}
+]}}).encode('utf-8')
+
+
+class StandInProtocol(asyncio.Protocol):
+    '''
+    Minimal https server which answers every request with PAYLOAD after a fixed delay.
+
+    Speaks HTTP/2 when it is negotiated with ALPN and HTTP/1.1 otherwise.
+    '''
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.h2 = None
+        self.h11 = None
+
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.n_connections += 1
+        if transport.get_extra_info('ssl_object').selected_alpn_protocol() == 'h2':
+            self.h2 = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+            self.h2.initiate_connection()
+            self.transport.write(self.h2.data_to_send())
+        else:
+            self.h11 = h11.Connection(h11.SERVER)
+
+
+    def data_received(self, data):
+        if self.h2 is not None:
+            self._h2_received(data)
+        else:
+            self.h11.receive_data(data)
+            self._h11_events()
+
+
+    def _respond_later(self, respond, *args):
+        asyncio.get_running_loop().call_later(self.server.delay, respond, *args)
+
+
+    def _h2_received(self, data):
+        for event in self.h2.receive_data(data):
+            if isinstance(event, h2.events.DataReceived):
+                self.h2.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                self._respond_later(self._h2_respond, event.stream_id)
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                self.transport.close()
+        self.transport.write(self.h2.data_to_send())
+
+
+    def _h2_respond(self, stream_id):
+        if self.transport.is_closing():
+            return
+        self.h2.send_headers(stream_id, [(':status', '200'), ('content-type', 'application/json'),
+                                         ('content-length', str(len(PAYLOAD)))])
+        self.h2.send_data(stream_id, PAYLOAD, end_stream=True)
+        self.transport.write(self.h2.data_to_send())
+
+
+    def _h11_events(self):
+        while True:
+            event = self.h11.next_event()
+            if event is h11.NEED_DATA or event is h11.PAUSED:
+                return
+            if isinstance(event, h11.ConnectionClosed):
+                self.transport.close()
+                return
+            if isinstance(event, h11.EndOfMessage):
+                self._respond_later(self._h11_respond)
+                return
+
+
+    def _h11_respond(self):
+        if self.transport.is_closing():
+            return
+        headers = [('content-type', 'application/json'), ('content-length', str(len(PAYLOAD)))]
+        data = self.h11.send(h11.Response(status_code=200, headers=headers))
+        data += self.h11.send(h11.Data(data=PAYLOAD))
+        data += self.h11.send(h11.EndOfMessage())
+        self.transport.write(data)
+        self.h11.start_next_cycle()
+        self._h11_events()
+
+
+class StandInServer():
+    ''' Run a StandInProtocol server on a random local port in a background thread. '''
+
+    def __init__(self, cert_dir: str, delay: float, h2_enabled: bool=True):
+        self.delay = delay
+        self.n_connections = 0
+        self.port = None
+
+        cert, key = os.path.join(cert_dir, 'cert.pem'), os.path.join(cert_dir, 'key.pem')
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                        '-subj', '/CN=127.0.0.1', '-keyout', key, '-out', cert],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        self.ssl_context.load_cert_chain(cert, key)
+        self.ssl_context.set_alpn_protocols(['h2', 'http/1.1'] if h2_enabled else ['http/1.1'])
+
+        self._loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        server = self._loop.run_until_complete(
+            self._loop.create_server(lambda: StandInProtocol(self), '127.0.0.1', 0, ssl=self.ssl_context))
+        self.port = server.sockets[0].getsockname()[1]
+        self._started.set()
+        self._loop.run_forever()
+        server.close()
+        self._loop.run_until_complete(server.wait_closed())
+        self._loop.close()
+
+
+    def __enter__(self):
+        self._thread.start()
+        self._started.wait()
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+def run_requests(url: str, n_requests: int, http2: bool, max_connections: int) -> tuple:
+    ''' Send n_requests distinct queries concurrently. Returns (seconds, Client.http_versions). '''
+    with Client(url=url, verify=False, http2=http2, max_connections=max_connections) as client:
+        start = time.perf_counter()
+        results = client.gather(*[client.async_get_study_id(f'PDC{i:06d}') for i in range(n_requests)])
+        elapsed = time.perf_counter() - start
+    if any(result is None for result in results):
+        raise RuntimeError('Request failed!')
+    return elapsed, dict(client.http_versions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Client request throughput over HTTP/1.1 and HTTP/2 '
+                                                 'against a local stand-in server.')
+    parser.add_argument('-n', '--nRequests', default=500, type=int, dest='n_requests',
+                        help='Number of requests sent in each run. 500 is the default.')
+    parser.add_argument('-c', '--maxConnections', default=20, type=int, dest='max_connections',
+                        help='Client max_connections, which is also the maximum request concurrency. '
+                             '20 is the default.')
+    parser.add_argument('-d', '--delay', default=0.02, type=float,
+                        help='Seconds the server waits before answering each request. 0.02 is the default.')
+    parser.add_argument('-r', '--repeat', default=3, type=int,
+                        help='Number of times to repeat each run. 3 is the default.')
+    args = parser.parse_args()
+
+    if not http2_available():
+        sys.stderr.write("The h2 package is required. Install it with: pip install 'httpx[http2]'\n")
+        sys.exit(1)
+
+    runs = (('HTTP/1.1', False, True), ('HTTP/2', True, True), ('HTTP/2 fallback', True, False))
+    sys.stdout.write(f'{args.n_requests} requests, max_connections={args.max_connections}, '
+                     f'server delay={args.delay * 1000:.0f}ms\n')
+    sys.stdout.write(f"{'mode':<18}{'best time':>12}{'requests/s':>12}{'connections':>13}  versions\n")
+    with TemporaryDirectory() as cert_dir:
+        for name, http2, h2_enabled in runs:
+            times = list()
+            for _ in range(args.repeat):
+                with StandInServer(cert_dir, args.delay, h2_enabled=h2_enabled) as server:
+                    elapsed, versions = run_requests(f'https://127.0.0.1:{server.port}/graphql',
+                                                     args.n_requests, http2, args.max_connections)
+                times.append(elapsed)
+            best = min(times)
+            sys.stdout.write(f'{name:<18}{best:>11.3f}s{args.n_requests / best:>12.0f}{server.n_connections:>13}'
+                             f"  {', '.join(f'{v}: {n}' for v, n in sorted(versions.items()))}\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+
+import os
+import sys
+import glob
+import argparse
+import timeit
+
+from PDC_client.submodules import json_codec
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'resources', 'data', 'api')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the json_codec backends on the test API data.')
+    parser.add_argument('-r', '--repeat', default=5, type=int,
+                        help='Number of times to repeat the benchmark. 5 is the default.')
+    parser.add_argument('-n', '--number', default=20, type=int,
+                        help='Number of times each file is processed in each repeat. 20 is the default.')
+    parser.add_argument('files', nargs='*', default=None,
+                        help=f'json files to use. By default all the files in {os.path.normpath(DATA_DIR)} are used.')
+    args = parser.parse_args()
+
+    texts = list()
+    for fname in args.files or sorted(glob.glob(os.path.join(DATA_DIR, '*.json'))):
+        with open(fname, 'rb') as inF:
+            texts.append(inF.read())
+    data = [json_codec.get_codec('json').loads(text) for text in texts]
+    sys.stdout.write(f'{len(texts)} files, {sum(len(text) for text in texts) / 1024 ** 2:.2f} MiB\n')
+
+    def best(f):
+        return min(timeit.repeat(f, number=args.number, repeat=args.repeat)) / args.number
+
+    results = dict()
+    for backend in json_codec.available_backends():
+        codec = json_codec.get_codec(backend)
+        results[backend] = {'loads': best(lambda: [codec.loads(text) for text in texts]),
+                            'dumps': best(lambda: [codec.dumps(d) for d in data]),
+                            'pretty': best(lambda: [codec.dumps(d, pretty=True) for d in data])}
+
+    baseline = results['json']
+    sys.stdout.write(f"{'backend':<10}{'loads':>18}{'dumps':>18}{'pretty':>18}\n")
+    for backend, times in results.items():
+        sys.stdout.write(f'{backend:<10}')
+        for op in ('loads', 'dumps', 'pretty'):
+            sys.stdout.write(f'{times[op] * 1000:>9.2f}ms ({baseline[op] / times[op]:>4.1f}x)')
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
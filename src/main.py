@@ -4,13 +4,20 @@ import sys
 import os
 from datetime import datetime
 
-from .submodules.api import Client, BASE_URL
-from .submodules import io
+# The api, io, cache, limiter and snapshot submodules are imported by the subcommands
+# which use them so that short commands only pay for the imports they need.
+# In particular, metadataToSky must not import httpx or asyncio.
+from .submodules.constants import BASE_URL
 from .submodules.logger import LOGGER
 
 SUBCOMMANDS = {'studyID', 'PDCStudyID', 'studyName',
                'metadata', 'metadataToSky',
-               'file'}
+               'file', 'files', 'snapshot', 'serve'}
+
+CACHE_DIR_ENV = 'PDC_CLIENT_CACHE_DIR'
+SNAPSHOT_DIR_ENV = 'PDC_CLIENT_SNAPSHOT_DIR'
+SERVER_SOCKET_ENV = 'PDC_CLIENT_SOCKET'
+STORE_DIR_ENV = 'PDC_CLIENT_STORE_DIR'
 
 
 def _firstSubcommand(argv):
@@ -20,6 +27,197 @@ def _firstSubcommand(argv):
     return len(argv)
 
 
+def _add_cache_args(parser):
+    cache_args = parser.add_argument_group('API response cache options')
+    cache_args.add_argument('--cacheDir', default=os.environ.get(CACHE_DIR_ENV), dest='cache_dir',
+                            help='Cache API responses in this directory. '
+                                 f'The default is the value of the {CACHE_DIR_ENV} environment variable. '
+                                 'If neither is set, responses are not cached.')
+    cache_args.add_argument('--noCache', default=False, action='store_true', dest='no_cache',
+                            help='Don\'t read or write cached API responses.')
+
+
+def _get_cache(args):
+    if args.no_cache or args.cache_dir is None:
+        return None
+    from .submodules.cache import ResponseCache
+    return ResponseCache(args.cache_dir)
+
+
+def _add_store_arg(parser):
+    parser.add_argument('--store', default=os.environ.get(STORE_DIR_ENV), dest='store_dir', metavar='DIR',
+                        help='Keep downloaded files in a local store in this directory keyed by their md5 sum. '
+                             'Files already in the store are hard linked, reflinked or copied to the output '
+                             'path instead of being downloaded again. Hard linked files are read only. '
+                             f'The default is the value of the {STORE_DIR_ENV} environment variable. '
+                             'If neither is set, files are always downloaded.')
+
+
+def _get_file_store(args):
+    if args.store_dir is None:
+        return None
+    from .submodules.store import FileStore
+    return FileStore(args.store_dir)
+
+
+def _add_http2_arg(parser):
+    parser.add_argument('--http2', default=False, action='store_true',
+                        help='Use HTTP/2 for API requests if the server supports it. '
+                             'Concurrent requests are multiplexed over fewer connections. '
+                             'Requires the h2 package.')
+
+
+def _add_snapshot_dir_arg(parser):
+    parser.add_argument('--snapshotDir', default=os.environ.get(SNAPSHOT_DIR_ENV), dest='snapshot_dir',
+                        help='The metadata snapshot directory. '
+                             f'The default is the value of the {SNAPSHOT_DIR_ENV} environment variable.')
+
+
+def _add_offline_args(parser):
+    offline_args = parser.add_argument_group('Offline options')
+    offline_args.add_argument('--offline', default=False, action='store_true',
+                              help='Read metadata from a snapshot created with the snapshot subcommand '
+                                   'instead of the PDC API.')
+    _add_snapshot_dir_arg(offline_args)
+
+
+def _get_snapshot_store(args):
+    if args.snapshot_dir is None:
+        LOGGER.error('A snapshot directory must be specified with --snapshotDir or the %s environment variable',
+                     SNAPSHOT_DIR_ENV)
+        sys.exit(1)
+    from .submodules.snapshot import SnapshotStore
+    return SnapshotStore(args.snapshot_dir)
+
+
+def _get_client(args, **kwargs):
+    '''
+    Get an OfflineClient if the --offline option was used, a RemoteClient if a
+    server started with the serve subcommand is listening on the socket in the
+    SERVER_SOCKET_ENV environment variable, otherwise a Client.
+
+    Only a Client uses the response cache from the cache options in args. The
+    server has its own cache.
+    '''
+    if getattr(args, 'offline', False):
+        from .submodules.snapshot import OfflineClient
+        return OfflineClient(_get_snapshot_store(args))
+
+    if socket_path := os.environ.get(SERVER_SOCKET_ENV):
+        from .submodules.server import RemoteClient, server_running
+        if server_running(socket_path):
+            return RemoteClient(socket_path, **kwargs)
+        LOGGER.info("No server running on socket '%s'. Sending requests directly.", socket_path)
+
+    from .submodules.api import Client
+    return Client(cache=_get_cache(args), **kwargs)
+
+
+def _add_concurrency_args(parser):
+    from .submodules.limiter import DEFAULT_INITIAL_LIMIT, DEFAULT_MAX_LIMIT
+    concurrency_args = parser.add_argument_group('API request concurrency options')
+    concurrency_args.add_argument('--initialConcurrency', default=DEFAULT_INITIAL_LIMIT, type=int,
+                                  dest='initial_concurrency',
+                                  help='The number of concurrent API requests to start with. '
+                                       'The limit is increased while the server responds quickly and '
+                                       f'decreased if it is overloaded. {DEFAULT_INITIAL_LIMIT} is the default.')
+    concurrency_args.add_argument('--maxConcurrency', default=DEFAULT_MAX_LIMIT, type=int,
+                                  dest='max_concurrency',
+                                  help=f'The maximum number of concurrent API requests. {DEFAULT_MAX_LIMIT} is the default.')
+
+
+def _get_limiter(args):
+    from .submodules.limiter import AdaptiveLimiter
+    try:
+        return AdaptiveLimiter(initial_limit=min(args.initial_concurrency, args.max_concurrency),
+                               max_limit=args.max_concurrency)
+    except ValueError as e:
+        LOGGER.error('Invalid concurrency options: %s', e)
+        sys.exit(1)
+
+
+def _read_study_ids(fname):
+    ''' Read a file with a study id on each line. Blank lines and lines starting with # are skipped. '''
+    try:
+        with open(fname, 'r', encoding='utf-8') as inF:
+            lines = [line.strip() for line in inF]
+    except OSError as e:
+        LOGGER.error("Could not read study id file '%s': %s", fname, e)
+        sys.exit(1)
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+async def _async_get_metadata_files(client, study_id, args):
+    '''
+    Get the study_metadata, files, aliquots, and cases for a study.
+
+    Returns None if any of the metadata could not be retrieved or the output
+    options are not compatable with the experiment type.
+    '''
+    import asyncio
+    from .submodules import io
+
+    # get study metadata, raw files and cases concurrently
+    # The other requests are finished before an exception from one is raised.
+    results = await asyncio.gather(
+        client.async_get_study_metadata(study_id=study_id),
+        client.async_get_study_raw_files(study_id, n_files=args.n_files,
+                                         use_s3_path=args.s3Path, records=True),
+        client.async_get_study_cases(study_id, records=True),
+        return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    study_metadata, files, cases = results
+
+    # check that output options are compatable with experiment type
+    if study_metadata is None:
+        LOGGER.error('Could not retrieve metadata for study: %s', study_id)
+        return None
+    experiment_type = study_metadata['experiment_type']
+    if not io.is_dia(study_metadata) and \
+        (args.flatten or args.skyline_annotations or args.format == 'tsv'):
+        LOGGER.error('Output format not supported for %s experiments', experiment_type)
+        return None
+
+    # aliquots depend on the file_ids
+    aliquots = None
+    if files is not None:
+        aliquots = await client.async_get_study_samples(study_id, records=True,
+                                                        file_ids=[f.file_id for f in files])
+
+    # check that no metadata is missing
+    metadata_files = {'study_metadata': study_metadata, 'files': files,
+                      'aliquots': aliquots, 'cases': cases}
+    all_good = True
+    for name, data in metadata_files.items():
+        if data is None:
+            LOGGER.error("Could not retreive %s data for study: '%s'", name, study_id)
+            all_good = False
+    return metadata_files if all_good else None
+
+
+def _write_metadata_files(metadata_files, prefix, args):
+    from .submodules import io
+
+    flat_data = None
+    if args.skyline_annotations:
+        flat_data = io.flatten_metadata(**metadata_files)
+        io.write_skyline_annotations(flat_data, f'{prefix}skyline_annotations.csv')
+
+    if args.flatten:
+        # stream the flattened rows unless they were already needed for the annotations
+        if flat_data is None:
+            flat_data = io.iter_flatten_metadata(**metadata_files)
+        io.write_metadata_rows(flat_data, f'{prefix}flat.{args.format}',
+                               format=args.format)
+        return
+
+    for name, data in metadata_files.items():
+        io.write_metadata_file(data, f'{prefix}{name}.{args.format}',
+                               format=args.format)
+
+
 class Main:
     '''
     A class to parse subcommands.
@@ -32,6 +230,9 @@ class Main:
     METADATA_DESCRIPTION = 'Get the metadata for files in a study.'
     METADATA_TO_SKY_DESCRIPTION = 'Convert a metadata tsv or json to Skyline annotation csv.'
     FILE_DESCRIPTION = 'Download a single file.'
+    FILES_DESCRIPTION = 'Download all the files in a study.'
+    SNAPSHOT_DESCRIPTION = 'Save the metadata for a study to a local snapshot for use with --offline.'
+    SERVE_DESCRIPTION = 'Run a local server which keeps API connections and caches warm between commands.'
 
     def __init__(self, argv=sys.argv):
         self.argv = argv
@@ -45,7 +246,10 @@ Available commands:
    studyName       {Main.STUDY_NAME_DESCRIPTION}
    metadata        {Main.METADATA_DESCRIPTION}
    metadataToSky   {Main.METADATA_TO_SKY_DESCRIPTION}
-   file            {Main.FILE_DESCRIPTION}''')
+   file            {Main.FILE_DESCRIPTION}
+   files           {Main.FILES_DESCRIPTION}
+   snapshot        {Main.SNAPSHOT_DESCRIPTION}
+   serve           {Main.SERVE_DESCRIPTION}''')
         parser.add_argument('command', help = 'Subcommand to run.')
         subcommand_start = _firstSubcommand(self.argv)
         args = parser.parse_args(self.argv[1:(subcommand_start + 1)])
@@ -63,10 +267,14 @@ Available commands:
                             help=f'The base URL for the PDC API. {BASE_URL} is the default.')
         parser.add_argument('--skipVerify', default=False, action='store_true',
                             help='Skip ssl verification?')
+        _add_http2_arg(parser)
+        _add_cache_args(parser)
+        _add_offline_args(parser)
         parser.add_argument('pdc_study_id')
         args = parser.parse_args(self.argv[start:])
 
-        with Client(url=args.baseUrl, verify=not args.skipVerify, timeout=60) as client:
+        with _get_client(args, url=args.baseUrl, verify=not args.skipVerify, timeout=60,
+                         http2=args.http2) as client:
             study_id = client.get_study_id(args.pdc_study_id)
         if study_id is None:
             LOGGER.error('No study found matching pdc_study_id!\n')
@@ -80,10 +288,14 @@ Available commands:
                             help=f'The base URL for the PDC API. {BASE_URL} is the default.')
         parser.add_argument('--skipVerify', default=False, action='store_true',
                             help='Skip ssl verification?')
+        _add_http2_arg(parser)
+        _add_cache_args(parser)
+        _add_offline_args(parser)
         parser.add_argument('study_id')
         args = parser.parse_args(self.argv[start:])
 
-        with Client(url=args.baseUrl, verify=not args.skipVerify, timeout=60) as client:
+        with _get_client(args, url=args.baseUrl, verify=not args.skipVerify, timeout=60,
+                         http2=args.http2) as client:
             pdc_study_id = client.get_pdc_study_id(args.study_id)
 
         if pdc_study_id is None:
@@ -100,10 +312,14 @@ Available commands:
                             help='Skip ssl verification?')
         parser.add_argument('--normalize', default=False, action='store_true',
                             help='Remove special characters from study name so it a valid file name.')
+        _add_http2_arg(parser)
+        _add_cache_args(parser)
+        _add_offline_args(parser)
         parser.add_argument('study_id')
         args = parser.parse_args(self.argv[start:])
 
-        with Client(url=args.baseUrl, verify=not args.skipVerify, timeout=60) as client:
+        with _get_client(args, url=args.baseUrl, verify=not args.skipVerify, timeout=60,
+                         http2=args.http2) as client:
             study_name = client.get_study_name(args.study_id)
 
         if study_name is None:
@@ -111,6 +327,7 @@ Available commands:
             sys.exit(1)
 
         if args.normalize:
+            from .submodules import io
             study_name = io.normalize_fname(study_name)
         sys.stdout.write(f'{study_name}\n')
 
@@ -128,9 +345,12 @@ Available commands:
         f_args.add_argument('-p', '--prefix', default=None,
                             help='The prefix to add to the output file names. '
                                  'Default is the PDC study id.')
-        f_args.add_argument('-f', '--format', choices=('json', 'tsv', 'str'), default = 'json',
+        f_args.add_argument('-f', '--format', choices=('json', 'jsonl', 'tsv', 'str', 'parquet', 'arrow'),
+                            default = 'json',
                             help="The output file format. Default is 'json'. "
-                                 "'tsv' is only compatable with DIA data.")
+                                 "'jsonl' writes one json object per line. "
+                                 "'tsv' is only compatable with DIA data. "
+                                 "'parquet' and 'arrow' write typed, compressed columns and require pyarrow.")
         f_args.add_argument('-a', '--skylineAnnotations', default=False, action='store_true',
                             dest='skyline_annotations',
                             help='Also save Skyline annotations csv file. Only compatable with DIA data.')
@@ -140,54 +360,75 @@ Available commands:
         f_args.add_argument('--s3Path', default=False, action='store_true',
                             help='Use S3 path instaed of URL for file download.')
 
-        parser.add_argument('study_id', help='The study id.')
+        _add_http2_arg(parser)
+        _add_cache_args(parser)
+        _add_offline_args(parser)
+        _add_concurrency_args(parser)
+        parser.add_argument('--studyIDFile', default=None, dest='study_id_file',
+                            help='A file with a study id on each line. '
+                                 'The studies are combined with any study ids given as arguments.')
+        parser.add_argument('study_ids', nargs='*', metavar='study_id',
+                            help='The study id(s). Multiple studies are retrieved concurrently and '
+                                 'the PDC study id of each study is added to the --prefix.')
         args = parser.parse_args(self.argv[start:])
 
-        with Client(url=args.baseUrl, verify=not args.skipVerify, timeout=60) as client:
-            # get study metadata and check that output options are compatable with experiment type
-            study_metadata = client.get_study_metadata(study_id=args.study_id)
-            if study_metadata is None:
-                LOGGER.error('Could not retrieve metadata for study: %s', args.study_id)
-                sys.exit(1)
-            experiment_type = study_metadata['experiment_type']
-            if not io.is_dia(study_metadata) and \
-                (args.flatten or args.skyline_annotations or args.format == 'tsv'):
-                LOGGER.error('Output format not supported for %s experiments', experiment_type)
-                sys.exit(1)
-
-            # download remaining metadata
-            files = client.get_study_raw_files(args.study_id, n_files=args.n_files, use_s3_path=args.s3Path)
-            aliquots = client.get_study_samples(args.study_id,
-                                                file_ids=[f['file_id'] for f in files])
-            cases = client.get_study_cases(args.study_id)
-
-        # check that no metadata is missing
-        metadata_files = {'study_metadata': study_metadata, 'files': files,
-                          'aliquots': aliquots, 'cases': cases}
-        all_good = True
-        for name, data in metadata_files.items():
-            if data is None:
-                LOGGER.error("Could not retreive %s data for study: '%s'", name, args.study_id)
-                all_good = False
-        if not all_good:
+        study_ids = list(args.study_ids)
+        if args.study_id_file is not None:
+            study_ids += _read_study_ids(args.study_id_file)
+        study_ids = list(dict.fromkeys(study_ids))
+        if len(study_ids) == 0:
+            parser.error('At least one study_id or --studyIDFile is required.')
+        from .submodules import io
+        if args.format in io.COLUMNAR_WRITERS and not io.pyarrow_available():
+            LOGGER.error("The '%s' format requires the pyarrow package. "
+                         "Install it with: pip install pyarrow", args.format)
             sys.exit(1)
 
-        prefix = f'{study_metadata["pdc_study_id"]}_' if args.prefix is None else args.prefix
-        flat_data = None
-        if args.flatten or args.skyline_annotations:
-            flat_data = io.flatten_metadata(**metadata_files)
-
-        if args.skyline_annotations:
-            io.write_skyline_annotations(flat_data, f'{prefix}skyline_annotations.csv')
-
-        if args.flatten:
-            io.write_metadata_file(flat_data, f'{prefix}flat.{args.format}',
-                                   format=args.format)
-            sys.exit(0)
-
-        for name, data in metadata_files.items():
-            io.write_metadata_file(data, f'{prefix}{name}.{args.format}',
-                                    format=args.format)
+        import asyncio
+        import contextlib
+        # the 'str' format writes to stdout, so studies are written one at a time
+        stdout_lock = asyncio.Lock() if args.format == 'str' else contextlib.nullcontext()
+
+        async def get_study(client, study_id):
+            try:
+                return await write_study(client, study_id)
+            except Exception as e:
+                # one study failing should not stop the other studies
+                LOGGER.error("Could not get metadata for study '%s': %s: %s", study_id, type(e).__name__, e)
+                return False
+
+        async def write_study(client, study_id):
+            metadata_files = await _async_get_metadata_files(client, study_id, args)
+            if metadata_files is None:
+                return False
+
+            pdc_study_id = metadata_files['study_metadata']['pdc_study_id']
+            if args.prefix is None:
+                prefix = f'{pdc_study_id}_'
+            elif len(study_ids) > 1:
+                prefix = f'{args.prefix}{pdc_study_id}_'
+            else:
+                prefix = args.prefix
+
+            try:
+                async with stdout_lock:
+                    await asyncio.to_thread(_write_metadata_files, metadata_files, prefix, args)
+            except (ValueError, KeyError, OSError) as e:
+                LOGGER.error("Could not write metadata for study '%s': %s", study_id, e)
+                return False
+            return True
+
+        with _get_client(args, url=args.baseUrl, verify=not args.skipVerify, timeout=60,
+                         max_connections=args.max_concurrency, limiter=_get_limiter(args),
+                         http2=args.http2) as client:
+            results = client.gather(*[get_study(client, study_id) for study_id in study_ids])
+
+        failed = [study_id for study_id, success in zip(study_ids, results) if not success]
+        if len(study_ids) > 1 and len(failed) > 0:
+            LOGGER.error('Failed to get metadata for %i of %i studies: %s',
+                         len(failed), len(study_ids), ', '.join(failed))
+        if len(failed) > 0:
+            sys.exit(1)
 
 
     def metadataToSky(self, start=2):
@@ -204,6 +445,7 @@ Available commands:
         else:
             input_format = os.path.splitext(args.metadata_file)[1][1:]
 
+        from .submodules import io
         with open(args.metadata_file, 'r', encoding='utf-8') as outF:
             data = io.read_file_metadata(outF, input_format)
 
@@ -211,6 +453,8 @@ Available commands:
 
 
     def file(self, start=2):
+        from .submodules import io
+
         parser = argparse.ArgumentParser(description=Main.FILE_DESCRIPTION)
         parser.add_argument('-u', '--baseUrl', default=BASE_URL,
                             help=f'The base URL for the PDC API. {BASE_URL} is the default. '
@@ -227,6 +471,14 @@ Available commands:
                                  'being downloaded and overwritten once the download is completed.')
         parser.add_argument('-f', '--force', action='store_true', default=False,
                             help='Re-download even if the target file already exists.')
+        parser.add_argument('--nSegments', dest='n_segments', default=4, type=int,
+                            help='The number of concurrent connections used to download files larger than '
+                                f'{io.SEGMENTED_DOWNLOAD_THRESHOLD // 1024 ** 2} MB. '
+                                 'Set to 1 to always use a single connection. 4 is the default.')
+        _add_store_arg(parser)
+
+        _add_http2_arg(parser)
+        _add_cache_args(parser)
 
         source_args = parser.add_mutually_exclusive_group(required=True)
         source_args.add_argument('--url', help='The file url.')
@@ -239,7 +491,8 @@ Available commands:
         md5sum = args.md5sum
         size = args.size
         if args.file_id is not None:
-            with Client(url=args.baseUrl, timeout=60) as client:
+            with _get_client(args, url=args.baseUrl, timeout=60,
+                             http2=args.http2) as client:
                 file_data = client.get_file_url(args.file_id)
 
             if file_data is None:
@@ -272,12 +525,170 @@ Available commands:
                 old_ofname = ofname
                 ofname += f'_{datetime.now().strftime("%y%m%d_%H%M%S")}.tmp'
 
-        if not io.download_file(url, ofname, expected_md5=md5sum, expected_size=size):
+        if args.n_segments < 1:
+            LOGGER.error('--nSegments must be >= 1')
+            sys.exit(1)
+
+        store = _get_file_store(args)
+        if not io.download_file(url, ofname, expected_md5=md5sum, expected_size=size,
+                                n_segments=args.n_segments, store=store):
             LOGGER.error("Failed to download file: '%s'", ofname)
             sys.exit(1)
 
         if remove_old:
             os.rename(ofname, old_ofname)
+        if store is not None:
+            store.log_stats()
+
+    def files(self, start=2):
+        parser = argparse.ArgumentParser(description=Main.FILES_DESCRIPTION)
+        parser.add_argument('-u', '--baseUrl', default=BASE_URL,
+                            help=f'The base URL for the PDC API. {BASE_URL} is the default.')
+        parser.add_argument('--skipVerify', default=False, action='store_true',
+                            help='Skip ssl verification?')
+        parser.add_argument('-o', '--outputDir', default='.', dest='output_dir',
+                            help='The directory to write the files to. Default is the current directory.')
+        parser.add_argument('-j', '--nJobs', type=int, default=4, dest='n_jobs',
+                            help='The number of files to download concurrently. Default is 4.')
+        parser.add_argument('-n', '--nFiles', type=int, default=None, dest='n_files',
+                            help='The number of files to download. Default is all files in study')
+        parser.add_argument('--s3Path', default=False, action='store_true',
+                            help='Use S3 path instaed of URL for file download.')
+        parser.add_argument('-f', '--force', action='store_true', default=False,
+                            help='Re-download files even if they already exist.')
+        parser.add_argument('--noManifest', default=False, action='store_true', dest='no_manifest',
+                            help="Don't record the state of each download in a manifest in the output directory. "
+                                 'By default, files the manifest records as downloaded are skipped without '
+                                 'checking their md5 sum again if their size and modification time are unchanged.')
+        _add_store_arg(parser)
+        _add_http2_arg(parser)
+        _add_cache_args(parser)
+        parser.add_argument('study_id', help='The study id.')
+        args = parser.parse_args(self.argv[start:])
+
+        if args.n_jobs < 1:
+            LOGGER.error('--nJobs must be >= 1')
+            sys.exit(1)
+
+        from .submodules import io
+        with _get_client(args, url=args.baseUrl, verify=not args.skipVerify, timeout=60,
+                         http2=args.http2) as client:
+            files = client.get_study_raw_files(args.study_id, n_files=args.n_files,
+                                               use_s3_path=args.s3Path)
+            if files is None:
+                LOGGER.error('Could not retrieve files for study: %s', args.study_id)
+                sys.exit(1)
+
+            os.makedirs(args.output_dir, exist_ok=True)
+            manifest = None
+            if not args.no_manifest:
+                from .submodules.manifest import DownloadManifest
+                manifest = DownloadManifest(args.output_dir)
+
+            # skip files which have already been downloaded
+            # io.async_download_files adds the files it downloads to the manifest
+            download = list()
+            verified = list()
+            for file in files:
+                ofname = os.path.join(args.output_dir, file['file_name'])
+                if not args.force:
+                    if manifest is not None and manifest.is_done(file):
+                        continue
+                    if os.path.isfile(ofname) and io.md5_sum(ofname) == file['md5sum']:
+                        verified.append(file)
+                        continue
+                download.append(file)
+            n_skipped = len(files) - len(download)
+            if manifest is not None and verified:
+                manifest.add(verified)
+                for file in verified:
+                    manifest.mark_done(file['file_name'])
+
+            async def refresh_urls(batch):
+                urls = await client.async_get_file_urls(args.study_id, batch)
+                return {file['file_name']: urls[file['file_id']] for file in batch if file['file_id'] in urls}
+
+            # The client stays open during the downloads to refresh signed urls which expire.
+            store = _get_file_store(args)
+            results = client.gather(io.async_download_files(
+                download, output_dir=args.output_dir, n_jobs=args.n_jobs, verify=not args.skipVerify,
+                refresh_urls=None if args.s3Path else refresh_urls, store=store, manifest=manifest))[0]
+        if store is not None:
+            store.log_stats()
+        if manifest is not None:
+            manifest.log_stats()
+            manifest.close()
+
+        failed = [file_name for file_name, success in results.items() if not success]
+        for file_name in failed:
+            LOGGER.error("Failed to download file: '%s'", file_name)
+
+        sys.stdout.write(f'Downloaded {len(results) - len(failed)} of {len(files)} file(s). '
+                         f'{n_skipped} already downloaded, {len(failed)} failed.\n')
+        if len(failed) > 0:
+            sys.exit(1)
+
+
+    def snapshot(self, start=2):
+        parser = argparse.ArgumentParser(description=Main.SNAPSHOT_DESCRIPTION)
+        parser.add_argument('-u', '--baseUrl', default=BASE_URL,
+                            help=f'The base URL for the PDC API. {BASE_URL} is the default.')
+        parser.add_argument('--skipVerify', default=False, action='store_true',
+                            help='Skip ssl verification?')
+        _add_snapshot_dir_arg(parser)
+        _add_http2_arg(parser)
+        _add_cache_args(parser)
+        parser.add_argument('study_ids', nargs='+', metavar='study_id', help='The study id(s).')
+        args = parser.parse_args(self.argv[start:])
+
+        store = _get_snapshot_store(args)
+        from .submodules.snapshot import async_take_snapshot
+        with _get_client(args, url=args.baseUrl, verify=not args.skipVerify, timeout=60,
+                         http2=args.http2) as client:
+            snapshots = client.gather(*[async_take_snapshot(client, study_id)
+                                        for study_id in args.study_ids])
+
+        all_good = True
+        for study_id, snapshot in zip(args.study_ids, snapshots):
+            if snapshot is None:
+                LOGGER.error("Failed to create snapshot for study: '%s'", study_id)
+                all_good = False
+                continue
+            path = store.save(snapshot)
+            sys.stdout.write(f'Saved snapshot of {snapshot["pdc_study_id"]} ({snapshot["study_id"]}) to "{path}"\n')
+
+        if not all_good:
+            sys.exit(1)
+
+
+    def serve(self, start=2):
+        parser = argparse.ArgumentParser(description=Main.SERVE_DESCRIPTION,
+                                         epilog='Other subcommands send their API requests through the server '
+                                                f'when {SERVER_SOCKET_ENV} is set to the server socket. '
+                                                'Files are still downloaded directly.')
+        parser.add_argument('--socket', default=os.environ.get(SERVER_SOCKET_ENV), dest='socket_path',
+                            help='The path of the Unix socket to listen on. '
+                                 f'The default is the value of the {SERVER_SOCKET_ENV} environment variable.')
+        _add_http2_arg(parser)
+        _add_cache_args(parser)
+        _add_concurrency_args(parser)
+        args = parser.parse_args(self.argv[start:])
+
+        if args.socket_path is None:
+            LOGGER.error('A socket path must be specified with --socket or the %s environment variable',
+                         SERVER_SOCKET_ENV)
+            sys.exit(1)
+
+        import asyncio
+        from .submodules.server import ClientServer
+
+        server = ClientServer(args.socket_path, cache=_get_cache(args), limiter=_get_limiter(args),
+                              max_connections=args.max_concurrency, timeout=60, http2=args.http2)
+        sys.stdout.write(f'Serving on socket: "{args.socket_path}"\n')
+        sys.stdout.flush()
+        if not asyncio.run(server.serve()):
+            sys.exit(1)
+
 
 def main():
     _ = Main()
@@ -1,3 +1,12 @@
-from . import api
-from . import io
 
+import importlib
+
+# api and io are imported on first use so that importing a light submodule
+# such as logger or constants does not also import httpx and asyncio.
+_LAZY_SUBMODULES = ('api', 'io')
+
+
+def __getattr__(name):
+    if name in _LAZY_SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
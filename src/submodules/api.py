@@ -1,22 +1,49 @@
 
 import re
+import time
 import asyncio
+import collections
+import contextvars
 from typing import Callable, Optional
 
 from httpx import Limits, AsyncClient
-from httpx import ConnectError, ConnectTimeout
+from httpx import ConnectError, TimeoutException, TransportError
 
+from . import json_codec
 from .logger import LOGGER
+from .cache import ResponseCache
+from .limiter import AdaptiveLimiter, BACKOFF_STATUS_CODES, DEFAULT_INITIAL_LIMIT, DEFAULT_MAX_LIMIT
+from .limiter import parse_retry_after
+from .retry import RetryPolicy, SUCCESS, RETRY, is_dns_error
+from .paging import AdaptivePageSize
+from .memo import QueryMemo
+from .records import FileRecord, AliquotRecord, CaseRecord
+from .constants import CLIENT_TIMEOUT, BASE_URL, FILE_DATA_KEYS, DATA_ID_KEYS
 
-CLIENT_TIMEOUT = 10
-BASE_URL ='https://proteomic.datacommons.cancer.gov/graphql'
+# HTTP status codes returned when a query document is too large for the server
+QUERY_TOO_LARGE_STATUS_CODES = (413, 414, 431)
 
-FILE_DATA_KEYS = ['file_id', 'file_name', 'file_submitter_id', 'md5sum', 'file_size',
-                  'experiment_type', 'analytical_fraction', 'analyte_type',
-                  'data_category', 'file_type', 'file_format', 'url']
+# Maximum number of pages requested ahead of the consumer of a paginated endpoint
+DEFAULT_PREFETCH_PAGES = 8
 
-DATA_ID_KEYS = ["file_id", "file_submitter_id", "aliquot_id",
-                "sample_id", "case_id", "demographic_id"]
+# Response time of the last request sent by the current task
+_REQUEST_LATENCY = contextvars.ContextVar('request_latency', default=None)
+
+
+def http2_available() -> bool:
+    ''' Check whether the h2 package needed for HTTP/2 is installed. '''
+    try:
+        import h2
+    except ImportError:
+        return False
+    return True
+
+
+class QueryTooLargeError(RuntimeError):
+    ''' Raised when the server rejects a query because the document is too large. '''
+
+class PaginatedDataError(RuntimeError):
+    ''' Raised by the aiter_* methods when a page could not be retrieved. '''
 
 class Client():
     '''
@@ -28,11 +55,21 @@ class Client():
         The base URL for the API.
     request_retries: int
         Number of times to retry a request in case of failure.
+    retry_policy: RetryPolicy
+        Backoff and error classification for failed requests.
     client: httpx.AsyncClient
         The HTTP client for making requests.
+    cache: ResponseCache
+        On-disk cache of API responses. None if responses are not cached.
+    limiter: AdaptiveLimiter
+        Adaptive limit on the number of concurrent requests.
+    page_sizes: dict
+        Adaptive page size of each paginated endpoint, keyed by the name of its data.
 
     Methods
     -------
+    gather(*coros, return_exceptions: bool=False) -> list:
+        Runs several async_get_* requests concurrently and returns their results.
     async async_get_study_id(pdc_study_id: str) -> str|None:
         Asynchronously gets the study ID for a given PDC study ID.
     get_study_id(pdc_study_id: str) -> str|None:
@@ -45,15 +82,19 @@ class Client():
         Gets the PDC study ID for a given study ID.
     get_study_name(study_id: str) -> str:
         Gets the study name for a given study ID.
-    async async_get_study_samples(study_id: str, file_ids: Optional[list]=None, page_limit: int=100) -> list:
+    async async_get_study_samples(study_id: str, file_ids: Optional[list]=None, page_limit: int|None=None, file_batch_size: int=25, records: bool=False) -> list:
         Asynchronously gets the samples and aliquots for a study.
     get_study_samples(study_id: str, **kwargs) -> list|None:
         Gets the samples and aliquots for a study.
-    async async_get_study_cases(study_id: str, page_limit: int=100) -> list|None:
+    async aiter_cases_samples_aliquots(study_id: str, page_limit: int|None=None, prefetch: int=8, ordered: bool=True):
+        Asynchronously iterates over the cases for a study with their samples and aliquots.
+    async async_get_study_cases(study_id: str, page_limit: int|None=None, records: bool=False) -> list|None:
         Asynchronously gets the cases for a study.
     get_study_cases(study_id: str, **kwargs) -> list|None:
         Gets the cases for a study.
-    async async_get_study_raw_files(study_id: str, n_files: Optional[int]=None) -> list|None:
+    async aiter_study_cases(study_id: str, page_limit: int|None=None, prefetch: int=8, ordered: bool=True, records: bool=False):
+        Asynchronously iterates over the cases for a study.
+    async async_get_study_raw_files(study_id: str, n_files: Optional[int]=None, records: bool=False) -> list|None:
         Asynchronously gets the raw files for a study.
     get_study_raw_files(study_id: str, **kwargs) -> list|None:
         Gets the raw files for a study.
@@ -61,16 +102,24 @@ class Client():
         Asynchronously gets the URL for a file.
     get_file_url(file_id: str) -> dict|None:
         Gets the URL for a file.
+    async async_get_file_urls(study_id: str, files: list) -> dict:
+        Asynchronously gets new signed URLs for a batch of files in a study.
     '''
 
     def __init__(self,
                  url: str = BASE_URL,
                  timeout: Optional[int]=CLIENT_TIMEOUT,
                  verify: Optional[bool]=True,
-                 max_connections: Optional[int]=5,
-                 max_keepalive_connections: Optional[int]=5,
+                 max_connections: Optional[int]=DEFAULT_MAX_LIMIT,
+                 max_keepalive_connections: Optional[int]=None,
                  keepalive_expiry: Optional[int]=5,
-                 request_retries: Optional[int]=5):
+                 request_retries: Optional[int]=5,
+                 cache: Optional[ResponseCache]=None,
+                 limiter: Optional[AdaptiveLimiter]=None,
+                 retry_policy: Optional[RetryPolicy]=None,
+                 page_sizes: Optional[dict]=None,
+                 memo: Optional[QueryMemo]=None,
+                 http2: bool=False):
         '''
         Parameters
         ----------
@@ -82,17 +131,67 @@ class Client():
             Whether to verify SSL certificates.
         max_connections: int
             The maximum number of connections to allow.
+            Also the maximum concurrency limit of the default limiter.
         max_keepalive_connections: int
-            The maximum number of connections to keep alive.
+            The maximum number of connections to keep alive. If None, max_connections is used.
         keepalive_expiry: int
             The number of seconds to keep a connection alive.
         request_retries: int
             The number of times to retry a request in case of failure.
+        cache: ResponseCache
+            On-disk cache of API responses. If None, responses are not cached.
+        limiter: AdaptiveLimiter
+            Adaptive limit on the number of concurrent requests. If None, a limiter
+            starting at DEFAULT_INITIAL_LIMIT with max_limit=max_connections is used.
+        retry_policy: RetryPolicy
+            Backoff and error classification for failed requests. If None, a policy
+            with max_attempts=request_retries is used.
+        page_sizes: dict
+            Page size of each paginated endpoint when no page_limit is given, keyed
+            by the name of the endpoint's data. Endpoints which are not in the
+            dictionary are given their own AdaptivePageSize with the default bounds.
+            If a cache is used, the page sizes are not adjusted, so that the pages
+            requested, and their cache keys, are the same between runs.
+        memo: QueryMemo
+            In memory store of the responses to this Client's queries. Identical
+            queries in flight at the same time are only sent once. Queries which
+            request signed urls are not memoized because the urls expire. If None,
+            a QueryMemo with the default size is used.
+        http2: bool
+            Use HTTP/2 if the server supports it, so that concurrent requests are
+            multiplexed over a few connections. Servers which do not negotiate HTTP/2
+            are sent HTTP/1.1 requests. Requires the h2 package. If it is not
+            installed, a warning is logged and HTTP/1.1 is used.
         '''
 
         self.url = url
         self.request_retries = request_retries
+        self.retry_policy = RetryPolicy(max_attempts=request_retries) if retry_policy is None else retry_policy
+        self.cache = cache
+        if limiter is None:
+            limiter = AdaptiveLimiter(initial_limit=min(DEFAULT_INITIAL_LIMIT, max_connections),
+                                      max_limit=max_connections)
+        self.limiter = limiter
+        self.page_sizes = dict() if page_sizes is None else page_sizes
+        self.memo = QueryMemo() if memo is None else memo
+        if max_keepalive_connections is None:
+            max_keepalive_connections = max_connections
+        if http2 and not http2_available():
+            LOGGER.warning("HTTP/2 requires the h2 package. Install it with: pip install 'httpx[http2]'. "
+                           "Using HTTP/1.1.")
+            http2 = False
+        self.http2 = http2
+        self.http_versions = collections.Counter()
+
+        self._init_loop()
+        self.client = AsyncClient(limits=Limits(max_connections=max_connections,
+                                                max_keepalive_connections=max_keepalive_connections,
+                                                keepalive_expiry=keepalive_expiry),
+                                  timeout=timeout, verify=verify, http2=http2)
 
+
+    def _init_loop(self) -> None:
+        ''' Use the running event loop, or a new one if there is no running loop. '''
         try:
             self._loop = asyncio.get_running_loop()
             self._initialized_loop = False
@@ -100,11 +199,6 @@ class Client():
             self._loop = asyncio.new_event_loop()
             self._initialized_loop = True
 
-        self.client = AsyncClient(limits=Limits(max_connections=max_connections,
-                                                max_keepalive_connections=max_keepalive_connections,
-                                                keepalive_expiry=keepalive_expiry),
-                                  timeout=timeout, verify=verify)
-
 
     def __del__(self):
         if self._initialized_loop:
@@ -115,7 +209,20 @@ class Client():
         return self
 
 
+    def _log_request_stats(self):
+        LOGGER.info('Request concurrency limit: %i, peak in flight: %i, backoffs: %i',
+                    self.limiter.limit, self.limiter.peak_in_flight, self.limiter.n_backoffs)
+        LOGGER.info('Request retries: %i, time spent backing off: %.1fs, failed requests: %i',
+                    self.retry_policy.n_retries, self.retry_policy.backoff_seconds,
+                    self.retry_policy.n_failures)
+        LOGGER.info('Memoized queries: %i hits, %i misses', self.memo.n_hits, self.memo.n_misses)
+        if self.http_versions:
+            LOGGER.info('Responses by HTTP version: %s',
+                        ', '.join(f'{version}: {n}' for version, n in sorted(self.http_versions.items())))
+
+
     def __exit__(self, exc_type, exc, tb):
+        self._log_request_stats()
         try:
             self._loop.run_until_complete(self.client.aclose())
         except RuntimeError:
@@ -129,6 +236,7 @@ class Client():
 
 
     async def __aexit__(self, exc_type, exc, tb):
+        self._log_request_stats()
         try:
             await self.client.aclose()
         except RuntimeError:
@@ -143,44 +251,137 @@ class Client():
         return closure().__await__()
 
 
-    async def _post(self, query: str) -> dict | None:
-        query = re.sub(r'\s+', ' ', query.strip())
-        for _ in range(self.request_retries):
+    def gather(self, *coros, return_exceptions: bool=False) -> list:
+        '''
+        Run several requests concurrently in a single call to the event loop.
+
+        Example
+        -------
+        >>> with Client() as client:
+        ...     metadata, files = client.gather(client.async_get_study_metadata(study_id=study_id),
+        ...                                      client.async_get_study_raw_files(study_id))
+
+        Parameters
+        ----------
+        coros: coroutine
+            The coroutines to run. Usually calls to the async_get_* methods of this Client.
+        return_exceptions: bool
+            Passed to asyncio.gather. If True, exceptions are returned in the
+            results instead of being raised.
+
+        Returns
+        -------
+        results: list
+            The result of each coroutine in the same order as coros.
+        '''
+        async def closure():
+            return await asyncio.gather(*coros, return_exceptions=return_exceptions)
+        return self._loop.run_until_complete(closure())
+
+
+    def _cache_get(self, query: str) -> dict | None:
+        if self.cache is None:
+            return None
+        return self.cache.get(self.url, query)
+
+
+    def _cache_put(self, query: str, data: dict) -> None:
+        if self.cache is not None and 'errors' not in data:
+            self.cache.put(self.url, query, data)
+
+
+    async def _send(self, send: Callable):
+        ''' Send a request when the limiter allows and report the outcome to the limiter. '''
+        start = await self.limiter.acquire()
+        overloaded = False
+        retry_after = None
+        try:
+            response = await send()
+            _REQUEST_LATENCY.set(time.monotonic() - start)
+            self.http_versions[response.http_version] += 1
+            if response.status_code in BACKOFF_STATUS_CODES:
+                overloaded = True
+                retry_after = parse_retry_after(response.headers.get('retry-after'))
+            return response
+        except TimeoutException:
+            overloaded = True
+            raise
+        finally:
+            await self.limiter.release(start, overloaded=overloaded, retry_after=retry_after)
+
+
+    async def _request(self, send: Callable, query: str, request_url: str) -> dict | None:
+        ''' Send a request with retries and return the response json or None on failure. '''
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            response = None
+            error = None
             try:
-                response = await self.client.post(self.url, json={'query': query})
-                if response.status_code == 200:
-                    return response.json()
-            # if response.status_code >= 400 and response.status_code < 500:
-            #     break
-            except ConnectError:
-                LOGGER.error('Invalid URL: %s', self.url, stacklevel=2)
-                return None
-        LOGGER.error('Error in query:\n\t%s\n\tstatus_code: %s\n\ttext: %s',
-                     query, response.status_code, response.text,
-                     stacklevel=2)
+                response = await self._send(send)
+            except TransportError as e:
+                error = e
+
+            outcome = self.retry_policy.classify(response=response, error=error)
+            if outcome == SUCCESS:
+                data = json_codec.loads(response.content)
+                self._cache_put(query, data)
+                return data
+            if response is not None and response.status_code in QUERY_TOO_LARGE_STATUS_CODES:
+                raise QueryTooLargeError(f'Query rejected with status_code: {response.status_code}')
+
+            if outcome == RETRY:
+                if error is not None:
+                    LOGGER.warning('Request failed: %s: %s', type(error).__name__, request_url, stacklevel=5)
+                retry_after = None if response is None else parse_retry_after(response.headers.get('retry-after'))
+                if await self.retry_policy.backoff(attempt, start, retry_after=retry_after):
+                    continue
+            else:
+                self.retry_policy.n_failures += 1
+            break
+
+        if isinstance(error, ConnectError) and is_dns_error(error):
+            LOGGER.error('Invalid URL: %s', self.url, stacklevel=5)
+        elif error is not None:
+            LOGGER.error('Request failed after %i attempt(s): %s: %s',
+                         attempt, type(error).__name__, request_url, stacklevel=5)
+        else:
+            LOGGER.error('Error in query:\n\t%s\n\tstatus_code: %s\n\ttext: %s',
+                         query, response.status_code, response.text,
+                         stacklevel=5)
         return None
 
 
-    async def _get(self, query) -> dict | None:
+    async def _cached_request(self, send: Callable, query: str, request_url: str) -> dict | None:
+        if (data := self._cache_get(query)) is not None:
+            return data
+        return await self._request(send, query, request_url)
+
+
+    async def _post(self, query: str, use_cache: bool=True) -> dict | None:
+        query = re.sub(r'\s+', ' ', query.strip())
+        def send():
+            return self.client.post(self.url, json={'query': query})
+        if not use_cache:
+            return await self._request(send, query, self.url)
+        if 'signedUrl' in query:
+            # Signed urls expire, so they are not memoized.
+            return await self._cached_request(send, query, self.url)
+        return await self.memo.get(('post', query), lambda: self._cached_request(send, query, self.url))
+
+
+    async def _get(self, query, use_cache: bool=True) -> dict | None:
         query = re.sub(r'\s+', ' ', query.strip())
         query_url = f'{self.url}?{query}'
-        for _ in range(self.request_retries):
-            try:
-                response = await self.client.get(query_url)
-                if response.status_code == 200:
-                    return response.json()
-            # if response.status_code >= 400 and response.status_code < 500:
-            #     break
-            except ConnectError:
-                LOGGER.error('Invalid URL: %s', self.url, stacklevel=2)
-                return None
-            except ConnectTimeout:
-                LOGGER.error('Connection timed out: %s', query_url, stacklevel=2)
-                return None
-        LOGGER.error('Error in query:\n\t%s\n\tstatus_code: %s\n\ttext: %s',
-                     query, response.status_code, response.text,
-                     stacklevel=2)
-        return None
+        def send():
+            return self.client.get(query_url)
+        if not use_cache:
+            return await self._request(send, query, query_url)
+        if 'signedUrl' in query:
+            # Signed urls expire, so they are not memoized.
+            return await self._cached_request(send, query, query_url)
+        return await self.memo.get(('get', query), lambda: self._cached_request(send, query, query_url))
 
 
     @staticmethod
@@ -498,50 +699,109 @@ class Client():
         return self._loop.run_until_complete(self.async_get_experimental_metadata(study_submitter_id))
 
 
-    async def _get_paginated_data(self,
-                                  query_f: Callable[[str, int, int], str],
-                                  data_name: str,
-                                  study_id: str,
-                                  page_limit: int=100) -> list | None:
-
-        endpoint_name = f'paginated{data_name[0].upper()}{data_name[1:]}'
-
-        data = list()
-        query = query_f(study_id, 0, page_limit)
-        first_page = await self._get(query)
-
-        if first_page is None:
-            return None
+    async def _aiter_paginated_data(self,
+                                    query_f: Callable[[str, int, int], str],
+                                    data_name: str,
+                                    study_id: str,
+                                    page_limit: int|None=None,
+                                    prefetch: int=DEFAULT_PREFETCH_PAGES,
+                                    ordered: bool=True):
+        '''
+        Yield the records from each page of a paginated endpoint as the pages arrive.
 
-        if first_page['data'][endpoint_name] is None:
-            LOGGER.error("Invalid query for study_id: '%s'", study_id)
-            return None
+        If page_limit is None, the size of each page is taken from the endpoint's
+        entry in self.page_sizes, which is updated with the response time of each
+        page unless responses are cached.
 
-        total = first_page['data'][endpoint_name]['total']
+        Raises PaginatedDataError if a page could not be retrieved and
+        RuntimeError if the number of records does not match the total
+        reported by the server.
+        '''
+        if prefetch < 1:
+            raise ValueError('prefetch must be >= 1')
 
-        if total <= page_limit:
-            data = first_page['data'][endpoint_name][data_name]
-            if len(data) != total:
-                raise RuntimeError(f"Expected {total} items, but got {len(data)} items.")
-            return data
+        endpoint_name = f'paginated{data_name[0].upper()}{data_name[1:]}'
+        page_size = None
+        if page_limit is None:
+            page_size = self.page_sizes.setdefault(data_name, AdaptivePageSize())
+        # Adjusting the size of cached pages would change their offsets and limits,
+        # so the queries would not match the cached responses in the next run.
+        adapt = page_size is not None and self.cache is None
+
+        def page_records(page):
+            if page is None:
+                raise PaginatedDataError(f"Could not retrieve {data_name} page for study_id: '{study_id}'")
+            if page['data'][endpoint_name] is None:
+                LOGGER.error("Invalid query for study_id: '%s'", study_id)
+                raise PaginatedDataError(f"Invalid query for study_id: '{study_id}'")
+            return page['data'][endpoint_name]
+
+        async def get_page(offset, limit):
+            # Each page is requested in its own task, so the latency recorded
+            # by _send is the latency of this page.
+            _REQUEST_LATENCY.set(None)
+            page = await self._get(query_f(study_id, offset, limit))
+            if adapt:
+                latency = _REQUEST_LATENCY.get()
+                if page is None:
+                    page_size.failed()
+                elif latency is not None and page['data'].get(endpoint_name) is not None:
+                    page_size.update(len(page['data'][endpoint_name][data_name]), latency)
+            return page
+
+        def next_limit():
+            return page_limit if page_size is None else page_size.size
+
+        limit = next_limit()
+        first_page = page_records(await asyncio.create_task(get_page(0, limit)))
+        total = first_page['total']
+        n_records = len(first_page[data_name])
+        for record in first_page[data_name]:
+            yield record
+
+        offset = limit
+        pending = collections.deque()
+
+        def schedule():
+            nonlocal offset
+            while offset < total and len(pending) < prefetch:
+                limit = next_limit()
+                pending.append(asyncio.create_task(get_page(offset, limit)))
+                offset += limit
 
-        offset = page_limit
-        page_tasks = list()
-        async with asyncio.TaskGroup() as tg:
-            while offset < total:
-                page_tasks.append(
-                    tg.create_task(self._get(query_f(study_id, offset, page_limit)))
-                )
-                offset += page_limit
+        try:
+            schedule()
+            while pending:
+                if ordered:
+                    page = await pending.popleft()
+                else:
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    task = next(task for task in pending if task in done)
+                    pending.remove(task)
+                    page = task.result()
+                schedule()
+
+                records = page_records(page)[data_name]
+                n_records += len(records)
+                for record in records:
+                    yield record
+        finally:
+            # stop fetching pages if the consumer stops early or a page fails
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        if n_records != total:
+            raise RuntimeError(f"Expected {total} items, but got {n_records} items.")
 
-        # Flatten pages into 1 list
-        data = list()
-        for page in [first_page] + [task.result() for task in page_tasks]:
-            data += page['data'][endpoint_name][data_name]
 
-        if len(data) != total:
-            raise RuntimeError(f"Expected {total} items, but got {len(data)} items.")
-        return data
+    @staticmethod
+    async def _collect(records) -> list | None:
+        ''' Collect the records yielded by an aiter_* method into a list. '''
+        try:
+            return [record async for record in records]
+        except PaginatedDataError:
+            return None
 
 
     @staticmethod
@@ -560,6 +820,45 @@ class Client():
             } }''' % (study_id, offset, limit)
 
 
+    async def aiter_cases_samples_aliquots(self, study_id: str,
+                                           page_limit: int|None=None,
+                                           prefetch: int=DEFAULT_PREFETCH_PAGES,
+                                           ordered: bool=True):
+        '''
+        Iterate over the cases in a study with their samples and aliquots.
+
+        Cases are yielded as soon as the page containing them arrives, so only
+        about prefetch pages are held in memory at once.
+
+        Parameters
+        ----------
+        study_id: str
+            The study ID.
+        page_limit: int
+            The number of cases in each page. If None, the page size is adjusted
+            to the server response time by Client.page_sizes.
+        prefetch: int
+            The maximum number of pages requested ahead of the consumer.
+        ordered: bool
+            If True, cases are yielded in the order returned by the API.
+            If False, pages are yielded in the order they arrive.
+
+        Yields
+        ------
+        case: dict
+            Metadata for a case with a list of samples, each with a list of aliquots.
+
+        Raises
+        ------
+        PaginatedDataError
+            If a page could not be retrieved.
+        '''
+        async for case in self._aiter_paginated_data(self._case_aliquot_query, 'casesSamplesAliquots',
+                                                     study_id, page_limit=page_limit,
+                                                     prefetch=prefetch, ordered=ordered):
+            yield case
+
+
     @staticmethod
     def _file_aliquot_query(file_id):
         ''' query to get aliquot IDs associated with each file. '''
@@ -569,6 +868,60 @@ class Client():
                 }''' % file_id
 
 
+    @staticmethod
+    def _file_aliquot_batch_query(file_ids):
+        '''
+        query to get aliquot IDs associated with multiple files.
+
+        Each file is queried under the alias f<i> where i is the index of the file_id in file_ids.
+        '''
+        fields = ' '.join('''f%u: fileMetadata (file_id: "%s" acceptDUA: true) {
+                file_id study_run_metadata_id aliquots { aliquot_id } }''' % (i, file_id)
+                          for i, file_id in enumerate(file_ids))
+        return 'query={ %s }' % fields
+
+
+    async def _get_file_aliquot_batch(self, file_ids: list) -> dict:
+        '''
+        Get the fileMetadata aliquot data for a batch of files in a single aliased query.
+
+        If the server rejects the query as too large, the batch is split in half
+        and each half is retried.
+
+        Parameters
+        ----------
+        file_ids: list
+            The file IDs to query.
+
+        Returns
+        -------
+        file_data: dict
+            A dictionary mapping each file_id to its fileMetadata or None if
+            no data could be retrieved for the file.
+        '''
+        try:
+            data = await self._get(self._file_aliquot_batch_query(file_ids))
+        except QueryTooLargeError:
+            if len(file_ids) == 1:
+                LOGGER.error("Query too large for file: '%s'", file_ids[0])
+                return {file_ids[0]: None}
+
+            LOGGER.info('Query for %u files too large. Splitting batch.', len(file_ids))
+            mid = len(file_ids) // 2
+            async with asyncio.TaskGroup() as tg:
+                lhs = tg.create_task(self._get_file_aliquot_batch(file_ids[:mid]))
+                rhs = tg.create_task(self._get_file_aliquot_batch(file_ids[mid:]))
+            return lhs.result() | rhs.result()
+
+        ret = dict()
+        for i, file_id in enumerate(file_ids):
+            if data is None or data.get('data') is None or not data['data'].get(f'f{i}'):
+                ret[file_id] = None
+            else:
+                ret[file_id] = data['data'][f'f{i}'][0]
+        return ret
+
+
     @staticmethod
     def _study_file_id_query(study_id):
         ''' query to get all file_ids in study '''
@@ -580,7 +933,9 @@ class Client():
 
     async def async_get_study_samples(self, study_id: str,
                                       file_ids: Optional[list]=None,
-                                      page_limit: int=100) -> list | None:
+                                      page_limit: int|None=None,
+                                      file_batch_size: int=25,
+                                      records: bool=False) -> list | None:
         '''
         Async version of get_study_samples.
 
@@ -591,7 +946,12 @@ class Client():
         file_ids: list
             A list of file IDs to retreive data for. If None, all the files in the study are used.
         page_limit: int
-            Page size limit passed to _get_paginated_data.
+            The number of cases in each page. If None, the page size is adjusted
+            to the server response time by Client.page_sizes.
+        file_batch_size: int
+            The maximum number of files to get aliquot IDs for in a single query.
+        records: bool
+            If True, each aliquot is an AliquotRecord instead of a dict.
 
         Returns
         -------
@@ -601,8 +961,7 @@ class Client():
         '''
 
         aliquot_task = asyncio.create_task(
-                self._get_paginated_data(self._case_aliquot_query, 'casesSamplesAliquots', study_id,
-                                         page_limit=page_limit)
+                self._collect(self.aiter_cases_samples_aliquots(study_id, page_limit=page_limit))
             )
 
         study_metadata = await self.async_get_study_metadata(study_id=study_id)
@@ -630,12 +989,18 @@ class Client():
             if len(file_ids) != len(set(file_ids)):
                 raise RuntimeError('Duplicate file_ids in study!')
 
+        if file_batch_size < 1:
+            raise ValueError('file_batch_size must be >= 1!')
+
         aliquot_id_tasks = list()
         async with asyncio.TaskGroup() as tg:
-            for file_id in file_ids:
+            for i in range(0, len(file_ids), file_batch_size):
                 aliquot_id_tasks.append(
-                    tg.create_task(self._get(self._file_aliquot_query(file_id)))
+                    tg.create_task(self._get_file_aliquot_batch(file_ids[i:i + file_batch_size]))
                 )
+        file_aliquot_data = dict()
+        for task in aliquot_id_tasks:
+            file_aliquot_data.update(task.result())
 
         # construct dictionary of study_run_metadata_ids mapped to aliquot_run_metadata_ids
         experiment_metadata = await experiment_metadata_task
@@ -653,16 +1018,16 @@ class Client():
 
         # construct dictionary of file_ids mapped to aliquot_run_metadata_ids
         aliquot_id_to_file_arm_id_pairs = dict()
-        for file_id, task in zip(file_ids, aliquot_id_tasks):
-            data = task.result()
-            if data is None or data['data']['fileMetadata'] is None:
+        for file_id in file_ids:
+            data = file_aliquot_data[file_id]
+            if data is None:
                 LOGGER.error("Error getting aliquot_ids for file: '%s'", file_id)
                 continue
-            query_file_id = data['data']['fileMetadata'][0]['file_id']
-            srm_id = data['data']['fileMetadata'][0]['study_run_metadata_id']
+            query_file_id = data['file_id']
+            srm_id = data['study_run_metadata_id']
             assert(file_id == query_file_id)
 
-            for aliquot in data['data']['fileMetadata'][0]['aliquots']:
+            for aliquot in data['aliquots']:
                 if aliquot['aliquot_id'] not in aliquot_id_to_file_arm_id_pairs:
                     aliquot_id_to_file_arm_id_pairs[aliquot['aliquot_id']] = set()
 
@@ -687,18 +1052,24 @@ class Client():
             return None
 
         # flatten aliquots into 1 list
+        # AliquotRecord and dict take the same keyword arguments, so only the requested type is built.
+        make_aliquot = AliquotRecord if records else dict
         aliquots = list()
         for case in aliquot_data:
             for sample in case['samples']:
                 for aliquot in sample['aliquots']:
-                    new_a = {k: aliquot[k] for k in ('aliquot_id', 'aliquot_submitter_id', 'analyte_type')}
-                    new_a.update({k: sample[k] for k in ('sample_id', 'sample_submitter_id',
-                                                         'sample_type', 'tissue_type')})
-                    new_a['case_id'] = case['case_id']
-
                     if aliquot['aliquot_id'] in aliquot_id_to_file_arm_id_pairs:
-                        new_a['file_id_to_aliquot_run_metadata_id'] = aliquot_id_to_file_arm_id_pairs[new_a['aliquot_id']]
-                        aliquots.append(new_a)
+                        aliquots.append(make_aliquot(
+                            aliquot_id=aliquot['aliquot_id'],
+                            aliquot_submitter_id=aliquot['aliquot_submitter_id'],
+                            analyte_type=aliquot['analyte_type'],
+                            sample_id=sample['sample_id'],
+                            sample_submitter_id=sample['sample_submitter_id'],
+                            sample_type=sample['sample_type'],
+                            tissue_type=sample['tissue_type'],
+                            case_id=case['case_id'],
+                            file_id_to_aliquot_run_metadata_id=aliquot_id_to_file_arm_id_pairs[aliquot['aliquot_id']]
+                        ))
 
         return aliquots
 
@@ -737,8 +1108,57 @@ class Client():
         } }''' % (study_id, offset, limit)
 
 
+    async def aiter_study_cases(self, study_id: str,
+                                page_limit: int|None=None,
+                                prefetch: int=DEFAULT_PREFETCH_PAGES,
+                                ordered: bool=True,
+                                records: bool=False):
+        '''
+        Iterate over the cases in a study.
+
+        Cases are yielded as soon as the page containing them arrives, so only
+        about prefetch pages are held in memory at once.
+
+        Parameters
+        ----------
+        study_id: str
+            The study id.
+        page_limit: int
+            The number of cases in each page. If None, the page size is adjusted
+            to the server response time by Client.page_sizes.
+        prefetch: int
+            The maximum number of pages requested ahead of the consumer.
+        ordered: bool
+            If True, cases are yielded in the order returned by the API.
+            If False, pages are yielded in the order they arrive.
+        records: bool
+            If True, each case is a CaseRecord instead of a dict.
+
+        Yields
+        ------
+        case: dict
+            The same case metadata as each element of the list returned by get_study_cases.
+
+        Raises
+        ------
+        PaginatedDataError
+            If a page could not be retrieved.
+        '''
+        async for case in self._aiter_paginated_data(self._study_case_query, 'caseDemographicsPerStudy',
+                                                     study_id, page_limit=page_limit,
+                                                     prefetch=prefetch, ordered=ordered):
+            if len(case['demographics']) > 1:
+                LOGGER.warning('Incorrect number of demographics in case %s', case["case_id"])
+            demographics = case['demographics'][0]
+            if records:
+                yield CaseRecord(case_id=case['case_id'], **demographics)
+            else:
+                yield {**demographics, 'case_id': case['case_id']}
+
+
     async def async_get_study_cases(self, study_id: str,
-                                    page_limit: int=100) -> list|None:
+                                    page_limit: int|None=None,
+                                    records: bool=False) -> list|None:
         '''
         Async versio of get_study_cases.
 
@@ -747,7 +1167,10 @@ class Client():
         study_id: str
             The study id.
         page_limit: int
-            Page limit passed to _get_paginated_data.
+            The number of cases in each page. If None, the page size is adjusted
+            to the server response time by Client.page_sizes.
+        records: bool
+            If True, each case is a CaseRecord instead of a dict.
 
         Returns
         -------
@@ -756,22 +1179,8 @@ class Client():
             or None if no cases could be found for study_id.
         '''
 
-        data = await self._get_paginated_data(self._study_case_query, 'caseDemographicsPerStudy', study_id,
-                                              page_limit=page_limit)
-
-        if data is None:
-            return None
-
-        cases = list()
-        for case in data:
-            if len(case['demographics']) > 1:
-                LOGGER.warning('Incorrect number of demographics in case %s', case["case_id"])
-            new_case = case['demographics'][0]
-            new_case['case_id'] = case['case_id']
-
-            cases.append(new_case)
-
-        return cases
+        return await self._collect(self.aiter_study_cases(study_id, page_limit=page_limit,
+                                                          records=records))
 
 
     def get_study_cases(self, study_id: str, **kwargs) -> list|None:
@@ -806,7 +1215,8 @@ class Client():
 
     async def async_get_study_raw_files(self, study_id: str,
                                         use_s3_path: bool=False,
-                                        n_files: Optional[int]=None) -> list|None:
+                                        n_files: Optional[int]=None,
+                                        records: bool=False) -> list|None:
         '''
         Async versio of get_study_raw_files
 
@@ -818,6 +1228,8 @@ class Client():
             If True, use the S3 path for the file URL. If False, use the signed URL.
         n_files: int
             Limit metadata to n files. If None metadata is returned for all files.
+        records: bool
+            If True, each file is a FileRecord instead of a dict.
 
         Returns
         -------
@@ -842,17 +1254,20 @@ class Client():
         data = list()
         for file in payload['data']['filesPerStudy']:
             if file['data_category'] == 'Raw Mass Spectra':
-                new_file = {k: file[k] for k in keys}
-
                 if use_s3_path:
-                    new_file['url'] = f"s3://pdcdatastore/{file['file_location']}"
+                    url = f"s3://pdcdatastore/{file['file_location']}"
                 else:
-                    new_file['url'] = file['signedUrl']['url']
+                    url = file['signedUrl']['url']
 
-                data.append(new_file)
+                if records:
+                    data.append(FileRecord(*[file[k] for k in keys], url))
+                else:
+                    row = {k: file[k] for k in keys}
+                    row['url'] = url
+                    data.append(row)
 
         if n_files is not None:
-            return data[:n_files]
+            data = data[:n_files]
 
         return data
 
@@ -877,6 +1292,69 @@ class Client():
         return self._loop.run_until_complete(self.async_get_study_raw_files(study_id, **kwargs))
 
 
+    @staticmethod
+    def _file_url_batch_query(study_id, files):
+        '''
+        query to get the signed urls of multiple files in a study.
+
+        Each file is queried under the alias f<i> where i is the index of the file in files.
+        '''
+        fields = ' '.join('''f%u: filesPerStudy (study_id: "%s" file_name: "%s" data_category: "%s"
+                acceptDUA: true) { file_id signedUrl { url } }''' % (i, study_id, file['file_name'],
+                                                                   file['data_category'])
+                          for i, file in enumerate(files))
+        return 'query { %s }' % fields
+
+
+    async def async_get_file_urls(self, study_id: str, files: list) -> dict:
+        '''
+        Get new signed urls for a batch of files in a study in a single aliased query.
+
+        Signed urls expire, so the query is always sent to the server instead of
+        being answered from the memo or the response cache. If the server rejects
+        the query as too large, the batch is split in half and each half is retried.
+
+        Parameters
+        ----------
+        study_id: str
+            The study id.
+        files: list
+            File metadata dictionaries with 'file_id', 'file_name' and
+            'data_category' keys as returned by get_study_raw_files.
+
+        Returns
+        -------
+        urls: dict
+            A dictionary mapping file_id to the signed url of each file a url could be found for.
+        '''
+        try:
+            payload = await self._post(self._file_url_batch_query(study_id, files), use_cache=False)
+        except QueryTooLargeError:
+            if len(files) == 1:
+                LOGGER.error("Query too large for file: '%s'", files[0]['file_id'])
+                return {}
+
+            LOGGER.info('Query for %u files too large. Splitting batch.', len(files))
+            mid = len(files) // 2
+            async with asyncio.TaskGroup() as tg:
+                lhs = tg.create_task(self.async_get_file_urls(study_id, files[:mid]))
+                rhs = tg.create_task(self.async_get_file_urls(study_id, files[mid:]))
+            return lhs.result() | rhs.result()
+
+        if payload is None:
+            return {}
+        if 'errors' in payload:
+            self._log_post_errors(payload['errors'])
+
+        data = payload.get('data') or {}
+        urls = dict()
+        for i, file in enumerate(files):
+            for match in data.get(f'f{i}') or []:
+                if match['file_id'] == file['file_id'] and match['signedUrl'] is not None:
+                    urls[file['file_id']] = match['signedUrl']['url']
+        return urls
+
+
     @staticmethod
     def _file_metadata_query(file_id):
         return '''query={
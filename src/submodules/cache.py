@@ -0,0 +1,213 @@
+
+import os
+import re
+import time
+from hashlib import sha256
+from tempfile import NamedTemporaryFile
+
+from . import json_codec
+from .logger import LOGGER
+
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+# Time to live in seconds for each API endpoint.
+ENDPOINT_TTLS = {'studyCatalog': 24 * 60 * 60,
+                 'study': DEFAULT_TTL,
+                 'experimentalMetadata': DEFAULT_TTL,
+                 'fileMetadata': DEFAULT_TTL,
+                 'filesPerStudy': DEFAULT_TTL,
+                 'paginatedCasesSamplesAliquots': DEFAULT_TTL,
+                 'paginatedCaseDemographicsPerStudy': DEFAULT_TTL}
+
+# Signed URLs expire so queries which request them are not cached by default.
+SIGNED_URL_TTL = 0
+
+ENDPOINT_RE = re.compile(r'(?:\w+\s*:\s*)?(\w+)\s*\(')
+CACHE_FILE_EXT = '.json'
+
+
+def query_endpoint(query: str) -> str|None:
+    ''' Get the name of the first endpoint in a GraphQL query. '''
+    match = ENDPOINT_RE.search(query)
+    return None if match is None else match.group(1)
+
+
+class ResponseCache():
+    '''
+    Persistent on-disk cache of API responses.
+
+    Each response is stored in a separate file named by the hash of the base URL
+    and the normalized query text. Entries expire after a per-endpoint time to live
+    and the least recently used entries are evicted once the total size of the
+    cache exceeds max_bytes.
+
+    Attributes
+    ----------
+    cache_dir: str
+        The cache directory.
+    max_bytes: int
+        The maximum total size of the cache files.
+    ttls: dict
+        The time to live in seconds for each endpoint.
+    signed_url_ttl: int
+        The time to live for queries which request a signed URL.
+    hits: int
+        The number of cache hits.
+    misses: int
+        The number of cache misses.
+    '''
+
+    def __init__(self, cache_dir: str,
+                 max_bytes: int=DEFAULT_MAX_BYTES,
+                 ttls: dict|None=None,
+                 default_ttl: int=DEFAULT_TTL,
+                 signed_url_ttl: int=SIGNED_URL_TTL):
+        '''
+        Parameters
+        ----------
+        cache_dir: str
+            The cache directory. It is created if it does not already exist.
+        max_bytes: int
+            The maximum total size of the cache files.
+        ttls: dict
+            Time to live in seconds for each endpoint. Endpoints not in ttls use the
+            values in ENDPOINT_TTLS and then default_ttl.
+        default_ttl: int
+            The time to live for endpoints not in ttls or ENDPOINT_TTLS.
+        signed_url_ttl: int
+            The time to live for queries which request a signed URL. 0 to never cache them.
+        '''
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttls = ENDPOINT_TTLS | (ttls or {})
+        self.default_ttl = default_ttl
+        self.signed_url_ttl = signed_url_ttl
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+
+    def _entries(self):
+        ''' Yield (path, size, last_used) for each file in the cache. '''
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(CACHE_FILE_EXT):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+
+    def _path(self, url: str, query: str) -> str:
+        key = sha256(f'{url}\n{query}'.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{key}{CACHE_FILE_EXT}')
+
+
+    def ttl(self, query: str) -> int:
+        ''' Get the time to live in seconds for a query. '''
+        if 'signedUrl' in query:
+            return self.signed_url_ttl
+        return self.ttls.get(query_endpoint(query), self.default_ttl)
+
+
+    def get(self, url: str, query: str) -> dict|None:
+        '''
+        Get a cached response.
+
+        Parameters
+        ----------
+        url: str
+            The base URL for the API.
+        query: str
+            The normalized query text.
+
+        Returns
+        -------
+        data: dict
+            The cached response or None if the query is not in the cache or has expired.
+        '''
+        ttl = self.ttl(query)
+        path = self._path(url, query)
+        if ttl <= 0 or not os.path.isfile(path):
+            self.misses += 1
+            return None
+
+        try:
+            with open(path, 'rb') as inF:
+                entry = json_codec.loads(inF.read())
+        except (OSError, ValueError):
+            LOGGER.warning('Removing unreadable cache file: %s', path)
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        if time.time() - entry['created'] > ttl:
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        # update last used time for LRU eviction
+        os.utime(path)
+        self.hits += 1
+        return entry['data']
+
+
+    def put(self, url: str, query: str, data: dict) -> None:
+        '''
+        Add a response to the cache.
+
+        Parameters
+        ----------
+        url: str
+            The base URL for the API.
+        query: str
+            The normalized query text.
+        data: dict
+            The response data.
+        '''
+        if self.ttl(query) <= 0:
+            return
+
+        path = self._path(url, query)
+        old_size = os.path.getsize(path) if os.path.isfile(path) else 0
+        with NamedTemporaryFile('w', encoding='utf-8', dir=self.cache_dir,
+                                suffix='.tmp', delete=False) as outF:
+            outF.write(json_codec.dumps({'created': time.time(), 'url': url, 'query': query, 'data': data}))
+        os.replace(outF.name, path)
+
+        self._size += os.path.getsize(path) - old_size
+        if self._size > self.max_bytes:
+            self.evict()
+
+
+    def _remove(self, path: str) -> None:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._size -= size
+        except FileNotFoundError:
+            pass
+
+
+    def evict(self) -> None:
+        ''' Remove the least recently used entries until the cache is smaller than max_bytes. '''
+        entries = sorted(self._entries(), key=lambda x: x[2])
+        self._size = sum(size for _, size, _ in entries)
+        for path, _, _ in entries:
+            if self._size <= self.max_bytes:
+                break
+            self._remove(path)
+
+
+    def clear(self) -> None:
+        ''' Remove all entries from the cache. '''
+        for path, _, _ in list(self._entries()):
+            self._remove(path)
+        self._size = 0
+
+
+    @property
+    def size(self) -> int:
+        ''' The total size of the cache files in bytes. '''
+        return self._size
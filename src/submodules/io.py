@@ -1,20 +1,49 @@
 
 import os
 import json
+import sys
 from csv import DictReader
 from hashlib import md5
 import re
+import time
+import calendar
 import warnings
-from typing import TextIO
-import subprocess
-
-import httpx
-
-from .api import FILE_DATA_KEYS, DATA_ID_KEYS
+from urllib.parse import urlsplit, parse_qsl
+from typing import Awaitable, Callable, Optional, TextIO, Iterable, Iterator, TYPE_CHECKING
+
+# httpx, asyncio and subprocess are only imported by the functions which download
+# files, so reading and writing metadata files does not pay for importing them.
+if TYPE_CHECKING:
+    import httpx
+    from .store import FileStore
+    from .manifest import DownloadManifest
+
+from .constants import FILE_DATA_KEYS, DATA_ID_KEYS
+from .records import Record
+from . import json_codec
 from .logger import LOGGER
 
 RAW_BASENAME_RE = re.compile(r'/([^/]+\.raw)')
 FILE_EXT_RE = re.compile(r'^([\w\-%& \\\/=\+]+)\.(.*)$')
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-\d+/(\d+|\*)$')
+
+DOWNLOAD_CHUNK_SIZE = 8192
+# Number of bytes between syncing partial downloads to disk
+CHECKPOINT_BYTES = 64 * 1024 ** 2
+# Files smaller than this are downloaded over a single connection
+SEGMENTED_DOWNLOAD_THRESHOLD = 256 * 1024 ** 2
+SEGMENT_CHUNK_SIZE = 1024 ** 2
+# Signed urls which expire within this many seconds are refreshed before they are used
+URL_EXPIRY_MARGIN = 300
+# Maximum number of signed urls refreshed in a single query
+URL_REFRESH_BATCH_SIZE = 100
+
+# Columns written as integers and as dictionary encoded strings in parquet and arrow files
+INTEGER_COLUMNS = ('file_size', 'year_of_birth', 'year_of_death')
+CATEGORICAL_COLUMNS = ('experiment_type', 'analytical_fraction', 'data_category', 'file_type',
+                       'file_format', 'analyte_type', 'sample_type', 'tissue_type',
+                       'ethnicity', 'gender', 'race', 'cause_of_death', 'vital_status')
+COLUMNAR_COMPRESSION = 'zstd'
 
 
 def normalize_fname(s: str) -> str:
@@ -45,55 +74,77 @@ def flatten_metadata(study_metadata, files, aliquots, cases):
     '''
     Flatten aliquot and case metadata into a single dict for each file.
 
+    The input dicts are not modified.
+
     Parameters:
         study_metadata (dict): The study metadata.
-        files (list): List of file metadata.
-        aliquots (list): List of aliquot metadata.
-        cases (list): List of case metadata.
+        files (list): List of file metadata dicts or FileRecords.
+        aliquots (list): List of aliquot metadata dicts or AliquotRecords.
+        cases (list): List of case metadata dicts or CaseRecords.
 
     Returns:
         data (list): List of dictionaries with the flattened metadata for each file.
     '''
+    return list(iter_flatten_metadata(study_metadata, files, aliquots, cases))
 
-    file_ids_to_arm_ids = {}
+
+def iter_flatten_metadata(study_metadata, files, aliquots, cases) -> Iterator[dict]:
+    '''
+    Iterator version of flatten_metadata which yields one flattened dict per file.
+
+    The aliquot and case indexes are built before the first row is yielded, so
+    duplicate aliquot file_ids are reported before anything is written.
+    '''
+
+    # index aliquots by file_id
+    file_id_to_aliquot = {}
+    duplicate_file_id = False
     for aliquot in aliquots:
-        for file_id, arm_id in aliquot['file_id_to_aliquot_run_metadata_id'].items():
-            if file_id not in file_ids_to_arm_ids:
-                file_ids_to_arm_ids[file_id] = []
-            file_ids_to_arm_ids[file_id].append(arm_id)
+        for file_id in aliquot['file_id_to_aliquot_run_metadata_id']:
+            if file_id in file_id_to_aliquot:
+                duplicate_file_id = True
+            else:
+                file_id_to_aliquot[file_id] = aliquot
 
-    if any(len(v) > 1 for v in file_ids_to_arm_ids.values()):
+    if duplicate_file_id:
         raise ValueError('Cannot flatten aliquots with more than 1 file_id.')
 
-    ret = []
+    # index cases by case_id. If a case_id is duplicated the first case is used.
+    case_id_to_case = {}
+    for case in cases:
+        case_id_to_case.setdefault(case['case_id'], case)
+
+    return _flat_rows(study_metadata, files, file_id_to_aliquot, case_id_to_case)
+
+
+def _flat_rows(study_metadata, files, file_id_to_aliquot, case_id_to_case):
     for file in files:
-        ret.append(file)
-        ret[-1]['experiment_type'] = study_metadata['experiment_type']
-        ret[-1]['analytical_fraction'] = study_metadata['analytical_fraction']
+        row = file.to_dict() if isinstance(file, Record) else dict(file)
+        row['experiment_type'] = study_metadata['experiment_type']
+        row['analytical_fraction'] = study_metadata['analytical_fraction']
 
         # add aliquot metadata
         file_id = file['file_id']
-        aliquot_data = next((a for a in aliquots if file_id in a['file_id_to_aliquot_run_metadata_id']), None)
+        aliquot_data = file_id_to_aliquot.get(file_id)
         if aliquot_data is None:
             raise ValueError(f'No aliquot data found for file_id: {file_id}')
 
         arm_id = aliquot_data['file_id_to_aliquot_run_metadata_id'].get(file_id)
         if arm_id is None:
             raise ValueError(f'No aliquot_run_metadata_id found for file_id: {file_id}')
-        ret[-1]['aliquot_run_metadata_id'] = arm_id
+        row['aliquot_run_metadata_id'] = arm_id
 
         for k, v in aliquot_data.items():
             if k != 'file_id_to_aliquot_run_metadata_id':
-                ret[-1][k] = v
+                row[k] = v
 
         # add case metadata
-        case_data = next((c for c in cases if c['case_id'] == aliquot_data['case_id']), None)
+        case_data = case_id_to_case.get(aliquot_data['case_id'])
         if case_data is None:
             raise ValueError(f'No case data found for file_id: {file_id}')
-        for k, v in case_data.items():
-            ret[-1][k] = v
+        row.update(case_data)
 
-    return ret
+        yield row
 
 
 def is_dia(study_metadata):
@@ -108,45 +159,201 @@ def is_dia(study_metadata):
     return experiment_type.lower() == 'label free'
 
 
-def write_metadata_file(data: dict|list, ofname: str, format: str='json'):
+def _check_keys(rows: Iterable[dict|Record]) -> Iterator[dict]:
     '''
-    Write metadata file.
+    Yield rows, raising KeyError if a row does not have the same keys as the first.
+    Records are converted to dicts one at a time as they are written.
+    '''
+    keys = None
+    for row in rows:
+        if isinstance(row, Record):
+            row = row.to_dict()
+        if keys is None:
+            keys = row.keys()
+        elif keys != row.keys():
+            raise KeyError('File dict keys must be identical!')
+        yield row
+
+
+def _write_json_rows(rows: Iterable[dict], ostream: TextIO):
+    ''' Write rows as a json array with the same layout as json.dump(list(rows), indent=2). '''
+    first = True
+    for row in rows:
+        ostream.write('[\n  ' if first else ',\n  ')
+        ostream.write(json_codec.dumps(row, pretty=True).replace('\n', '\n  '))
+        first = False
+    ostream.write('[]' if first else '\n]')
+
+
+def _write_jsonl_rows(rows: Iterable[dict], ostream: TextIO):
+    for row in rows:
+        ostream.write(json_codec.dumps(row))
+        ostream.write('\n')
+
+
+def _write_tsv_rows(rows: Iterable[dict], ostream: TextIO):
+    ''' Write rows with one write per row. Values are not quoted, the same as _write_row. '''
+    first = True
+    for row in rows:
+        if first:
+            ostream.write('\t'.join(row.keys()) + '\n')
+            first = False
+        ostream.write('\t'.join('' if value is None else str(value) for value in row.values()) + '\n')
+
+
+ROW_WRITERS = {'json': _write_json_rows,
+               'str': _write_json_rows,
+               'jsonl': _write_jsonl_rows,
+               'tsv': _write_tsv_rows}
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("The 'pyarrow' package is required for parquet and arrow output. "
+                          "Install it with: pip install pyarrow") from None
+    return pyarrow
+
+
+def pyarrow_available() -> bool:
+    ''' Check whether the parquet and arrow output formats can be used. '''
+    try:
+        _import_pyarrow()
+    except ImportError:
+        return False
+    return True
+
+
+def _arrow_array(pa, name: str, values: list):
+    if name in INTEGER_COLUMNS:
+        try:
+            return pa.array([None if v is None or v == '' else int(v) for v in values], type=pa.int64())
+        except (ValueError, TypeError):
+            pass  # leave columns with non numeric values as strings
+
+    if any(isinstance(v, dict) for v in values):
+        return pa.array([None if v is None else list(v.items()) for v in values],
+                        type=pa.map_(pa.string(), pa.string()))
+
+    try:
+        array = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        array = pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+    if name in CATEGORICAL_COLUMNS and pa.types.is_string(array.type):
+        array = array.dictionary_encode()
+    return array
+
+
+def _arrow_table(rows: Iterable[dict]):
+    '''
+    Build a pyarrow Table from rows.
+
+    Values are copied into columns as the rows are read, so only the columns are
+    held in memory.
+    '''
+    pa = _import_pyarrow()
+    columns = None
+    for row in rows:
+        if columns is None:
+            columns = {key: [] for key in row.keys()}
+        for key, value in row.items():
+            columns[key].append(value)
+
+    if columns is None:
+        return pa.table({})
+    return pa.table({name: _arrow_array(pa, name, values) for name, values in columns.items()})
+
+
+def _write_parquet(table, ofname: str):
+    import pyarrow.parquet
+    pyarrow.parquet.write_table(table, ofname, compression=COLUMNAR_COMPRESSION)
+
+
+def _write_arrow(table, ofname: str):
+    import pyarrow.feather
+    pyarrow.feather.write_feather(table, ofname, compression=COLUMNAR_COMPRESSION)
+
+
+COLUMNAR_WRITERS = {'parquet': _write_parquet,
+                    'arrow': _write_arrow}
+
+
+def write_metadata_rows(rows: Iterable[dict], ofname: str, format: str='json'):
+    '''
+    Write metadata rows as they are generated.
+
+    rows can be any iterable of dicts or records, so the complete table never has
+    to be held in memory. The keys of each row are checked against the first row as it is
+    written. If an error occurs the partially written file is removed.
+
+    The "parquet" and "arrow" formats are columnar, so the values are collected into
+    typed columns before the file is written. INTEGER_COLUMNS are written as integers
+    and CATEGORICAL_COLUMNS are dictionary encoded. These formats require pyarrow.
 
     Parameters:
-        data (dict|list): The metadata to write.
-            If a dict, the metadata is written as a single json object.
-        ofname (str): Output file name.
-        format (str): Output file format. One of ["json", "tsv", "str"]
+        rows (Iterable): The rows to write. Every row must have the same keys.
+        ofname (str): Output file name. Ignored if format is "str".
+        format (str): Output file format. One of ["json", "jsonl", "tsv", "str", "parquet", "arrow"]
 
     Raises:
         ValueError: If unknown output file format.
+        KeyError: If the rows do not all have the same keys.
+        ImportError: If the format is "parquet" or "arrow" and pyarrow is not installed.
     '''
+    if format in COLUMNAR_WRITERS:
+        table = _arrow_table(_check_keys(rows))
+        try:
+            COLUMNAR_WRITERS[format](table, ofname)
+        except BaseException:
+            if os.path.isfile(ofname):
+                os.remove(ofname)
+            raise
+        return
 
-    if isinstance(data, dict):
-        with open(ofname, 'w', encoding='utf-8') as outF:
-            json.dump(data, outF, indent=2)
+    if format not in ROW_WRITERS:
+        raise ValueError(f'{format} is an unknown output format!')
+
+    if format == 'str':
+        _write_json_rows(_check_keys(rows), sys.stdout)
+        sys.stdout.write('\n')
         return
 
-    # make sure all the keys are the same
-    keys = data[0].keys()
-    for file in data:
-        if keys != file.keys():
-            raise KeyError('File dict keys must be identical!')
+    try:
+        with open(ofname, 'w', encoding='utf-8', newline='') as outF:
+            ROW_WRITERS[format](_check_keys(rows), outF)
+    except BaseException:
+        if os.path.isfile(ofname):
+            os.remove(ofname)
+        raise
 
-    if format in ('json', 'str'):
-        if format == 'json':
-            with open(ofname, 'w', encoding='utf-8') as outF:
-                json.dump(data, outF, indent=2)
-        else:
-            print(json.dumps(data, indent=2))
 
-    elif format == 'tsv':
+def write_metadata_file(data: dict|Iterable[dict], ofname: str, format: str='json'):
+    '''
+    Write metadata file.
+
+    Parameters:
+        data (dict|Iterable): The metadata to write.
+            If a dict, the metadata is written as a single json object,
+            or a table with one row for the "parquet" and "arrow" formats.
+            Otherwise the rows are streamed with write_metadata_rows.
+        ofname (str): Output file name.
+        format (str): Output file format. One of ["json", "jsonl", "tsv", "str", "parquet", "arrow"]
+
+    Raises:
+        ValueError: If unknown output file format.
+    '''
+
+    if isinstance(data, dict) and format not in COLUMNAR_WRITERS:
         with open(ofname, 'w', encoding='utf-8') as outF:
-            _write_row(keys, outF, sep='\t')
-            for file in data:
-                _write_row([file[key] for key in keys], outF, sep='\t')
-    else:
-        raise ValueError(f'{format} is an unknown output format!')
+            if format == 'jsonl':
+                outF.write(json_codec.dumps(data) + '\n')
+            else:
+                outF.write(json_codec.dumps(data, pretty=True))
+        return
+
+    write_metadata_rows([data] if isinstance(data, dict) else data, ofname, format=format)
 
 
 def read_file_metadata(fp: TextIO, format: str) -> list:
@@ -166,7 +373,7 @@ def read_file_metadata(fp: TextIO, format: str) -> list:
     if format == 'tsv':
         return list(DictReader(fp, delimiter='\t'))
     if format == 'json':
-        return json.load(fp)
+        return json_codec.loads(fp.read())
     raise RuntimeError(f"Unknown metadata format!: '{format}'")
 
 
@@ -218,31 +425,566 @@ def file_basename(url):
     return None if not match else match.group(1)
 
 
-def http_get(url: str, ofname: str, n_retries: int=2) -> bool:
+class UrlForbiddenError(RuntimeError):
+    ''' The server refused a download with status 403, usually because a signed url expired. '''
+
+
+def url_expiry(url: str) -> float|None:
+    '''
+    Get the time a signed url expires.
+
+    AWS signature version 4 urls (X-Amz-Date and X-Amz-Expires query parameters)
+    and urls with an Expires query parameter in seconds since the epoch are recognized.
+
+    Parameters:
+        url (str): The url.
+
+    Returns:
+        expiry (float): The expiry time in seconds since the epoch. None if url is not a signed url.
+    '''
+    params = {k.lower(): v for k, v in parse_qsl(urlsplit(url).query)}
+    try:
+        if 'x-amz-date' in params and 'x-amz-expires' in params:
+            signed = calendar.timegm(time.strptime(params['x-amz-date'], '%Y%m%dT%H%M%SZ'))
+            return signed + int(params['x-amz-expires'])
+        if 'expires' in params:
+            return float(params['expires'])
+    except ValueError:
+        LOGGER.warning('Could not parse expiry time of signed url.')
+    return None
+
+
+def url_expires_soon(url: str, margin: float=URL_EXPIRY_MARGIN) -> bool:
+    ''' Check whether a signed url has expired or expires in the next margin seconds. '''
+    expiry = url_expiry(url)
+    return expiry is not None and expiry - time.time() < margin
+
+
+class PartialDownload():
+    '''
+    State of a resumable http download.
+
+    Data is written to <ofname>.part and the number of bytes written and the server's
+    validator (ETag or Last-Modified) are recorded in the sidecar <ofname>.part.json.
+    An interrupted download is resumed with a Range request. If the server does not
+    return the requested range the download restarts from byte 0.
+
+    The md5 state of the bytes already written can not be serialized, so it is
+    rebuilt by reading the .part file when a download is resumed.
+    '''
+
+    def __init__(self, ofname: str):
+        self.ofname = ofname
+        self.part_path = f'{ofname}.part'
+        self.state_path = f'{ofname}.part.json'
+        self.offset = 0
+        self.validator = None
+        self.file_hash = md5()
+        self._outF = None
+        self._last_checkpoint = 0
+        self._load()
+
+
+    def _load(self):
+        if not (os.path.isfile(self.part_path) and os.path.isfile(self.state_path)):
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as inF:
+                state = json.load(inF)
+            offset = min(int(state['bytes']), os.path.getsize(self.part_path))
+            validator = state['validator']
+        except (OSError, ValueError, KeyError, TypeError):
+            LOGGER.warning('Ignoring invalid partial download state "%s"', self.state_path)
+            return
+        if validator is None:
+            return
+
+        with open(self.part_path, 'rb') as inF:
+            remaining = offset
+            while remaining > 0 and (chunk := inF.read(min(DOWNLOAD_CHUNK_SIZE, remaining))):
+                self.file_hash.update(chunk)
+                remaining -= len(chunk)
+        self.offset = offset - remaining
+        self.validator = validator
+
+
+    def _save(self):
+        with open(self.state_path, 'w', encoding='utf-8') as outF:
+            json.dump({'bytes': self.offset, 'validator': self.validator}, outF)
+
+
+    @staticmethod
+    def resumable(ofname: str) -> bool:
+        ''' Check whether there is an interrupted single stream download of ofname which can be resumed. '''
+        try:
+            with open(f'{ofname}.part.json', 'r', encoding='utf-8') as inF:
+                state = json.load(inF)
+            return os.path.isfile(f'{ofname}.part') and \
+                int(state['bytes']) > 0 and state['validator'] is not None
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+
+
+    def headers(self) -> dict:
+        ''' Get the request headers needed to resume the download. '''
+        if self.offset == 0:
+            return {}
+        LOGGER.info('Resuming download of "%s" at byte %i', self.ofname, self.offset)
+        return {'Range': f'bytes={self.offset}-', 'If-Range': self.validator}
+
+
+    def reset(self):
+        ''' Discard any partially downloaded data. '''
+        self.stop()
+        for path in (self.part_path, self.state_path):
+            if os.path.isfile(path):
+                os.remove(path)
+        self.offset = 0
+        self.validator = None
+        self.file_hash = md5()
+
+
+    def start(self, response: 'httpx.Response'):
+        ''' Open the .part file to write the response body. '''
+        if self.offset > 0:
+            match = CONTENT_RANGE_RE.search(response.headers.get('content-range', ''))
+            if response.status_code != 206 or match is None or int(match.group(1)) != self.offset:
+                LOGGER.warning('Server did not resume download of "%s". Restarting from byte 0.', self.ofname)
+                self.offset = 0
+                self.file_hash = md5()
+
+        if self.offset == 0:
+            self.validator = response.headers.get('etag') or response.headers.get('last-modified')
+
+        self._outF = open(self.part_path, 'r+b' if self.offset > 0 else 'wb')
+        self._outF.seek(self.offset)
+        self._outF.truncate()
+        self._last_checkpoint = self.offset
+        self._save()
+
+
+    def write(self, chunk: bytes):
+        ''' Write a chunk to the .part file. '''
+        self._outF.write(chunk)
+        self.file_hash.update(chunk)
+        self.offset += len(chunk)
+        if self.offset - self._last_checkpoint >= CHECKPOINT_BYTES:
+            self._checkpoint()
+
+
+    def _checkpoint(self):
+        self._outF.flush()
+        os.fsync(self._outF.fileno())
+        self._last_checkpoint = self.offset
+        self._save()
+
+
+    def stop(self):
+        ''' Close the .part file so the download can be resumed later. '''
+        if self._outF is not None:
+            self._checkpoint()
+            self._outF.close()
+            self._outF = None
+
+
+    def finish(self) -> tuple:
+        '''
+        Move the completed .part file to ofname.
+
+        Returns:
+            digest (tuple): The (md5 sum, size) of the downloaded file.
+        '''
+        if self._outF is not None:
+            self._outF.close()
+            self._outF = None
+        os.replace(self.part_path, self.ofname)
+        if os.path.isfile(self.state_path):
+            os.remove(self.state_path)
+        return self.file_hash.hexdigest(), self.offset
+
+
+def _forbidden(error: Exception) -> bool:
+    import httpx
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 403
+
+
+def _download_failed(download: PartialDownload, error: Exception, tries: int, n_retries: int):
+    import httpx
+
+    if isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 416:
+        # The saved offset is not valid for the file on the server.
+        download.reset()
+    else:
+        download.stop()
+    LOGGER.warning('Failed to download file "%s" because "%s"', download.ofname, error)
+    LOGGER.warning('Retry %i of %i', tries + 1, n_retries)
+
+
+def http_get(url: str, ofname: str, n_retries: int=2) -> tuple|None:
+    '''
+    Download a file over http(s).
+
+    The md5 sum and size of the file are computed as it is written. The file is
+    written to <ofname>.part and moved to ofname once the download is complete.
+    Interrupted downloads are resumed where they stopped if the server supports
+    Range requests.
+
+    Parameters:
+        url (str): The file url.
+        ofname (str): The name of the file to write.
+        n_retries (int): The number of times to try the download.
+
+    Returns:
+        digest (tuple): The (md5 sum, size) of the downloaded file. None if the download failed.
+    '''
+    import httpx
+
+    download = PartialDownload(ofname)
     tries = 0
     while tries < n_retries:
         tries += 1
         try:
-            with httpx.stream("GET", url) as response:
+            with httpx.stream("GET", url, headers=download.headers()) as response:
                 response.raise_for_status()
-                with open(ofname, 'wb') as outF:
-                    for chunk in response.iter_bytes(chunk_size=8192):
-                        outF.write(chunk)
-        except (httpx.TimeoutException, httpx.RequestError) as e:
-            LOGGER.warning('Failed to download file "%s" because "%s"', ofname, e)
-            LOGGER.warning('Retry %i of %i', tries + 1, n_retries)
+                download.start(response)
+                for chunk in response.iter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    download.write(chunk)
+        except (httpx.TimeoutException, httpx.RequestError, httpx.HTTPStatusError) as e:
+            if _forbidden(e):
+                download.stop()
+                LOGGER.error('Download of file "%s" was forbidden. The url may have expired.', ofname)
+                return None
+            _download_failed(download, e, tries, n_retries)
+            continue
+
+        return download.finish()
+
+    LOGGER.error('Failed to download file "%s" after %d attempt(s)', ofname, n_retries)
+    return None
+
+
+async def async_http_get(client: 'httpx.AsyncClient', url: str, ofname: str,
+                         n_retries: int=2) -> tuple|None:
+    '''
+    Async version of http_get using a shared httpx.AsyncClient.
+
+    Raises UrlForbiddenError instead of returning None if the server responds
+    with status 403, so the caller can get a new url and resume the download.
+    '''
+    import httpx
+
+    download = PartialDownload(ofname)
+    tries = 0
+    while tries < n_retries:
+        tries += 1
+        try:
+            async with client.stream("GET", url, headers=download.headers()) as response:
+                response.raise_for_status()
+                download.start(response)
+                async for chunk in response.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    download.write(chunk)
+        except (httpx.TimeoutException, httpx.RequestError, httpx.HTTPStatusError) as e:
+            if _forbidden(e):
+                download.stop()
+                raise UrlForbiddenError(f'Download of file "{ofname}" was forbidden') from e
+            _download_failed(download, e, tries, n_retries)
             continue
-        except (httpx.HTTPStatusError) as e:
-            LOGGER.warning('Failed to download file "%s" because "%s"', ofname, e)
+
+        return download.finish()
+
+    LOGGER.error('Failed to download file "%s" after %d attempt(s)', ofname, n_retries)
+    return None
+
+
+def http_range_size(url: str) -> int|None:
+    '''
+    Get the size of a file if the server supports Range requests.
+
+    A single byte GET is used instead of HEAD because signed URLs are only
+    valid for GET requests.
+
+    Parameters:
+        url (str): The file url.
+
+    Returns:
+        size (int): The file size. None if the server does not support Range requests.
+    '''
+    import httpx
+
+    try:
+        with httpx.stream("GET", url, headers={'Range': 'bytes=0-0'}) as response:
+            response.raise_for_status()
+            match = CONTENT_RANGE_RE.search(response.headers.get('content-range', ''))
+    except (httpx.TimeoutException, httpx.RequestError, httpx.HTTPStatusError) as e:
+        LOGGER.warning('Failed to get size of "%s" because "%s"', url, e)
+        return None
+
+    if response.status_code != 206 or match is None or match.group(2) == '*':
+        return None
+    return int(match.group(2))
+
+
+def _segment_ranges(size: int, n_segments: int) -> list:
+    ''' Split [0, size) into n_segments (start, end) ranges with inclusive ends. '''
+    n_segments = max(1, min(n_segments, size))
+    segment_size = -(-size // n_segments)
+    return [(start, min(start + segment_size, size) - 1)
+            for start in range(0, size, segment_size)]
+
+
+class SegmentedDownload():
+    '''
+    State of a resumable segmented http download.
+
+    The file is preallocated as <ofname>.part and each segment is written in place
+    with os.pwrite. The byte ranges which are finished, the file size and the server's
+    validator (ETag or Last-Modified) are recorded in the sidecar <ofname>.part.json.
+    An interrupted download only requests the byte ranges which are not finished.
+    If the validator changes, the file changed on the server and the download restarts.
+    '''
+
+    def __init__(self, ofname: str, size: int):
+        self.ofname = ofname
+        self.part_path = f'{ofname}.part'
+        self.state_path = f'{ofname}.part.json'
+        self.size = size
+        self.validator = None
+        self.changed = False
+        # [start, end] of the bytes written by each segment, updated in place as they are written.
+        self._ranges = []
+        self._fd = None
+        self._unsynced = 0
+        self._load()
+
+
+    def _load(self):
+        if not (os.path.isfile(self.part_path) and os.path.isfile(self.state_path)):
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as inF:
+                state = json.load(inF)
+            if 'ranges' not in state:
+                # state of a single stream download
+                return
+            ranges = [[int(start), int(end)] for start, end in state['ranges']]
+            validator = state['validator']
+            size = int(state['size'])
+        except (OSError, ValueError, KeyError, TypeError):
+            LOGGER.warning('Ignoring invalid partial download state "%s"', self.state_path)
+            return
+        if validator is None or size != self.size or os.path.getsize(self.part_path) != self.size:
+            return
+
+        self._ranges = [[start, end] for start, end in ranges if 0 <= start <= end < self.size]
+        self.validator = validator
+
+
+    def _finished(self) -> list:
+        ''' Get the sorted and merged [start, end] ranges of bytes written. '''
+        merged = []
+        for start, end in sorted((start, end) for start, end in self._ranges if end >= start):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+
+    def missing(self, n_segments: int) -> list:
+        ''' Split the bytes which are not finished into (start, end) ranges for about n_segments connections. '''
+        gaps = []
+        pos = 0
+        for start, end in self._finished():
+            if start > pos:
+                gaps.append((pos, start - 1))
+            pos = end + 1
+        if pos < self.size:
+            gaps.append((pos, self.size - 1))
+        if len(gaps) == 0:
+            return []
+
+        segment_size = -(-sum(end + 1 - start for start, end in gaps) // max(1, n_segments))
+        return [(start + seg_start, start + seg_end) for start, end in gaps
+                for seg_start, seg_end in _segment_ranges(end + 1 - start, -(-(end + 1 - start) // segment_size))]
+
+
+    def open(self):
+        ''' Open the .part file. It is preallocated unless the download is being resumed. '''
+        resume = len(self._ranges) > 0
+        self._fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT | (0 if resume else os.O_TRUNC), 0o644)
+        if resume:
+            LOGGER.info('Resuming segmented download of "%s" with %i of %i bytes finished', self.ofname,
+                        sum(end + 1 - start for start, end in self._finished()), self.size)
+            return
+        try:
+            os.posix_fallocate(self._fd, 0, self.size)
+        except (AttributeError, OSError):
+            os.ftruncate(self._fd, self.size)
+        # Replace any state from an interrupted single stream download.
+        self._save()
+
+
+    def segment(self, start: int) -> list:
+        ''' Start recording the [start, end] range of bytes written by a segment. '''
+        written = [start, start - 1]
+        self._ranges.append(written)
+        return written
+
+
+    def check_validator(self, response: 'httpx.Response') -> bool:
+        ''' Check that the file did not change on the server since the download started. '''
+        validator = response.headers.get('etag') or response.headers.get('last-modified')
+        if self.validator is None:
+            self.validator = validator
+        elif validator is not None and validator != self.validator and not self.changed:
+            LOGGER.warning('File "%s" changed on the server. The download will restart.', self.ofname)
+            self.changed = True
+        return not self.changed
+
+
+    def write(self, written: list, chunk: bytes):
+        ''' Write a chunk after the bytes already written by a segment. '''
+        os.pwrite(self._fd, chunk, written[1] + 1)
+        written[1] += len(chunk)
+        self._unsynced += len(chunk)
+        if self._unsynced >= CHECKPOINT_BYTES:
+            self._checkpoint()
+
+
+    def _save(self):
+        with open(self.state_path, 'w', encoding='utf-8') as outF:
+            json.dump({'size': self.size, 'validator': self.validator,
+                       'ranges': self._finished()}, outF)
+
+
+    def _checkpoint(self):
+        os.fsync(self._fd)
+        self._unsynced = 0
+        self._save()
+
+
+    def stop(self):
+        ''' Close the .part file so the download can be resumed later. '''
+        if self._fd is not None:
+            try:
+                self._checkpoint()
+            finally:
+                os.close(self._fd)
+                self._fd = None
+
+
+    def reset(self):
+        ''' Discard any partially downloaded data. '''
+        self.stop()
+        for path in (self.part_path, self.state_path):
+            if os.path.isfile(path):
+                os.remove(path)
+        self._ranges = []
+        self.validator = None
+        self.changed = False
+
+
+    def finish(self):
+        ''' Move the completed .part file to ofname. '''
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._fd = None
+        os.replace(self.part_path, self.ofname)
+        if os.path.isfile(self.state_path):
+            os.remove(self.state_path)
+
+
+async def _download_segment(client: 'httpx.AsyncClient', url: str, download: SegmentedDownload,
+                            start: int, end: int, n_retries: int) -> bool:
+    import httpx
+
+    written = download.segment(start)
+    tries = 0
+    while tries < n_retries:
+        tries += 1
+        pos = written[1] + 1
+        headers = {'Range': f'bytes={pos}-{end}'}
+        if download.validator is not None:
+            headers['If-Range'] = download.validator
+        try:
+            async with client.stream("GET", url, headers=headers) as response:
+                response.raise_for_status()
+                if not download.check_validator(response):
+                    return False
+                match = CONTENT_RANGE_RE.search(response.headers.get('content-range', ''))
+                if response.status_code != 206 or match is None or int(match.group(1)) != pos:
+                    LOGGER.error('Server did not return byte range %i-%i', pos, end)
+                    return False
+                async for chunk in response.aiter_bytes(chunk_size=SEGMENT_CHUNK_SIZE):
+                    download.write(written, chunk[:end - written[1]])
+        except (httpx.TimeoutException, httpx.RequestError, httpx.HTTPStatusError) as e:
+            LOGGER.warning('Failed to download byte range %i-%i because "%s"', written[1] + 1, end, e)
             LOGGER.warning('Retry %i of %i', tries + 1, n_retries)
             continue
 
-        return True
+        if written[1] >= end:
+            return True
+        LOGGER.warning('Download of byte range %i-%i ended early', written[1] + 1, end)
 
+    return False
+
+
+async def async_segmented_http_get(url: str, ofname: str, size: int,
+                                   n_segments: int=4, n_retries: int=2) -> bool:
+    '''
+    Download a file over http(s) as n_segments byte ranges on concurrent connections.
+
+    The file is preallocated as <ofname>.part and each segment is written in
+    place with os.pwrite. The .part file is moved to ofname once every segment
+    has been downloaded. A failed segment is retried from the last byte written.
+    If the download fails, the .part file and the finished byte ranges are kept
+    so the next attempt only downloads the ranges which are not finished.
+
+    Parameters:
+        url (str): The file url.
+        ofname (str): The name of the file to write.
+        size (int): The file size.
+        n_segments (int): The number of byte ranges to download concurrently.
+        n_retries (int): The number of times to try each segment.
+
+    Returns:
+        sucess (bool): True if sucessfull, False if not.
+    '''
+    import asyncio
+    import httpx
+
+    download = SegmentedDownload(ofname, size)
+    success = False
+    try:
+        download.open()
+        limits = httpx.Limits(max_connections=n_segments, max_keepalive_connections=n_segments)
+        async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+            results = await asyncio.gather(*[_download_segment(client, url, download, start, end, n_retries)
+                                             for start, end in download.missing(n_segments)])
+        success = all(results)
+    except OSError as e:
+        LOGGER.error('Failed to write file "%s" because "%s"', download.part_path, e)
+    finally:
+        if not success:
+            download.stop()
+
+    if success:
+        download.finish()
+        return True
+    if download.changed:
+        download.reset()
     LOGGER.error('Failed to download file "%s" after %d attempt(s)', ofname, n_retries)
     return False
 
 
+def segmented_http_get(url: str, ofname: str, size: int,
+                       n_segments: int=4, n_retries: int=2) -> bool:
+    ''' Sync wrapper around async_segmented_http_get. '''
+    import asyncio
+    return asyncio.run(async_segmented_http_get(url, ofname, size,
+                                                n_segments=n_segments, n_retries=n_retries))
+
+
 def s3_get(path: str, ofname: str, aws_profile: str|None = None) -> bool:
     '''
     Download a file from S3.
@@ -255,6 +997,7 @@ def s3_get(path: str, ofname: str, aws_profile: str|None = None) -> bool:
     Returns:
         sucess (bool): True if sucessfull, False if not.
     '''
+    import subprocess
 
     cmd = ["aws", "s3"]
     if aws_profile:
@@ -275,46 +1018,301 @@ def s3_get(path: str, ofname: str, aws_profile: str|None = None) -> bool:
     return True
 
 
+def verify_file(ofname: str, expected_md5: str=None, expected_size: int=None,
+                md5sum: str=None, size: int=None) -> bool:
+    '''
+    Check the md5 sum and size of a downloaded file.
+
+    Parameters:
+        ofname (str): The file name.
+        expected_md5 (str): Expected md5 sum. None to skip checksum.
+        expected_size (int): Expected file size. None to skip size check.
+        md5sum (str): The md5 sum of the file if it is already known.
+            If None, it is computed by reading the file.
+        size (int): The size of the file if it is already known.
+
+    Returns:
+        sucess (bool): True if the file matches, False if not.
+    '''
+    if expected_md5 is None:
+        LOGGER.warning('Skipping md5 check for file "%s"', ofname)
+    elif (md5sum if md5sum is not None else md5_sum(ofname)) != expected_md5:
+        LOGGER.error('Expected MD5 checksum does not match for file "%s"', ofname)
+        return False
+
+    if expected_size is None:
+        LOGGER.warning('Skipping size check for file "%s"', ofname)
+    elif (size if size is not None else os.path.getsize(ofname)) != expected_size:
+        LOGGER.error('Expected file size does not match for file "%s"', ofname)
+        return False
+    return True
+
+
 def download_file(url: str, ofname: str,
                   expected_md5: str=None, expected_size: int=None,
-                  n_retries:int=2) -> bool:
+                  n_retries:int=2, n_segments: int=1,
+                  store: 'FileStore|None'=None) -> bool:
     '''
     Download a single file.
 
     The expected md5 sum is checked against the downloaded file and the
     download is retried up to n times if it does not match.
 
+    If n_segments > 1 and the file is at least SEGMENTED_DOWNLOAD_THRESHOLD bytes,
+    http(s) files are downloaded as n_segments byte ranges over concurrent
+    connections. Smaller files and servers without Range support use a single stream.
+
+    If a store is given and a file with expected_md5 is in it, the file is
+    materialized from the store instead of being downloaded. Downloaded files
+    which match expected_md5 are added to the store.
+
     Parameters:
         url (str): The file url.
         ofname (str): The name of the file to write.
         expected_md5 (str): Expected md5 sum. None to skip checksum.
         expected_size (int): Expected file size. None to skip size check.
         n_retrys (int): defaults to 5.
+        n_segments (int): The number of concurrent connections for large files.
+        store (FileStore): Content addressed store of downloaded files. None to always download.
 
     Returns:
         sucess (bool): True if sucessfull, False if not.
     '''
+    if store is not None and expected_md5 is not None and \
+       store.materialize(expected_md5, ofname, size=expected_size):
+        return True
+
     protocol = url.split(':')[0]
 
     if protocol in ('http', 'https'):
-        if not http_get(url, ofname, n_retries):
-            return False
+        size = None
+        # An interrupted single stream download is resumed instead of being restarted in segments.
+        if n_segments > 1 and (expected_size is None or expected_size >= SEGMENTED_DOWNLOAD_THRESHOLD) \
+           and not PartialDownload.resumable(ofname):
+            size = http_range_size(url)
+
+        if size is not None and size >= SEGMENTED_DOWNLOAD_THRESHOLD:
+            # Segments are written out of order so the md5 sum is computed after the download.
+            if not segmented_http_get(url, ofname, size, n_segments=n_segments, n_retries=n_retries):
+                return False
+            md5sum, size = None, None
+        else:
+            if (digest := http_get(url, ofname, n_retries)) is None:
+                return False
+            md5sum, size = digest
     elif protocol == 's3':
         if not s3_get(url, ofname):
             return False
+        md5sum, size = None, None
     else:
         LOGGER.error('Unknown protocol "%s" for file "%s"', protocol, ofname)
         return False
 
-    if expected_md5 is None:
-        LOGGER.warning('Skipping md5 check for file "%s"', ofname)
-    elif md5_sum(ofname) != expected_md5:
-        LOGGER.error('Expected MD5 checksum does not match for file "%s"', ofname)
+    if not verify_file(ofname, expected_md5=expected_md5, expected_size=expected_size,
+                       md5sum=md5sum, size=size):
         return False
+    if store is not None and expected_md5 is not None:
+        store.add(ofname, expected_md5)
+    return True
 
-    if expected_size is None:
-        LOGGER.warning('Skipping size check for file "%s"', ofname)
-    elif os.path.getsize(ofname) != expected_size:
-        LOGGER.error('Expected file size does not match for file "%s"', ofname)
+
+async def async_download_file(client: 'httpx.AsyncClient', url: str, ofname: str,
+                              expected_md5: str=None, expected_size: int=None,
+                              n_retries: int=2, store: 'FileStore|None'=None) -> bool:
+    '''
+    Async version of download_file using a shared httpx.AsyncClient.
+
+    Raises UrlForbiddenError if the server responds to an http(s) url with status 403.
+
+    Parameters:
+        client (httpx.AsyncClient): The client to download http(s) urls with.
+        url (str): The file url.
+        ofname (str): The name of the file to write.
+        expected_md5 (str): Expected md5 sum. None to skip checksum.
+        expected_size (int): Expected file size. None to skip size check.
+        n_retries (int): defaults to 2.
+        store (FileStore): Content addressed store of downloaded files. None to always download.
+
+    Returns:
+        sucess (bool): True if sucessfull, False if not.
+    '''
+    import asyncio
+
+    use_store = store is not None and expected_md5 is not None
+    if use_store and await asyncio.to_thread(store.materialize, expected_md5, ofname, size=expected_size):
+        return True
+
+    protocol = url.split(':')[0]
+
+    if protocol in ('http', 'https'):
+        if (digest := await async_http_get(client, url, ofname, n_retries)) is None:
+            return False
+        success = verify_file(ofname, expected_md5=expected_md5, expected_size=expected_size,
+                              md5sum=digest[0], size=digest[1])
+    elif protocol == 's3':
+        if not await asyncio.to_thread(s3_get, url, ofname):
+            return False
+        success = await asyncio.to_thread(verify_file, ofname,
+                                          expected_md5=expected_md5, expected_size=expected_size)
+    else:
+        LOGGER.error('Unknown protocol "%s" for file "%s"', protocol, ofname)
+        return False
+
+    if success and use_store:
+        await asyncio.to_thread(store.add, ofname, expected_md5)
+    return success
+
+
+async def async_download_files(files: list, output_dir: str='.',
+                               n_jobs: int=4, n_retries: int=2,
+                               timeout: int=60, verify: bool=True,
+                               refresh_urls: Optional[Callable[[list], Awaitable[dict]]]=None,
+                               store: 'FileStore|None'=None,
+                               manifest: 'DownloadManifest|None'=None) -> dict:
+    '''
+    Async version of download_files.
+
+    Signed urls can expire before the file is downloaded when there are many files.
+    If refresh_urls is given, a url which expires within URL_EXPIRY_MARGIN seconds
+    is refreshed just before the file is downloaded, along with the urls of the
+    files waiting to be downloaded which also expire soon. If the server responds
+    with status 403, the url of the file and every file waiting to be downloaded
+    which was not already refreshed are refreshed and the download is resumed once.
+
+    Parameters:
+        files (list): List of file metadata dictionaries with 'file_name',
+            'url', 'md5sum' and 'file_size' keys.
+        output_dir (str): The directory to write the files to.
+        n_jobs (int): The maximum number of files to download concurrently.
+        n_retries (int): The number of times to retry each download.
+        timeout (int): The http timeout in seconds.
+        verify (bool): Whether to verify SSL certificates.
+        refresh_urls (Callable): Coroutine function which gets new urls for a list
+            of files. Returns a dictionary mapping file_name to the new url of each
+            file a url was found for. If None, urls are not refreshed.
+        store (FileStore): Content addressed store of downloaded files. Files with an md5sum
+            in the store are materialized from it instead of being downloaded.
+        manifest (DownloadManifest): Record of the state of each download in output_dir.
+            The files are added to it and each file is marked in-progress when its
+            download starts and done or failed when it finishes. The manifest is
+            updated in a worker thread so its commits and syncs do not block the
+            event loop. None to not record them.
+
+    Returns:
+        results (dict): A dictionary mapping each file_name to True if the
+            file was sucessfully downloaded, False if not.
+    '''
+    import asyncio
+    import httpx
+
+    if n_jobs < 1:
+        raise ValueError('n_jobs must be >= 1!')
+
+    if manifest is not None:
+        await asyncio.to_thread(manifest.add, files)
+
+    semaphore = asyncio.Semaphore(n_jobs)
+    refresh_lock = asyncio.Lock()
+    urls = {file['file_name']: file['url'] for file in files}
+    waiting = set(urls)
+    refreshed = set()
+
+    async def refresh(file, old_url, forbidden):
+        async with refresh_lock:
+            if urls[file['file_name']] != old_url:
+                # another download already refreshed this url
+                return True
+
+            batch = [file]
+            for other in files:
+                if len(batch) >= URL_REFRESH_BATCH_SIZE:
+                    break
+                name = other['file_name']
+                if name in waiting and (url_expires_soon(urls[name]) or
+                                        (forbidden and name not in refreshed)):
+                    batch.append(other)
+
+            new_urls = await refresh_urls(batch)
+            for other in batch:
+                if (url := new_urls.get(other['file_name'])) is not None:
+                    urls[other['file_name']] = url
+                    refreshed.add(other['file_name'])
+            LOGGER.info('Refreshed %i of %i signed url(s)', len(new_urls), len(batch))
+            return file['file_name'] in new_urls
+
+    async def fetch(client, file):
+        name = file['file_name']
+        waiting.discard(name)
+        ofname = os.path.join(output_dir, name)
+        expected_size = None if file.get('file_size') is None else int(file['file_size'])
+
+        # The store is checked once here, before any url is refreshed, so
+        # async_download_file is not given the store to check it again.
+        use_store = store is not None and file.get('md5sum') is not None
+        if use_store and await asyncio.to_thread(store.materialize, file['md5sum'], ofname, size=expected_size):
+            return True
+
+        if refresh_urls is not None and url_expires_soon(urls[name]):
+            await refresh(file, urls[name], forbidden=False)
+
+        for attempt in range(2):
+            url = urls[name]
+            try:
+                success = await async_download_file(client, url, ofname,
+                                                    expected_md5=file.get('md5sum'),
+                                                    expected_size=expected_size,
+                                                    n_retries=n_retries)
+                if success and use_store:
+                    await asyncio.to_thread(store.add, ofname, file['md5sum'])
+                return success
+            except UrlForbiddenError:
+                if refresh_urls is None or attempt > 0:
+                    break
+                LOGGER.warning('Download of file "%s" was forbidden. Refreshing signed url.', ofname)
+                if not await refresh(file, url, forbidden=True):
+                    break
+
+        LOGGER.error('Download of file "%s" was forbidden. The url may have expired.', ofname)
         return False
-    return True
\ No newline at end of file
+
+    async def download(client, file):
+        async with semaphore:
+            if manifest is None:
+                return await fetch(client, file)
+            await asyncio.to_thread(manifest.start, file['file_name'])
+            success = False
+            try:
+                success = await fetch(client, file)
+            finally:
+                await asyncio.to_thread(manifest.finish, file['file_name'], success)
+            return success
+
+    limits = httpx.Limits(max_connections=n_jobs, max_keepalive_connections=n_jobs)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout, verify=verify) as client:
+        tasks = list()
+        async with asyncio.TaskGroup() as tg:
+            for file in files:
+                tasks.append(tg.create_task(download(client, file)))
+
+    return {file['file_name']: task.result() for file, task in zip(files, tasks)}
+
+
+def download_files(files: list, output_dir: str='.', **kwargs) -> dict:
+    '''
+    Concurrently download a list of files.
+
+    Each file is checked against its expected md5 sum and size as in download_file.
+
+    Parameters:
+        files (list): List of file metadata dictionaries with 'file_name',
+            'url', 'md5sum' and 'file_size' keys.
+        output_dir (str): The directory to write the files to.
+        kwargs (dict): Additional kwargs passed to async_download_files.
+
+    Returns:
+        results (dict): A dictionary mapping each file_name to True if the
+            file was sucessfully downloaded, False if not.
+    '''
+    import asyncio
+
+    return asyncio.run(async_download_files(files, output_dir=output_dir, **kwargs))
@@ -0,0 +1,198 @@
+
+import re
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# In order of preference
+BACKENDS = ('orjson', 'msgspec', 'json')
+
+_NON_ASCII_RE = re.compile('[\x7f-\U0010ffff]')
+_SCALAR_TYPES = (str, int, bool, type(None))
+
+
+def _floats_match_stdlib(obj) -> bool:
+    '''
+    Check that every float in obj is formatted the same by orjson and json.
+
+    They only differ for floats which repr() writes in exponent notation,
+    and for NaN and infinity.
+    '''
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        t = type(o)
+        if t is dict:
+            stack.extend(o.values())
+        elif t is list or t is tuple:
+            stack.extend(o)
+        elif t is float:
+            if not (1e-4 <= abs(o) < 1e16 or o == 0):
+                return False
+        elif t not in _SCALAR_TYPES:
+            if isinstance(o, dict):
+                stack.extend(o.values())
+            elif isinstance(o, (list, tuple)):
+                stack.extend(o)
+            elif isinstance(o, float):
+                stack.append(float(o))
+    return True
+
+
+def _escape_non_ascii(text: str) -> str:
+    ''' Escape characters the same way as json.dumps(ensure_ascii=True). '''
+    def escape(match):
+        n = ord(match.group(0))
+        if n < 0x10000:
+            return f'\\u{n:04x}'
+        n -= 0x10000
+        return f'\\u{0xd800 | (n >> 10):04x}\\u{0xdc00 | (n & 0x3ff):04x}'
+    return _NON_ASCII_RE.sub(escape, text)
+
+
+class JsonCodec():
+    '''
+    JSON encoding and decoding with the stdlib json module.
+
+    Subclasses use a faster backend, falling back to the stdlib for anything
+    the backend can not encode identically.
+
+    Attributes
+    ----------
+    name: str
+        The backend name.
+    '''
+
+    name = 'json'
+
+    def loads(self, data: bytes|str):
+        '''
+        Decode a json document.
+
+        Raises
+        ------
+        ValueError
+            If data is not valid json.
+        '''
+        return json.loads(data)
+
+
+    def dumps(self, obj, pretty: bool=False) -> str:
+        '''
+        Encode obj as json.
+
+        Parameters
+        ----------
+        obj: Any
+            The object to encode.
+        pretty: bool
+            If True, the output is identical to json.dumps(obj, indent=2) for every
+            backend. Otherwise the output is compact and non-ASCII characters are not
+            escaped, but the exact formatting of floats depends on the backend.
+        '''
+        if pretty:
+            return json.dumps(obj, indent=2)
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+class OrjsonCodec(JsonCodec):
+    ''' JSON codec using orjson. '''
+
+    name = 'orjson'
+
+    def loads(self, data: bytes|str):
+        return orjson.loads(data)
+
+
+    def dumps(self, obj, pretty: bool=False) -> str:
+        if pretty and not _floats_match_stdlib(obj):
+            return super().dumps(obj, pretty=True)
+        try:
+            if not pretty:
+                return orjson.dumps(obj).decode('utf-8')
+            text = orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode('utf-8')
+        except orjson.JSONEncodeError:
+            # non-str keys, integers larger than 64 bits, etc.
+            return super().dumps(obj, pretty=pretty)
+
+        if not text.isascii() or '\x7f' in text:
+            text = _escape_non_ascii(text)
+        return text
+
+
+class MsgspecCodec(JsonCodec):
+    ''' JSON codec using msgspec. Pretty output uses the stdlib. '''
+
+    name = 'msgspec'
+
+    def loads(self, data: bytes|str):
+        try:
+            return msgspec.json.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+
+    def dumps(self, obj, pretty: bool=False) -> str:
+        if not pretty:
+            try:
+                return msgspec.json.encode(obj).decode('utf-8')
+            except (msgspec.EncodeError, TypeError):
+                pass
+        return super().dumps(obj, pretty=pretty)
+
+
+_CODECS = {'orjson': (OrjsonCodec, orjson),
+           'msgspec': (MsgspecCodec, msgspec),
+           'json': (JsonCodec, json)}
+
+
+def available_backends() -> list:
+    ''' Get the names of the installed backends in order of preference. '''
+    return [name for name in BACKENDS if _CODECS[name][1] is not None]
+
+
+def get_codec(backend: str|None=None) -> JsonCodec:
+    '''
+    Get a JSON codec.
+
+    Parameters
+    ----------
+    backend: str
+        One of BACKENDS. If None, the first installed backend is used.
+
+    Raises
+    ------
+    ValueError
+        If backend is unknown.
+    ImportError
+        If backend is not installed.
+    '''
+    if backend is None:
+        backend = available_backends()[0]
+    if backend not in _CODECS:
+        raise ValueError(f"Unknown JSON backend: '{backend}'")
+    codec, module = _CODECS[backend]
+    if module is None:
+        raise ImportError(f"JSON backend '{backend}' is not installed.")
+    return codec()
+
+
+CODEC = get_codec()
+
+
+def loads(data: bytes|str):
+    ''' Decode a json document with the default codec. '''
+    return CODEC.loads(data)
+
+
+def dumps(obj, pretty: bool=False) -> str:
+    ''' Encode obj as json with the default codec. '''
+    return CODEC.dumps(obj, pretty=pretty)
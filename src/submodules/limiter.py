@@ -0,0 +1,176 @@
+
+import time
+import asyncio
+from email.utils import parsedate_to_datetime
+
+# HTTP status codes which indicate the server is overloaded
+BACKOFF_STATUS_CODES = (429, 500, 502, 503, 504)
+
+DEFAULT_INITIAL_LIMIT = 5
+DEFAULT_MAX_LIMIT = 20
+
+
+def parse_retry_after(value: str|None) -> float|None:
+    '''
+    Parse the value of a Retry-After header.
+
+    Parameters
+    ----------
+    value: str
+        Either a number of seconds or an HTTP date.
+
+    Returns
+    -------
+    seconds: float
+        The number of seconds to wait or None if value could not be parsed.
+    '''
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter():
+    '''
+    Additive increase / multiplicative decrease (AIMD) limit on concurrent requests.
+
+    The limit grows by about 1 each time a full window of requests completes
+    without the latency rising above latency_tolerance times the lowest latency
+    seen. It is multiplied by decrease when the server responds with 429 or a
+    5xx status, or a request times out. Only requests started after the last
+    decrease can trigger another, so a burst of failures from one window only
+    shrinks the limit once. If the server sends Retry-After, no new requests are
+    started until it has passed.
+
+    Attributes
+    ----------
+    limit: int
+        The current maximum number of requests in flight.
+    in_flight: int
+        The number of requests in flight.
+    peak_in_flight: int
+        The largest number of requests that have been in flight at once.
+    n_backoffs: int
+        The number of times the limit was decreased.
+    '''
+
+    def __init__(self, initial_limit: int=DEFAULT_INITIAL_LIMIT,
+                 min_limit: int=1, max_limit: int=DEFAULT_MAX_LIMIT,
+                 decrease: float=0.5, latency_tolerance: float=2.0):
+        '''
+        Parameters
+        ----------
+        initial_limit: int
+            The starting concurrency limit.
+        min_limit: int
+            The concurrency limit is never decreased below min_limit.
+        max_limit: int
+            The concurrency limit is never increased above max_limit.
+        decrease: float
+            The factor the limit is multiplied by when the server is overloaded.
+        latency_tolerance: float
+            The limit is only increased while request latency is less than
+            latency_tolerance times the lowest latency seen.
+        '''
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError('Concurrency limits must satisfy 1 <= min_limit <= initial_limit <= max_limit')
+        if not 0 < decrease < 1:
+            raise ValueError('decrease must be between 0 and 1')
+
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+
+        self._limit = float(initial_limit)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.n_backoffs = 0
+        self._min_latency = None
+        self._last_decrease = 0.0
+        self._blocked_until = 0.0
+        self._condition = None
+        self._condition_loop = None
+
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+
+    def _get_condition(self) -> asyncio.Condition:
+        # created lazily so the condition is bound to the loop which uses it
+        loop = asyncio.get_running_loop()
+        if self._condition_loop is not loop:
+            self._condition = asyncio.Condition()
+            self._condition_loop = loop
+        return self._condition
+
+
+    async def acquire(self) -> float:
+        '''
+        Wait for a free request slot.
+
+        Returns
+        -------
+        start: float
+            The start time of the request, which must be passed to release.
+        '''
+        condition = self._get_condition()
+        async with condition:
+            while True:
+                wait = self._blocked_until - time.monotonic()
+                if wait > 0:
+                    try:
+                        await asyncio.wait_for(condition.wait(), wait)
+                    except TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < self.limit:
+                    break
+                await condition.wait()
+
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return time.monotonic()
+
+
+    async def release(self, start: float, overloaded: bool=False,
+                      retry_after: float|None=None) -> None:
+        '''
+        Release a request slot and update the limit.
+
+        Parameters
+        ----------
+        start: float
+            The value returned by acquire.
+        overloaded: bool
+            True if the request failed because the server was overloaded.
+        retry_after: float
+            The number of seconds the server asked to wait before the next request.
+        '''
+        now = time.monotonic()
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            if overloaded:
+                if start >= self._last_decrease:
+                    self._limit = max(float(self.min_limit), self._limit * self.decrease)
+                    self._last_decrease = now
+                    self.n_backoffs += 1
+                if retry_after:
+                    self._blocked_until = max(self._blocked_until, now + retry_after)
+            else:
+                latency = now - start
+                if self._min_latency is None or latency < self._min_latency:
+                    self._min_latency = latency
+                if latency <= self._min_latency * self.latency_tolerance:
+                    self._limit = min(float(self.max_limit), self._limit + 1 / self._limit)
+            condition.notify_all()
@@ -0,0 +1,216 @@
+
+import os
+import time
+import sqlite3
+import threading
+import collections
+
+from .logger import LOGGER
+
+MANIFEST_NAME = '.pdc_manifest.sqlite'
+
+PENDING = 'pending'
+IN_PROGRESS = 'in-progress'
+DONE = 'done'
+FAILED = 'failed'
+STATES = (PENDING, IN_PROGRESS, DONE, FAILED)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    file_name TEXT PRIMARY KEY,
+    file_id TEXT,
+    url TEXT,
+    md5sum TEXT,
+    file_size INTEGER,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started REAL,
+    finished REAL,
+    seconds REAL,
+    mtime_ns INTEGER
+)'''
+
+
+def _fsync_file(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DownloadManifest():
+    '''
+    SQLite record of the files downloaded to an output directory.
+
+    Each file has a state which is one of pending, in-progress, done or failed,
+    along with its expected md5 sum and size, the number of download attempts
+    and the time of the last attempt. Every state change is committed and synced
+    to disk before the download continues, so a bulk download which is stopped
+    at any point can be restarted where it left off.
+
+    A file is only marked done after it has been checked against its expected md5
+    sum and synced to disk. Its size and modification time are recorded, so a
+    later run can skip it without reading it again as long as it has not changed.
+
+    The methods can be called from any thread, so that the commits and syncs can
+    be run off the event loop with asyncio.to_thread. Access to the database
+    connection is serialized with a lock.
+
+    Attributes
+    ----------
+    output_dir: str
+        The directory files are downloaded to.
+    path: str
+        The path of the manifest database.
+    '''
+
+    def __init__(self, output_dir: str, name: str=MANIFEST_NAME):
+        '''
+        Parameters
+        ----------
+        output_dir: str
+            The directory files are downloaded to. It is created if it does not already exist.
+        name: str
+            The file name of the manifest database in output_dir.
+        '''
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, name)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # In WAL mode synchronous=FULL syncs the log on every commit.
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        with self._conn:
+            self._conn.execute(_SCHEMA)
+
+
+    def close(self) -> None:
+        ''' Close the manifest database. '''
+        with self._lock:
+            self._conn.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+    def add(self, files: list) -> None:
+        '''
+        Add files to the manifest.
+
+        Files already in the manifest get the new url. If the md5 sum or size
+        of a file changed, its state is reset to pending.
+
+        Parameters
+        ----------
+        files: list
+            File metadata dictionaries with 'file_name', 'url', 'md5sum' and
+            'file_size' keys and an optional 'file_id' key.
+        '''
+        rows = [(file['file_name'], file.get('file_id'), file.get('url'), file.get('md5sum'),
+                 None if file.get('file_size') is None else int(file['file_size']))
+                for file in files]
+        with self._lock, self._conn:
+            self._conn.executemany('''
+                INSERT INTO files (file_name, file_id, url, md5sum, file_size) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (file_name) DO UPDATE SET
+                    file_id = excluded.file_id,
+                    url = excluded.url,
+                    state = CASE WHEN md5sum IS excluded.md5sum AND file_size IS excluded.file_size
+                            THEN state ELSE 'pending' END,
+                    md5sum = excluded.md5sum,
+                    file_size = excluded.file_size''', rows)
+
+
+    def get(self, file_name: str) -> dict|None:
+        ''' Get the manifest entry for a file or None if it is not in the manifest. '''
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM files WHERE file_name = ?', (file_name,)).fetchone()
+        return None if row is None else dict(row)
+
+
+    def is_done(self, file: dict) -> bool:
+        '''
+        Check whether a file was already downloaded without reading it.
+
+        The file must be marked done with the same md5 sum and size in the
+        manifest, and its size and modification time must not have changed.
+
+        Parameters
+        ----------
+        file: dict
+            File metadata dictionary with 'file_name', 'md5sum' and 'file_size' keys.
+        '''
+        if (entry := self.get(file['file_name'])) is None or entry['state'] != DONE:
+            return False
+        file_size = None if file.get('file_size') is None else int(file['file_size'])
+        if entry['md5sum'] != file.get('md5sum') or entry['file_size'] != file_size:
+            return False
+        try:
+            stat = os.stat(os.path.join(self.output_dir, file['file_name']))
+        except OSError:
+            return False
+        return stat.st_mtime_ns == entry['mtime_ns'] and \
+            (file_size is None or stat.st_size == file_size)
+
+
+    def start(self, file_name: str) -> None:
+        ''' Mark a file in-progress and count the download attempt. '''
+        with self._lock, self._conn:
+            self._conn.execute('''UPDATE files SET state = ?, attempts = attempts + 1,
+                                  started = ?, finished = NULL, seconds = NULL
+                                  WHERE file_name = ?''', (IN_PROGRESS, time.time(), file_name))
+
+
+    def _sync(self, file_name: str) -> int:
+        ''' Sync a downloaded file to disk and get its modification time. '''
+        ofname = os.path.join(self.output_dir, file_name)
+        _fsync_file(ofname)
+        return os.stat(ofname).st_mtime_ns
+
+
+    def _finish(self, file_name: str, success: bool, mtime_ns: int|None) -> None:
+        finished = time.time()
+        self._conn.execute('''UPDATE files SET state = ?, finished = ?, seconds = ? - started,
+                              mtime_ns = ? WHERE file_name = ?''',
+                           (DONE if success else FAILED, finished, finished, mtime_ns, file_name))
+
+
+    def finish(self, file_name: str, success: bool) -> None:
+        '''
+        Mark a file done or failed.
+
+        If success is True, the file is synced to disk before it is marked done.
+        '''
+        mtime_ns = self._sync(file_name) if success else None
+        with self._lock, self._conn:
+            self._finish(file_name, success, mtime_ns)
+
+
+    def mark_done(self, file_name: str) -> None:
+        ''' Mark a file which was already verified done without counting a download attempt. '''
+        mtime_ns = self._sync(file_name)
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE files SET started = ? WHERE file_name = ?', (time.time(), file_name))
+            self._finish(file_name, True, mtime_ns)
+
+
+    def counts(self) -> collections.Counter:
+        ''' Get the number of files in each state. '''
+        with self._lock:
+            return collections.Counter({row['state']: row['n'] for row in self._conn.execute(
+                'SELECT state, COUNT(*) AS n FROM files GROUP BY state')})
+
+
+    def log_stats(self) -> None:
+        ''' Log the number of files in each state. '''
+        counts = self.counts()
+        LOGGER.info('Download manifest "%s": %s', self.path,
+                    ', '.join(f'{state}: {counts[state]}' for state in STATES))
@@ -0,0 +1,139 @@
+
+import time
+import asyncio
+import collections
+from typing import Awaitable, Callable, Hashable, Optional
+
+from . import json_codec
+
+DEFAULT_MEMO_SIZE = 256
+
+
+class QueryMemo():
+    '''
+    In memory LRU of API responses with single-flight deduplication of identical requests.
+
+    Concurrent calls to get with the same key share a single request, and later calls
+    are answered from the LRU without a request. Responses are stored encoded as json,
+    so every caller gets its own copy which it can modify. Failed requests (None) and
+    responses with GraphQL errors are not stored.
+
+    Attributes
+    ----------
+    max_size: int
+        The maximum number of responses stored. If 0, nothing is stored but
+        identical requests in flight are still shared.
+    ttl: float
+        Responses older than ttl seconds are not used. If None, they never expire.
+    n_hits: int
+        The number of calls answered from the LRU or by a request already in flight.
+    n_misses: int
+        The number of calls which sent a request.
+    '''
+
+    def __init__(self, max_size: int=DEFAULT_MEMO_SIZE, ttl: Optional[float]=None):
+        '''
+        Parameters
+        ----------
+        max_size: int
+            The maximum number of responses to store.
+        ttl: float
+            The number of seconds each response is valid for. If None, responses never expire.
+        '''
+        if max_size < 0:
+            raise ValueError('max_size must be >= 0')
+        if ttl is not None and ttl <= 0:
+            raise ValueError('ttl must be > 0')
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.n_hits = 0
+        self.n_misses = 0
+        self._results = collections.OrderedDict()
+        self._in_flight = {}
+
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+
+    def clear(self) -> None:
+        ''' Remove every stored response. '''
+        self._results.clear()
+
+
+    def _lookup(self, key: Hashable) -> str|None:
+        if (entry := self._results.get(key)) is None:
+            return None
+        stored, text = entry
+        if self.ttl is not None and time.monotonic() - stored > self.ttl:
+            del self._results[key]
+            return None
+        self._results.move_to_end(key)
+        return text
+
+
+    def _store(self, key: Hashable, text: str) -> None:
+        if self.max_size == 0:
+            return
+        self._results[key] = (time.monotonic(), text)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[dict|None]]) -> dict|None:
+        '''
+        Get the response for key, calling fetch if it is not stored or in flight.
+
+        Parameters
+        ----------
+        key: Hashable
+            The normalized request.
+        fetch: Callable
+            Coroutine function which sends the request and returns the response json or None.
+
+        Returns
+        -------
+        data: dict
+            The response json or None if the request failed.
+        '''
+        while True:
+            if (text := self._lookup(key)) is not None:
+                self.n_hits += 1
+                return json_codec.loads(text)
+
+            if (future := self._in_flight.get(key)) is None:
+                break
+            try:
+                # shield so that cancelling this caller does not cancel the shared request
+                text = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    # the caller sending the request was cancelled, so send it again
+                    continue
+                raise
+            self.n_hits += 1
+            return None if text is None else json_codec.loads(text)
+
+        self.n_misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            data = await fetch()
+        except Exception as e:
+            future.set_exception(e)
+            # mark the exception as retrieved in case nothing else is waiting for it
+            future.exception()
+            raise
+        else:
+            text = None if data is None else json_codec.dumps(data)
+            if data is not None and 'errors' not in data:
+                self._store(key, text)
+            future.set_result(text)
+        finally:
+            del self._in_flight[key]
+            if not future.done():
+                # this caller was cancelled, so the callers waiting for it send the request again
+                future.cancel()
+        return data
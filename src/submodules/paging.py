@@ -0,0 +1,91 @@
+
+DEFAULT_INITIAL_PAGE_SIZE = 100
+DEFAULT_MIN_PAGE_SIZE = 10
+DEFAULT_MAX_PAGE_SIZE = 1000
+DEFAULT_TARGET_LATENCY = 2.0
+
+
+class AdaptivePageSize():
+    '''
+    Page size for paginated endpoints adjusted from measured response times.
+
+    After each page, the size is set to the number of records which the server
+    would be expected to return in target_latency seconds at the rate it returned
+    that page. The size changes by at most a factor of max_step per page, so one
+    unusually fast or slow response, or a short last page, can not swing it too
+    far. It is divided by max_step when a page request fails.
+
+    Attributes
+    ----------
+    size: int
+        The number of records to request in the next page.
+    min_size: int
+        The size is never decreased below min_size.
+    max_size: int
+        The size is never increased above max_size.
+    target_latency: float
+        The target response time in seconds for each page.
+    '''
+
+    def __init__(self, initial_size: int=DEFAULT_INITIAL_PAGE_SIZE,
+                 min_size: int=DEFAULT_MIN_PAGE_SIZE,
+                 max_size: int=DEFAULT_MAX_PAGE_SIZE,
+                 target_latency: float=DEFAULT_TARGET_LATENCY,
+                 max_step: float=2.0):
+        '''
+        Parameters
+        ----------
+        initial_size: int
+            The size of the first page.
+        min_size: int
+            The minimum page size.
+        max_size: int
+            The maximum page size.
+        target_latency: float
+            The target response time in seconds for each page.
+        max_step: float
+            The maximum factor the size can change by after each page.
+        '''
+        if not 1 <= min_size <= initial_size <= max_size:
+            raise ValueError('Page sizes must satisfy 1 <= min_size <= initial_size <= max_size')
+        if target_latency <= 0:
+            raise ValueError('target_latency must be > 0')
+        if max_step <= 1:
+            raise ValueError('max_step must be > 1')
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.max_step = max_step
+        self._size = float(initial_size)
+
+
+    @property
+    def size(self) -> int:
+        return int(self._size)
+
+
+    def _set(self, size: float) -> None:
+        self._size = min(float(self.max_size), max(float(self.min_size), size))
+
+
+    def update(self, n_records: int, latency: float) -> None:
+        '''
+        Update the size from the response time of a page.
+
+        Parameters
+        ----------
+        n_records: int
+            The number of records in the page.
+        latency: float
+            The response time in seconds.
+        '''
+        if n_records < 1:
+            return
+        size = n_records * self.target_latency / max(latency, 1e-3)
+        self._set(min(self._size * self.max_step, max(self._size / self.max_step, size)))
+
+
+    def failed(self) -> None:
+        ''' Decrease the size after a page request failed. '''
+        self._set(self._size / self.max_step)
@@ -0,0 +1,115 @@
+
+from dataclasses import dataclass, fields
+from collections.abc import Mapping
+
+
+class Record():
+    '''
+    Read only mapping interface for the slotted metadata record classes.
+
+    Records can be used anywhere the metadata dicts returned by Client are
+    read, e.g. record['file_id'], record.items() or dict(record), but use much
+    less memory than a dict per record. Use to_dict to get a plain dict.
+    '''
+
+    __slots__ = ()
+    KEYS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        Mapping.register(cls)
+
+
+    def keys(self) -> tuple:
+        return self.KEYS
+
+
+    def __getitem__(self, key: str):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in self.KEYS else default
+
+
+    def __contains__(self, key) -> bool:
+        return key in self.KEYS
+
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+
+    def __len__(self) -> int:
+        return len(self.KEYS)
+
+
+    def values(self) -> list:
+        return [getattr(self, key) for key in self.KEYS]
+
+
+    def items(self) -> list:
+        return [(key, getattr(self, key)) for key in self.KEYS]
+
+
+    def to_dict(self) -> dict:
+        ''' Get a dict with the same keys and values as the metadata dicts returned by Client. '''
+        return {key: getattr(self, key) for key in self.KEYS}
+
+
+    @classmethod
+    def from_dict(cls, data: Mapping):
+        ''' Make a record from a metadata dict. '''
+        return cls(**data)
+
+
+def _record(cls):
+    ''' Make cls a slotted dataclass with KEYS in field order. '''
+    cls = dataclass(slots=True)(cls)
+    cls.KEYS = tuple(field.name for field in fields(cls))
+    return cls
+
+
+@_record
+class FileRecord(Record):
+    ''' Metadata for a raw file. '''
+    file_id: str
+    file_name: str
+    file_submitter_id: str
+    md5sum: str
+    file_size: str|int
+    data_category: str
+    file_type: str
+    file_format: str
+    file_location: str
+    url: str
+
+
+@_record
+class AliquotRecord(Record):
+    ''' Metadata for an aliquot and the sample it was taken from. '''
+    aliquot_id: str
+    aliquot_submitter_id: str
+    analyte_type: str
+    sample_id: str
+    sample_submitter_id: str
+    sample_type: str
+    tissue_type: str
+    case_id: str
+    file_id_to_aliquot_run_metadata_id: dict
+
+
+@_record
+class CaseRecord(Record):
+    ''' Demographic metadata for a case. '''
+    demographic_id: str
+    ethnicity: str|None
+    gender: str|None
+    race: str|None
+    cause_of_death: str|None
+    vital_status: str|None
+    year_of_birth: str|int|None
+    year_of_death: str|int|None
+    case_id: str
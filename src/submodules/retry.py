@@ -0,0 +1,165 @@
+
+import time
+import socket
+import random
+import asyncio
+
+from httpx import Response, TransportError, ConnectError, TimeoutException
+
+# Outcomes of a request attempt
+SUCCESS = 'success'
+RETRY = 'retry'
+FATAL = 'fatal'
+
+# 4xx status codes which are worth retrying. All other 4xx codes are fatal.
+RETRYABLE_CLIENT_STATUS_CODES = (408, 425, 429)
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30.0
+DEFAULT_DEADLINE = 300.0
+
+
+def is_dns_error(error: BaseException) -> bool:
+    ''' Check whether a connection failed because the host name could not be resolved. '''
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, socket.gaierror):
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class RetryPolicy():
+    '''
+    Exponential backoff with full jitter for API requests.
+
+    Before retry n, the policy sleeps for a random time between 0 and
+    min(max_delay, base_delay * 2 ** n) seconds. It waits longer if the server sent
+    Retry-After. A request is abandoned when it runs out of attempts, or when
+    the next retry would start after the request's deadline.
+
+    Errors are classified as:
+        - transport errors (timeouts, dropped connections): retried.
+        - 5xx and 408, 425 and 429 responses: retried.
+        - other 4xx and 3xx responses: fatal.
+        - httpx.ConnectError: fatal if the host name could not be resolved, because
+          it almost always means the URL is wrong. Other connection failures
+          (refused or reset connections) are retried within the deadline.
+
+    Attributes
+    ----------
+    max_attempts: int
+        The maximum number of attempts for each request.
+    n_retries: int
+        The total number of retries.
+    n_failures: int
+        The number of requests which were abandoned.
+    backoff_seconds: float
+        The total time spent sleeping before retries.
+    '''
+
+    def __init__(self, max_attempts: int=DEFAULT_MAX_ATTEMPTS,
+                 base_delay: float=DEFAULT_BASE_DELAY,
+                 max_delay: float=DEFAULT_MAX_DELAY,
+                 deadline: float|None=DEFAULT_DEADLINE):
+        '''
+        Parameters
+        ----------
+        max_attempts: int
+            The maximum number of attempts for each request.
+        base_delay: float
+            The maximum delay in seconds before the first retry.
+        max_delay: float
+            The maximum delay in seconds before any retry.
+        deadline: float
+            The maximum time in seconds to spend on one request including retries.
+            None for no deadline.
+        '''
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be >= 1')
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+        self.n_retries = 0
+        self.n_failures = 0
+        self.backoff_seconds = 0.0
+
+
+    @staticmethod
+    def classify(response: Response|None=None, error: Exception|None=None) -> str:
+        '''
+        Classify the outcome of a request attempt.
+
+        Parameters
+        ----------
+        response: httpx.Response
+            The response. None if the request raised error.
+        error: Exception
+            The exception raised by the request.
+
+        Returns
+        -------
+        outcome: str
+            One of SUCCESS, RETRY or FATAL.
+        '''
+        if error is not None:
+            if isinstance(error, ConnectError) and is_dns_error(error):
+                return FATAL
+            if isinstance(error, (TimeoutException, TransportError)):
+                return RETRY
+            return FATAL
+
+        if response.status_code == 200:
+            return SUCCESS
+        if response.status_code >= 500 or response.status_code in RETRYABLE_CLIENT_STATUS_CODES:
+            return RETRY
+        return FATAL
+
+
+    def delay(self, attempt: int, retry_after: float|None=None) -> float:
+        '''
+        Get the time to wait before a retry.
+
+        Parameters
+        ----------
+        attempt: int
+            The number of attempts already made.
+        retry_after: float
+            The Retry-After delay requested by the server.
+        '''
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        return max(delay, retry_after or 0)
+
+
+    async def backoff(self, attempt: int, start: float, retry_after: float|None=None) -> bool:
+        '''
+        Sleep before the next attempt of a request.
+
+        Parameters
+        ----------
+        attempt: int
+            The number of attempts already made.
+        start: float
+            The time.monotonic() value when the request was first attempted.
+        retry_after: float
+            The Retry-After delay requested by the server.
+
+        Returns
+        -------
+        retry: bool
+            False without sleeping if the request should be abandoned.
+        '''
+        delay = self.delay(attempt, retry_after)
+        if attempt >= self.max_attempts or \
+                (self.deadline is not None and time.monotonic() + delay - start > self.deadline):
+            self.n_failures += 1
+            return False
+
+        self.n_retries += 1
+        self.backoff_seconds += delay
+        await asyncio.sleep(delay)
+        return True
@@ -0,0 +1,376 @@
+
+import os
+import re
+import signal
+import itertools
+import socket
+import struct
+import asyncio
+from typing import Optional
+
+from . import json_codec
+from .api import Client, QueryTooLargeError, _REQUEST_LATENCY
+from .cache import ResponseCache
+from .limiter import AdaptiveLimiter
+from .memo import QueryMemo
+from .logger import LOGGER
+from .constants import BASE_URL
+
+# Each message is a json object preceded by its length in bytes. A connection carries
+# any number of requests at once, and each response has the 'id' of its request.
+_HEADER = struct.Struct('>I')
+
+# Requests which are forwarded to a Client method.
+REQUEST_OPS = {'get': '_get', 'post': '_post'}
+
+# Seconds the server keeps responses in memory.
+# Responses include signed file URLs which expire, so they are not kept for the life of the server.
+MEMO_TTL = 300
+
+
+async def write_message(writer: asyncio.StreamWriter, message: dict) -> None:
+    ''' Write a length prefixed json message. '''
+    data = json_codec.dumps(message).encode('utf-8')
+    writer.write(_HEADER.pack(len(data)) + data)
+    await writer.drain()
+
+
+async def read_message(reader: asyncio.StreamReader) -> dict|None:
+    '''
+    Read a length prefixed json message.
+
+    Returns None if the connection was closed before the next message.
+    '''
+    try:
+        header = await reader.readexactly(_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if len(e.partial) == 0:
+            return None
+        raise
+    (size,) = _HEADER.unpack(header)
+    return json_codec.loads(await reader.readexactly(size))
+
+
+def server_running(socket_path: str) -> bool:
+    ''' Check whether a server is accepting connections on socket_path. '''
+    if not os.path.exists(socket_path):
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(1)
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+class ClientServer():
+    '''
+    Local server which sends the API requests of RemoteClients with long lived Clients.
+
+    One Client is kept for each base URL and verify setting used by a
+    RemoteClient, so the TLS connections in its pool, the response caches and
+    the concurrency limiter are shared by every command routed through the server.
+
+    Attributes
+    ----------
+    socket_path: str
+        The path of the Unix socket the server listens on.
+    clients: dict
+        Mapping of (url, verify) to the Client used for those requests.
+    n_requests: int
+        The number of API requests handled.
+    n_connections: int
+        The number of connections accepted.
+    '''
+
+    def __init__(self, socket_path: str,
+                 cache: Optional[ResponseCache]=None,
+                 limiter: Optional[AdaptiveLimiter]=None,
+                 **kwargs):
+        '''
+        Parameters
+        ----------
+        socket_path: str
+            The path of the Unix socket to listen on.
+        cache: ResponseCache
+            On-disk cache of API responses shared by every Client. If None, responses are not cached.
+        limiter: AdaptiveLimiter
+            Limit on the number of concurrent requests shared by every Client.
+            If None, each Client has its own default limiter.
+        kwargs: dict
+            Additional kwargs passed to each Client.
+        '''
+        self.socket_path = socket_path
+        self.cache = cache
+        self.limiter = limiter
+        self.client_kwargs = kwargs
+        self.clients = {}
+        self.n_requests = 0
+        self.n_connections = 0
+        self._loop = None
+        self._stop = None
+
+
+    def _client(self, url: str, verify: bool) -> Client:
+        key = (url, verify)
+        if key not in self.clients:
+            LOGGER.info("Starting client for url: '%s'", url)
+            self.clients[key] = Client(url=url, verify=verify, cache=self.cache,
+                                       limiter=self.limiter, memo=QueryMemo(ttl=MEMO_TTL),
+                                       **self.client_kwargs)
+        return self.clients[key]
+
+
+    async def _response(self, request: dict) -> dict:
+        op = request.get('op')
+        if op == 'ping':
+            return {'ok': True}
+        if op not in REQUEST_OPS:
+            return {'error': 'ValueError', 'message': f"Unknown request op: '{op}'"}
+
+        self.n_requests += 1
+        client = self._client(request['url'], request.get('verify', True))
+        _REQUEST_LATENCY.set(None)
+        try:
+            data = await getattr(client, REQUEST_OPS[op])(request['query'],
+                                                          use_cache=request.get('use_cache', True))
+        except QueryTooLargeError as e:
+            return {'error': 'QueryTooLargeError', 'message': str(e)}
+        return {'data': data, 'latency': _REQUEST_LATENCY.get()}
+
+
+    async def _respond(self, request: dict, writer: asyncio.StreamWriter, write_lock: asyncio.Lock) -> None:
+        try:
+            response = await self._response(request)
+        except Exception as e:
+            LOGGER.error('Request failed: %s: %s', type(e).__name__, e)
+            response = {'error': type(e).__name__, 'message': str(e)}
+        if 'id' in request:
+            response['id'] = request['id']
+        try:
+            async with write_lock:
+                await write_message(writer, response)
+        except ConnectionError as e:
+            LOGGER.warning('Dropped connection: %s', e)
+
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.n_connections += 1
+        # requests on the same connection are handled concurrently
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while (request := await read_message(reader)) is not None:
+                task = asyncio.create_task(self._respond(request, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            LOGGER.warning('Dropped connection: %s', e)
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+
+    async def serve(self) -> bool:
+        '''
+        Listen on socket_path until stop is called or the process gets SIGINT or SIGTERM.
+
+        Returns
+        -------
+        success: bool
+            False if another server is already listening on socket_path.
+        '''
+        if server_running(self.socket_path):
+            LOGGER.error("A server is already running on socket: '%s'", self.socket_path)
+            return False
+        if os.path.exists(self.socket_path):
+            # left behind by a server which did not shut down cleanly
+            os.remove(self.socket_path)
+
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self._loop.add_signal_handler(sig, self._stop.set)
+            except (ValueError, RuntimeError):
+                # signal handlers can only be set in the main thread
+                pass
+
+        # The socket is created with mode 0600, so other users can not connect
+        # to it between bind and a later chmod.
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        finally:
+            os.umask(umask)
+        try:
+            async with server:
+                await self._stop.wait()
+        finally:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                self._loop.remove_signal_handler(sig)
+            for client in self.clients.values():
+                await client.__aexit__(None, None, None)
+            self.clients = {}
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            LOGGER.info('Server handled %i request(s)', self.n_requests)
+        return True
+
+
+    def stop(self) -> None:
+        ''' Stop the server. Safe to call from another thread. '''
+        if self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+
+class RemoteClient(Client):
+    '''
+    Client which sends its API requests through a ClientServer.
+
+    Queries are built and responses are parsed locally exactly as in Client,
+    but the requests themselves are sent by the server, so they use its warm
+    connection pool, response cache and concurrency limiter, so a RemoteClient
+    does not have its own HTTP client, cache, limiter or query memo.
+
+    Every request is sent on a single connection to the server which is opened
+    by the first request and kept until the client is closed. Concurrent
+    requests share the connection and are matched to their responses by id.
+    '''
+
+    def __init__(self, socket_path: str, url: str=BASE_URL, verify: Optional[bool]=True,
+                 page_sizes: Optional[dict]=None, **kwargs):
+        '''
+        Parameters
+        ----------
+        socket_path: str
+            The path of the Unix socket the server listens on.
+        url: str
+            The base URL for the API.
+        verify: bool
+            Whether the server should verify SSL certificates.
+        page_sizes: dict
+            Page size of each paginated endpoint as in Client.
+        kwargs: dict
+            The other Client kwargs are accepted, so that a RemoteClient can be used
+            in place of a Client, but are not used because the server sends the requests.
+        '''
+        # Client.__init__ is not called because it makes an HTTP client, limiter
+        # and memo which are not used when the requests are sent by the server.
+        self.url = url
+        self.cache = None
+        self.page_sizes = dict() if page_sizes is None else page_sizes
+        self._init_loop()
+        self.socket_path = socket_path
+        self.verify = verify
+        self._writer = None
+        self._reader_task = None
+        self._connect_lock = None
+        self._pending = {}
+        self._request_ids = itertools.count()
+
+
+    async def _connect(self) -> asyncio.StreamWriter|None:
+        ''' Get the connection to the server, opening it if it is not already open. '''
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._writer is not None:
+                return self._writer
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.socket_path)
+            except OSError as e:
+                LOGGER.error("Could not connect to server on socket '%s': %s", self.socket_path, e, stacklevel=4)
+                return None
+            self._writer = writer
+            self._reader_task = asyncio.create_task(self._read_responses(reader, writer))
+            return writer
+
+
+    async def _read_responses(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        ''' Pass each response to the request waiting for it until the connection is closed. '''
+        error = {'error': 'ConnectionError', 'message': 'Server closed the connection'}
+        try:
+            while (response := await read_message(reader)) is not None:
+                future = self._pending.pop(response.pop('id', None), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            error = {'error': type(e).__name__, 'message': str(e)}
+        finally:
+            # the next request opens a new connection
+            if self._writer is writer:
+                self._writer = None
+            writer.close()
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_result(error)
+            self._pending.clear()
+
+
+    async def _close_connection(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+            self._reader_task = None
+
+
+    def __exit__(self, exc_type, exc, tb):
+        # the request statistics are logged by the server
+        self._loop.run_until_complete(self._close_connection())
+        if self._initialized_loop:
+            self._loop.close()
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._close_connection()
+        if self._initialized_loop:
+            self._loop.close()
+
+
+    async def _remote(self, op: str, query: str, use_cache: bool=True) -> dict|None:
+        if (writer := await self._connect()) is None:
+            return None
+
+        request_id = next(self._request_ids)
+        request = {'id': request_id, 'op': op, 'query': re.sub(r'\s+', ' ', query.strip()),
+                   'url': self.url, 'verify': self.verify, 'use_cache': use_cache}
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            if self._writer is not writer:
+                # the connection was closed after it was opened for this request
+                response = {'error': 'ConnectionError', 'message': 'Server closed the connection'}
+            else:
+                await write_message(writer, request)
+                response = await future
+        except OSError as e:
+            response = {'error': type(e).__name__, 'message': str(e)}
+        finally:
+            self._pending.pop(request_id, None)
+
+        if 'error' in response:
+            if response['error'] == 'QueryTooLargeError':
+                raise QueryTooLargeError(response['message'])
+            LOGGER.error('Server request failed: %s: %s', response['error'], response['message'], stacklevel=3)
+            return None
+
+        _REQUEST_LATENCY.set(response['latency'])
+        return response['data']
+
+
+    async def _post(self, query: str, use_cache: bool=True) -> dict | None:
+        return await self._remote('post', query, use_cache=use_cache)
+
+
+    async def _get(self, query, use_cache: bool=True) -> dict | None:
+        return await self._remote('get', query, use_cache=use_cache)
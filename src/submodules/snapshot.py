@@ -0,0 +1,331 @@
+
+import os
+import gzip
+import time
+import asyncio
+from copy import deepcopy
+from tempfile import NamedTemporaryFile
+from typing import Optional
+
+from .api import Client, PaginatedDataError
+from .records import FileRecord, AliquotRecord, CaseRecord
+from . import json_codec
+from .logger import LOGGER
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_EXT = '.json.gz'
+INDEX_NAME = 'index.json'
+
+# The keys in each study snapshot with the data for each endpoint.
+# These are the same as the endpoint names used by tests/update_api_data.py
+SNAPSHOT_KEYS = ('study', 'studyCatalog', 'experiment', 'file', 'samples', 'case')
+
+
+async def async_take_snapshot(client: Client, study_id: str) -> dict|None:
+    '''
+    Download all the metadata for a study.
+
+    Parameters
+    ----------
+    client: Client
+        The client to download the metadata with.
+    study_id: str
+        The study ID.
+
+    Returns
+    -------
+    snapshot: dict
+        A dictionary with the data for each key in SNAPSHOT_KEYS
+        or None if any of the data could not be retrieved.
+    '''
+    study_metadata = await client.async_get_study_metadata(study_id=study_id)
+    if study_metadata is None:
+        LOGGER.error("Could not retrieve metadata for study: '%s'", study_id)
+        return None
+    pdc_study_id = study_metadata['pdc_study_id']
+
+    data = await asyncio.gather(
+        client.async_get_study_metadata(pdc_study_id=pdc_study_id, only_latest=False),
+        client.async_get_study_catalog(pdc_study_id),
+        client.async_get_experimental_metadata(study_metadata['study_submitter_id']),
+        client.async_get_study_raw_files(study_id),
+        client.async_get_study_samples(study_id),
+        client.async_get_study_cases(study_id))
+
+    snapshot = dict(zip(SNAPSHOT_KEYS, data))
+    for key, value in snapshot.items():
+        if value is None:
+            LOGGER.error("Could not retrieve %s data for study: '%s'", key, study_id)
+            return None
+
+    # the study versions are retrieved by pdc_study_id so they include every version
+    # of the study. Make sure the requested version is included even if it is not the latest.
+    if not any(study['study_id'] == study_id for study in snapshot['study']):
+        study_metadata['is_latest_version'] = False
+        snapshot['study'].append(study_metadata)
+
+    snapshot.update({'version': SNAPSHOT_VERSION,
+                     'created': time.time(),
+                     'url': client.url,
+                     'study_id': study_id,
+                     'pdc_study_id': pdc_study_id,
+                     'study_submitter_id': study_metadata['study_submitter_id']})
+    return snapshot
+
+
+class SnapshotStore():
+    '''
+    Local store of study metadata snapshots.
+
+    Each snapshot is written to a separate gzip compressed json file named by
+    its study_id, so snapshots of different versions of a study are kept apart.
+    An index file maps the study_id of each snapshot, and the pdc_study_id and
+    study_submitter_id of the study, to the study_id of the snapshot file. The
+    pdc_study_id and study_submitter_id map to the snapshot saved last. Versions
+    of a study which were not snapshotted are not in the index.
+
+    Attributes
+    ----------
+    store_dir: str
+        The snapshot directory.
+    '''
+
+    def __init__(self, store_dir: str):
+        '''
+        Parameters
+        ----------
+        store_dir: str
+            The snapshot directory. It is created when the first snapshot is saved.
+        '''
+        self.store_dir = store_dir
+        self._snapshots = {}
+        self._index = None
+
+
+    def _path(self, study_id: str) -> str:
+        return os.path.join(self.store_dir, f'{study_id}{SNAPSHOT_EXT}')
+
+
+    def _write(self, path: str, text: str, compress: bool) -> None:
+        with NamedTemporaryFile('wb', dir=self.store_dir, suffix='.tmp', delete=False) as outF:
+            outF.write(gzip.compress(text.encode('utf-8')) if compress else text.encode('utf-8'))
+        os.replace(outF.name, path)
+
+
+    @property
+    def index(self) -> dict:
+        ''' Dictionary mapping study_ids, pdc_study_ids and study_submitter_ids to snapshot study_ids. '''
+        if self._index is None:
+            index_path = os.path.join(self.store_dir, INDEX_NAME)
+            if os.path.isfile(index_path):
+                with open(index_path, 'rb') as inF:
+                    self._index = json_codec.loads(inF.read())
+            else:
+                self._index = {}
+        return self._index
+
+
+    def save(self, snapshot: dict) -> str:
+        '''
+        Add a study snapshot to the store.
+
+        Parameters
+        ----------
+        snapshot: dict
+            A snapshot returned by async_take_snapshot.
+
+        Returns
+        -------
+        path: str
+            The path of the snapshot file.
+        '''
+        os.makedirs(self.store_dir, exist_ok=True)
+        study_id = snapshot['study_id']
+        path = self._path(study_id)
+        self._write(path, json_codec.dumps(snapshot), compress=True)
+        self._snapshots[study_id] = snapshot
+
+        # The file, sample and case data only belong to the snapshotted study_id,
+        # so the other versions of the study are not indexed.
+        index = self.index
+        for key in (study_id, snapshot['pdc_study_id'], snapshot['study_submitter_id']):
+            index[key] = study_id
+        self._write(os.path.join(self.store_dir, INDEX_NAME), json_codec.dumps(index, pretty=True), compress=False)
+        return path
+
+
+    def study_ids(self) -> list:
+        ''' Get the study_id of each snapshot in the store. '''
+        return sorted(set(self.index.values()))
+
+
+    def load(self, key: str) -> dict|None:
+        '''
+        Get the snapshot for a study.
+
+        Parameters
+        ----------
+        key: str
+            A study_id, pdc_study_id or study_submitter_id.
+
+        Returns
+        -------
+        snapshot: dict
+            The study snapshot or None if the study is not in the store.
+            The snapshot is shared between calls so it should not be modified.
+        '''
+        study_id = self.index.get(key)
+        if study_id is None:
+            return None
+
+        if study_id not in self._snapshots:
+            path = self._path(study_id)
+            try:
+                with gzip.open(path, 'rb') as inF:
+                    snapshot = json_codec.loads(inF.read())
+            except (OSError, EOFError, ValueError):
+                LOGGER.error("Could not read snapshot file: '%s'", path)
+                return None
+            if snapshot.get('version') != SNAPSHOT_VERSION:
+                LOGGER.error("Unsupported snapshot version in file: '%s'", path)
+                return None
+            self._snapshots[study_id] = snapshot
+
+        return self._snapshots[study_id]
+
+
+class OfflineClient(Client):
+    '''
+    Client which answers requests from a SnapshotStore without any network I/O.
+
+    The get_* methods return the same data as Client for the studies in the store
+    and None for any other study. The signed file URLs in a snapshot expire, so
+    files should not be downloaded using an OfflineClient.
+    '''
+
+    def __init__(self, store: SnapshotStore, **kwargs):
+        '''
+        Parameters
+        ----------
+        store: SnapshotStore
+            The snapshot store.
+        kwargs: dict
+            Additional kwargs passed to Client.
+        '''
+        super().__init__(**kwargs)
+        self.store = store
+
+
+    def _load(self, key: str, id_name: str) -> dict|None:
+        snapshot = self.store.load(key)
+        if snapshot is None:
+            LOGGER.error("No snapshot found for %s: '%s'", id_name, key, stacklevel=3)
+        return snapshot
+
+
+    async def _post(self, query: str, use_cache: bool=True) -> dict | None:
+        LOGGER.error('API requests are not available in offline mode.')
+        return None
+
+
+    async def _get(self, query, use_cache: bool=True) -> dict | None:
+        LOGGER.error('API requests are not available in offline mode.')
+        return None
+
+
+    async def async_get_study_catalog(self, pdc_study_id: str) -> dict|None:
+        if (snapshot := self.store.load(pdc_study_id)) is None:
+            return None
+        return deepcopy(snapshot['studyCatalog'])
+
+
+    async def async_get_study_metadata(self, pdc_study_id: str|None=None,
+                                       study_id: str|None=None,
+                                       only_latest: bool=True) -> dict|list|None:
+        if study_id is not None:
+            if (snapshot := self.store.load(study_id)) is None:
+                return None
+            for study in snapshot['study']:
+                if study['study_id'] == study_id:
+                    return {k: v for k, v in deepcopy(study).items() if k != 'is_latest_version'}
+            return None
+
+        if pdc_study_id is None:
+            raise ValueError('Both pdc_study_id and study_id cannot be None!')
+
+        if (snapshot := self.store.load(pdc_study_id)) is None:
+            return None
+        if not only_latest:
+            return deepcopy(snapshot['study'])
+        for study in snapshot['study']:
+            if study['is_latest_version']:
+                return {k: v for k, v in deepcopy(study).items() if k != 'is_latest_version'}
+        raise RuntimeError('Could not find latest study for pdc_study_id!')
+
+
+    async def async_get_experimental_metadata(self, study_submitter_id: str) -> dict|None:
+        if (snapshot := self._load(study_submitter_id, 'study_submitter_id')) is None:
+            return None
+        return deepcopy(snapshot['experiment'])
+
+
+    async def async_get_study_samples(self, study_id: str,
+                                      file_ids: Optional[list]=None,
+                                      records: bool=False,
+                                      **kwargs) -> list | None:
+        if (snapshot := self._load(study_id, 'study_id')) is None:
+            return None
+        if file_ids is None:
+            aliquots = deepcopy(snapshot['samples'])
+        else:
+            file_ids = set(file_ids)
+            aliquots = list()
+            for aliquot in snapshot['samples']:
+                arm_ids = {file_id: arm_id for file_id, arm_id
+                           in aliquot['file_id_to_aliquot_run_metadata_id'].items() if file_id in file_ids}
+                if len(arm_ids) > 0:
+                    aliquot = deepcopy(aliquot)
+                    aliquot['file_id_to_aliquot_run_metadata_id'] = arm_ids
+                    aliquots.append(aliquot)
+        return [AliquotRecord.from_dict(a) for a in aliquots] if records else aliquots
+
+
+    async def async_get_study_cases(self, study_id: str, records: bool=False, **kwargs) -> list|None:
+        if (snapshot := self._load(study_id, 'study_id')) is None:
+            return None
+        if records:
+            return [CaseRecord.from_dict(case) for case in snapshot['case']]
+        return deepcopy(snapshot['case'])
+
+
+    async def aiter_study_cases(self, study_id: str, records: bool=False, **kwargs):
+        if (snapshot := self._load(study_id, 'study_id')) is None:
+            raise PaginatedDataError(f"No snapshot found for study_id: '{study_id}'")
+        for case in snapshot['case']:
+            yield CaseRecord.from_dict(case) if records else deepcopy(case)
+
+
+    async def async_get_study_raw_files(self, study_id: str,
+                                        use_s3_path: bool=False,
+                                        n_files: Optional[int]=None,
+                                        records: bool=False) -> list|None:
+        if (snapshot := self._load(study_id, 'study_id')) is None:
+            return None
+        files = deepcopy(snapshot['file'])
+        if use_s3_path:
+            for file in files:
+                file['url'] = f"s3://pdcdatastore/{file['file_location']}"
+        if n_files is not None:
+            files = files[:n_files]
+        return [FileRecord.from_dict(file) for file in files] if records else files
+
+
+    async def async_get_file_url(self, file_id: str) -> dict|None:
+        for study_id in self.store.study_ids():
+            if (snapshot := self.store.load(study_id)) is None:
+                continue
+            for file in snapshot['file']:
+                if file['file_id'] == file_id:
+                    return {k: file[k] for k in ('file_name', 'file_size', 'md5sum', 'url')}
+        LOGGER.error("No file found for file_id: '%s'", file_id)
+        return None
@@ -0,0 +1,240 @@
+
+import os
+import re
+import shutil
+import tempfile
+import collections
+
+from .logger import LOGGER
+
+# ioctl request to share the data blocks of one file with another (reflink) on
+# file systems which support it (btrfs, xfs, bcachefs, ...). From linux/fs.h.
+FICLONE = 0x40049409
+
+MD5_RE = re.compile(r'^[0-9a-f]{32}$')
+
+# Order materialization methods are tried in.
+HARDLINK = 'hardlink'
+REFLINK = 'reflink'
+COPY = 'copy'
+METHODS = (HARDLINK, REFLINK, COPY)
+
+
+def reflink(src: str, dest: str) -> None:
+    ''' Create dest sharing the data blocks of src. Raises OSError if it is not supported. '''
+    import fcntl
+
+    with open(src, 'rb') as inF, open(dest, 'wb') as outF:
+        try:
+            fcntl.ioctl(outF.fileno(), FICLONE, inF.fileno())
+        except OSError:
+            outF.close()
+            os.remove(dest)
+            raise
+
+
+def copy_file(src: str, dest: str) -> None:
+    '''
+    Copy src to dest in the kernel with copy_file_range.
+
+    copy_file_range can also share the data blocks on file systems which support
+    reflinks or copy on the server for network file systems. Falls back to a
+    buffered copy if copy_file_range is not available.
+    '''
+    with open(src, 'rb') as inF, open(dest, 'wb') as outF:
+        size = os.fstat(inF.fileno()).st_size
+        offset = 0
+        try:
+            while offset < size:
+                if (n_bytes := os.copy_file_range(inF.fileno(), outF.fileno(), size - offset)) == 0:
+                    break
+                offset += n_bytes
+        except (AttributeError, OSError):
+            inF.seek(offset)
+            outF.seek(offset)
+            outF.truncate()
+            shutil.copyfileobj(inF, outF)
+
+
+class FileStore():
+    '''
+    Local content addressed store of downloaded files.
+
+    Each file is stored once under its md5 sum as <store_dir>/<md5[:2]>/<md5>, so a
+    file which appears in several studies or study versions is only downloaded once.
+    Files in the store are materialized at their output path with a hard link if
+    the output directory is on the same file system, otherwise with a reflink or a
+    copy_file_range copy.
+
+    Hard links share the same inode as the stored file, so stored files are made
+    read only to prevent a materialized file from being modified in place. Downloaded
+    files are added to the store as a reflink or copy, so the mode of the downloaded
+    file is not changed.
+
+    Attributes
+    ----------
+    store_dir: str
+        The store directory.
+    methods: tuple
+        The materialization methods to try, in order.
+    n_materialized: collections.Counter
+        The number of files materialized with each method.
+    bytes_materialized: int
+        The total size of the files materialized from the store.
+    n_added: int
+        The number of files added to the store.
+    '''
+
+    def __init__(self, store_dir: str, methods: tuple=METHODS):
+        '''
+        Parameters
+        ----------
+        store_dir: str
+            The store directory. It is created if it does not already exist.
+        methods: tuple
+            The materialization methods to try, in order. Any of 'hardlink', 'reflink' and 'copy'.
+        '''
+        if len(methods) == 0 or any(method not in METHODS for method in methods):
+            raise ValueError(f'methods must be one or more of: {", ".join(METHODS)}')
+
+        self.store_dir = store_dir
+        self.methods = tuple(methods)
+        self.n_materialized = collections.Counter()
+        self.bytes_materialized = 0
+        self.n_added = 0
+        os.makedirs(self.store_dir, exist_ok=True)
+
+
+    def path(self, md5sum: str) -> str:
+        ''' Get the path of the stored file with md5sum. '''
+        md5sum = md5sum.lower()
+        if MD5_RE.search(md5sum) is None:
+            raise ValueError(f"Invalid md5 sum: '{md5sum}'")
+        return os.path.join(self.store_dir, md5sum[:2], md5sum)
+
+
+    def __contains__(self, md5sum: str) -> bool:
+        return os.path.isfile(self.path(md5sum))
+
+
+    def _link(self, method: str, src: str, dest: str) -> None:
+        if method == HARDLINK:
+            os.link(src, dest)
+        elif method == REFLINK:
+            reflink(src, dest)
+        else:
+            copy_file(src, dest)
+
+
+    def _place(self, src: str, dest: str, methods: tuple, mode: int|None=None) -> str|None:
+        '''
+        Atomically create dest from src with the first method in methods which works.
+
+        If mode is not None, it is set on the new file before it is moved to dest.
+        Returns the method used or None if all of them failed.
+        '''
+        # mkstemp picks a name in the destination directory which no other caller uses.
+        # The empty file is removed so that each method creates the file itself.
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest) or '.',
+                                            prefix=f'.{os.path.basename(dest)}.', suffix='.tmp')
+        except OSError as e:
+            LOGGER.debug("Could not create temporary file for '%s': %s", dest, e)
+            return None
+        os.close(fd)
+        for method in methods:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            try:
+                self._link(method, src, tmp_path)
+                if mode is not None:
+                    os.chmod(tmp_path, mode)
+            except OSError as e:
+                LOGGER.debug("Could not %s '%s' to '%s': %s", method, src, dest, e)
+                continue
+            os.replace(tmp_path, dest)
+            return method
+
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+
+    def materialize(self, md5sum: str, ofname: str, size: int|None=None) -> bool:
+        '''
+        Create ofname from the stored file with md5sum.
+
+        Parameters
+        ----------
+        md5sum: str
+            The md5 sum of the file.
+        ofname: str
+            The name of the file to write. An existing file is replaced.
+        size: int
+            The expected file size. If the stored file is a different size, it is not used.
+
+        Returns
+        -------
+        success: bool
+            True if ofname was created, False if the file is not in the store.
+        '''
+        path = self.path(md5sum)
+        try:
+            stored_size = os.path.getsize(path)
+        except OSError:
+            return False
+        if size is not None and stored_size != size:
+            LOGGER.warning("Size of stored file '%s' does not match. Ignoring it.", path)
+            return False
+
+        if (method := self._place(path, ofname, self.methods)) is None:
+            LOGGER.warning("Could not materialize stored file '%s' to '%s'", path, ofname)
+            return False
+        LOGGER.info("Materialized '%s' from store with %s", ofname, method)
+        self.n_materialized[method] += 1
+        self.bytes_materialized += stored_size
+        return True
+
+
+    def add(self, ofname: str, md5sum: str) -> bool:
+        '''
+        Add a downloaded file to the store.
+
+        The file should already have been checked against md5sum.
+        If the file is already in the store, nothing is done. The file is reflinked
+        or copied into the store, never hard linked, because stored files are made
+        read only.
+
+        Parameters
+        ----------
+        ofname: str
+            The downloaded file.
+        md5sum: str
+            The md5 sum of the file.
+
+        Returns
+        -------
+        success: bool
+            True if the file is in the store.
+        '''
+        path = self.path(md5sum)
+        if os.path.isfile(path):
+            return True
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        methods = tuple(method for method in self.methods if method != HARDLINK) or (COPY,)
+        if self._place(ofname, path, methods, mode=0o444) is None:
+            LOGGER.warning("Could not add '%s' to store", ofname)
+            return False
+        self.n_added += 1
+        return True
+
+
+    def log_stats(self) -> None:
+        ''' Log the number of files materialized from and added to the store. '''
+        if self.n_materialized:
+            LOGGER.info('Materialized %i file(s) (%.1f MB) from store: %s',
+                        sum(self.n_materialized.values()), self.bytes_materialized / 1024 ** 2,
+                        ', '.join(f'{method}: {n}' for method, n in sorted(self.n_materialized.items())))
+        if self.n_added:
+            LOGGER.info('Added %i file(s) to store', self.n_added)
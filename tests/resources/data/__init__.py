@@ -32,6 +32,7 @@ PDC_TEST_FILE_IDS = [{"file_id": "127602b9-a2b4-4683-816d-741ebb8bec82",
 
 TEST_URLS = [{'url': 'https://raw.githubusercontent.com/ajmaurais/PDC_client/refs/heads/dev/README.md',
               'file_name': 'README.md',
+              'path': f'{TEST_DIR}/../README.md',
               'md5sum': md5_sum(f'{TEST_DIR}/../README.md'),
               'file_size': getsize(f'{TEST_DIR}/../README.md')}]
 
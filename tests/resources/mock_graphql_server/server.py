@@ -1,4 +1,7 @@
 
+import time
+import threading
+
 from flask import Flask, request, jsonify
 from graphql_server.flask import GraphQLView
 import graphene
@@ -7,6 +10,9 @@ from httpx import get, ConnectError
 from .schema import Query
 from .schema import QueryError
 
+# Emulate the request line limit of the PDC web server
+MAX_QUERY_STRING_LENGTH = 8192
+
 def server_is_running(url='http://127.0.0.1:5000'):
     ''' Check if mock graphql server is running.'''
     query = 'query={ __schema { queryType { name }}}'
@@ -30,6 +36,42 @@ def get_server():
         view_func=GraphQLView.as_view("graphql", schema=schema, graphiql=True)
     )
 
+    # Errors to return from the next requests to /graphql. Set with POST /inject_errors
+    injected_errors = {'count': 0, 'status_code': 503, 'retry_after': None, 'delay': 0}
+    injected_errors_lock = threading.Lock()
+
+    @app.route('/inject_errors', methods=['POST'])
+    def inject_errors():
+        with injected_errors_lock:
+            injected_errors.update({'count': 0, 'status_code': 503, 'retry_after': None, 'delay': 0})
+            injected_errors.update(request.json or {})
+            return jsonify(injected_errors)
+
+    @app.before_request
+    def inject_error():
+        if not request.path.startswith('/graphql'):
+            return None
+        with injected_errors_lock:
+            if injected_errors['count'] <= 0:
+                return None
+            injected_errors['count'] -= 1
+            error = dict(injected_errors)
+
+        time.sleep(error['delay'])
+        response = jsonify('Injected error')
+        response.status_code = error['status_code']
+        if error['retry_after'] is not None:
+            response.headers['Retry-After'] = str(error['retry_after'])
+        return response
+
+    @app.before_request
+    def check_query_length():
+        if len(request.query_string) > MAX_QUERY_STRING_LENGTH:
+            response = jsonify('Request-URI Too Large')
+            response.status_code = 414
+            return response
+        return None
+
     @app.route('/graphql', methods=['GET'])
     def graphql_get():
         query = request.args.get('query')
@@ -2,8 +2,15 @@
 import os
 from shlex import join as join_shell
 import subprocess
+import re
+import hashlib
+import threading
+import http.server
+from urllib.parse import urlsplit
 from inspect import stack
 
+RANGE_RE = re.compile(r'^bytes=(\d+)-(\d*)$')
+
 def make_work_dir(work_dir, clear_dir=False):
     '''
     Setup work directory for test.
@@ -24,7 +31,7 @@ def make_work_dir(work_dir, clear_dir=False):
                 os.remove(f'{work_dir}/{file}')
 
 
-def run_command(command, wd, prefix=None):
+def run_command(command, wd, prefix=None, env=None):
     '''
     Run command in subprocess and write stdout, stderr, return code and command to
     textfiles in specified directory.
@@ -38,11 +45,13 @@ def run_command(command, wd, prefix=None):
     prefix: str
         A prefix to add to stdout, stderr, rc and command files.
         If None, the name of the calling function is used as the prefix.
+    env: dict
+        The environment to run the command in. If None, the current environment is used.
     '''
     encoding = 'utf-8'
     result = subprocess.run(command, cwd=wd,
                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                            shell=False, check=False)
+                            shell=False, check=False, env=env)
 
     prefix_path = f'{wd}/{prefix if prefix else stack()[1][3]}'
 
@@ -58,4 +67,99 @@ def run_command(command, wd, prefix=None):
     with open(f'{prefix_path}.rc.txt', 'w', encoding=encoding) as outF:
         outF.write(f'{str(result.returncode)}\n')
 
-    return result
\ No newline at end of file
+    return result
+
+class _FileRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.n_requests += 1
+        if self.server.forbidden is not None and self.server.forbidden(self.path):
+            self.server.n_forbidden += 1
+            self.send_error(403)
+            return
+        data = self.server.files.get(urlsplit(self.path).path.lstrip('/'))
+        if data is None:
+            self.send_error(404)
+            return
+
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        start, end = 0, len(data) - 1
+        match = RANGE_RE.search(self.headers.get('Range', ''))
+        if match and self.headers.get('If-Range', etag) == etag:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else end, end)
+            if start > end:
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(end + 1 - start))
+        self.end_headers()
+
+        body = data[start:end + 1]
+        if self.server.max_bytes is not None:
+            # Close the connection part way through the response body.
+            body = body[:self.server.max_bytes]
+            self.close_connection = True
+        self.wfile.write(body)
+        self.server.bytes_sent += len(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalFileServer(http.server.ThreadingHTTPServer):
+    '''
+    Threaded http server on localhost which serves files from memory for download tests.
+
+    Range and If-Range requests are supported with the md5 sum of each file as its ETag.
+
+    Attributes
+    ----------
+    files: dict
+        The data of each file served, keyed by url path without the leading '/'.
+    forbidden: callable
+        Called with the request path (including the query string). If it returns True
+        the server responds with status 403. None to serve every request.
+    n_requests: int
+        The number of GET requests received.
+    n_forbidden: int
+        The number of requests which were forbidden.
+    bytes_sent: int
+        The number of bytes of file data sent.
+    max_bytes: int
+        If not None, responses are cut off after max_bytes bytes of file data.
+    base_url: str
+        The url of the server.
+    '''
+
+    def __init__(self, files, forbidden=None):
+        super().__init__(('127.0.0.1', 0), _FileRequestHandler)
+        self.files = files
+        self.forbidden = forbidden
+        self.n_requests = 0
+        self.n_forbidden = 0
+        self.bytes_sent = 0
+        self.max_bytes = None
+        self.base_url = f'http://127.0.0.1:{self.server_address[1]}'
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+
+    def url(self, path):
+        ''' Get the url of a file. '''
+        return f'{self.base_url}/{path}'
+
+
+    def start(self):
+        ''' Start serving requests in a background thread. '''
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        ''' Stop the server and close its socket. '''
+        self.shutdown()
+        self.server_close()
@@ -4,10 +4,12 @@ import json
 import random
 from copy import deepcopy
 
-from resources import data
+from resources import data, TEST_DIR
+from resources.setup_functions import make_work_dir
 from update_api_data import DUPLICATE_FILE_TEST_STUDIES
 
 from PDC_client.submodules import api
+from PDC_client.submodules.cache import ResponseCache
 
 # TEST_URL = 'http://127.0.0.1:5000/graphql'
 TEST_URL = 'https://pdc.cancer.gov/graphql'
@@ -88,6 +90,27 @@ class TestStudyLevel(unittest.TestCase):
         self.assertIsNone(self.client.get_study_catalog('DUMMY'))
 
 
+    def test_gather(self):
+        results = self.client.gather(*[self.client.async_get_study_id(study['pdc_study_id'])
+                                       for study in self.studies],
+                                     self.client.async_get_study_id('DUMMY'))
+        self.assertEqual(results, [study['study_id'] for study in self.studies] + [None])
+
+
+    def test_response_cache(self):
+        work_dir = f'{TEST_DIR}/work/api_response_cache'
+        make_work_dir(work_dir, clear_dir=True)
+
+        for _ in range(2):
+            with api.Client(url=TEST_URL, cache=ResponseCache(work_dir)) as client:
+                self.do_sucessful_test(client.get_study_id, 'pdc_study_id', 'study_id')
+                self.do_sucessful_test(client.get_study_name, 'study_id', 'study_name')
+                cache = client.cache
+
+        self.assertEqual(cache.misses, 0)
+        self.assertGreater(cache.hits, 0)
+
+
 class TestFileLevel(unittest.TestCase):
     def setUp(self):
         with open(data.FILE_METADATA, 'r', encoding='utf-8') as inF:
@@ -401,6 +424,22 @@ class TestSampleLevel(unittest.TestCase):
         self.assertSampleListEqual(file_ids_aliquots, gt_samples)
 
 
+    def test_file_batch_size(self):
+        test_study = 'PDC000592'
+        study_id = self.studies[test_study]['study_id']
+        gt_samples = self.sample_list_to_dict(self.samples[test_study])
+        all_file_ids = list(set(file_id for f in self.samples[test_study]
+                                for file_id in f['file_id_to_aliquot_run_metadata_id']))
+
+        # A batch size larger than the server accepts should fall back to smaller batches
+        with api.Client(url=TEST_URL) as client:
+            for batch_size in (1, 7, len(all_file_ids)):
+                test_samples = client.get_study_samples(study_id, page_limit=50,
+                                                        file_ids=all_file_ids,
+                                                        file_batch_size=batch_size)
+                self.assertSampleListEqual(self.sample_list_to_dict(test_samples), gt_samples)
+
+
 class TestCaseLevel(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
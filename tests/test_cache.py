@@ -0,0 +1,90 @@
+
+import os
+import unittest
+import time
+from unittest import mock
+
+from resources import TEST_DIR
+from resources.setup_functions import make_work_dir
+
+from PDC_client.submodules import cache
+from PDC_client.submodules.api import Client
+
+TEST_URL = 'http://127.0.0.1:5000/graphql'
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = f'{TEST_DIR}/work/response_cache'
+        make_work_dir(self.work_dir, clear_dir=True)
+        self.study_query = Client._study_metadata_query('pdc_study_id', 'PDC000504')
+
+
+    def test_query_endpoint(self):
+        self.assertEqual(cache.query_endpoint(Client._study_catalog_query('PDC000504')), 'studyCatalog')
+        self.assertEqual(cache.query_endpoint(self.study_query), 'study')
+        self.assertEqual(cache.query_endpoint(Client._study_case_query('id', 0, 10)),
+                         'paginatedCaseDemographicsPerStudy')
+        self.assertEqual(cache.query_endpoint(Client._file_aliquot_batch_query(['a', 'b'])),
+                         'fileMetadata')
+
+
+    def test_get_put(self):
+        response_cache = cache.ResponseCache(self.work_dir)
+        data = {'data': {'study': [{'study_id': 'test'}]}}
+
+        self.assertIsNone(response_cache.get(TEST_URL, self.study_query))
+        response_cache.put(TEST_URL, self.study_query, data)
+        self.assertDictEqual(response_cache.get(TEST_URL, self.study_query), data)
+        self.assertEqual(response_cache.hits, 1)
+        self.assertEqual(response_cache.misses, 1)
+
+        # base url is part of the key
+        self.assertIsNone(response_cache.get('http://other/graphql', self.study_query))
+
+        # entries persist across instances
+        self.assertDictEqual(cache.ResponseCache(self.work_dir).get(TEST_URL, self.study_query), data)
+
+
+    def test_ttl(self):
+        response_cache = cache.ResponseCache(self.work_dir, ttls={'study': 10})
+        response_cache.put(TEST_URL, self.study_query, {'data': None})
+
+        with mock.patch('time.time', return_value=time.time() + 11):
+            self.assertIsNone(response_cache.get(TEST_URL, self.study_query))
+        self.assertEqual(response_cache.size, 0)
+
+
+    def test_signed_url_not_cached(self):
+        response_cache = cache.ResponseCache(self.work_dir)
+        query = Client._study_raw_file_query('study_id')
+        response_cache.put(TEST_URL, query, {'data': None})
+        self.assertIsNone(response_cache.get(TEST_URL, query))
+        self.assertEqual(len(os.listdir(self.work_dir)), 0)
+
+
+    def test_lru_eviction(self):
+        queries = [Client._study_metadata_query('study_id', f'study_{i}') for i in range(4)]
+        data = {'data': {'study': ['x' * 1000]}}
+
+        response_cache = cache.ResponseCache(self.work_dir)
+        response_cache.put(TEST_URL, queries[0], data)
+        entry_size = response_cache.size
+        # leave some slack because the size of each entry can vary by a few bytes
+        response_cache.max_bytes = entry_size * 3 + entry_size // 2
+
+        # make queries[0] the oldest entry
+        now = time.time()
+        for i, query in enumerate(queries[:3]):
+            if i > 0:
+                response_cache.put(TEST_URL, query, data)
+            os.utime(response_cache._path(TEST_URL, query), (now - 10 + i, now - 10 + i))
+
+        # using queries[0] should make it the most recently used entry
+        self.assertIsNotNone(response_cache.get(TEST_URL, queries[0]))
+
+        response_cache.put(TEST_URL, queries[3], data)
+        self.assertLessEqual(response_cache.size, response_cache.max_bytes)
+        self.assertIsNone(response_cache.get(TEST_URL, queries[1]))
+        for query in (queries[0], queries[2], queries[3]):
+            self.assertIsNotNone(response_cache.get(TEST_URL, query))
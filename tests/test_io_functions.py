@@ -3,14 +3,22 @@ import os
 import unittest
 import json
 import re
+import time
 import random
+import calendar
+import hashlib
+from io import StringIO
+from unittest import mock
 
-from resources.setup_functions import make_work_dir, run_command
+import httpx
+
+from resources.setup_functions import make_work_dir, run_command, LocalFileServer
 from resources import TEST_DIR
 from resources.data import FILE_METADATA, SAMPLE_METADATA, CASE_METADATA, STUDY_METADATA
 from resources.data import PDC_TEST_URLS, TEST_URLS
 
 from PDC_client.submodules import io
+from PDC_client.submodules.records import FileRecord, AliquotRecord, CaseRecord
 
 
 class TestMd5(unittest.TestCase):
@@ -83,6 +91,52 @@ class TestMetadataFunctions(unittest.TestCase):
                     self.assertIsInstance(value, str, f'Value for key "{key}" is not a string!')
 
 
+    def test_flatten_does_not_modify_input(self):
+        for pdc_study_id in self.study_types['dia']:
+            data = {'study_metadata': self.studies[pdc_study_id],
+                    'files': self.files[pdc_study_id],
+                    'aliquots': self.aliquots[pdc_study_id],
+                    'cases': self.cases[pdc_study_id]}
+            original = json.dumps(data)
+
+            flat_data = io.flatten_metadata(**data)
+            self.assertEqual(json.dumps(data), original)
+            self.assertEqual(len(flat_data), len(data['files']))
+            for file, flat_file in zip(data['files'], flat_data):
+                self.assertIsNot(file, flat_file)
+                self.assertEqual(flat_file['file_id'], file['file_id'])
+
+
+    def test_flatten_records(self):
+        work_dir = f'{TEST_DIR}/work/write_metadata_records'
+        make_work_dir(work_dir, clear_dir=True)
+        for pdc_study_id in self.study_types['dia']:
+            files = [{k: file.get(k) for k in FileRecord.KEYS} for file in self.files[pdc_study_id]]
+            data = {'study_metadata': self.studies[pdc_study_id],
+                    'files': files,
+                    'aliquots': self.aliquots[pdc_study_id],
+                    'cases': self.cases[pdc_study_id]}
+            records = {'study_metadata': self.studies[pdc_study_id],
+                       'files': [FileRecord.from_dict(file) for file in files],
+                       'aliquots': [AliquotRecord.from_dict(a) for a in self.aliquots[pdc_study_id]],
+                       'cases': [CaseRecord.from_dict(case) for case in self.cases[pdc_study_id]]}
+
+            flat_data = io.flatten_metadata(**records)
+            self.assertEqual(flat_data, io.flatten_metadata(**data))
+            for row in flat_data:
+                self.assertIsInstance(row, dict)
+
+            # records are written the same as the equivalent dicts
+            for format in ('json', 'jsonl', 'tsv'):
+                io.write_metadata_file(records['aliquots'], f'{work_dir}/records.{format}', format=format)
+                io.write_metadata_file([a.to_dict() for a in records['aliquots']],
+                                       f'{work_dir}/dicts.{format}', format=format)
+                with open(f'{work_dir}/records.{format}', 'r', encoding='utf-8') as inF:
+                    records_text = inF.read()
+                with open(f'{work_dir}/dicts.{format}', 'r', encoding='utf-8') as inF:
+                    self.assertEqual(records_text, inF.read())
+
+
     def test_flatten_dda_study(self):
         for pdc_study_id in self.study_types['dda']:
             data = {'study_metadata': self.studies[pdc_study_id],
@@ -125,6 +179,103 @@ class TestMetadataFunctions(unittest.TestCase):
         self.assertEqual(len(data), len(self.files[test_study]))
 
 
+    def test_write_metadata_rows(self):
+        work_dir = f'{TEST_DIR}/work/write_metadata'
+        make_work_dir(work_dir, clear_dir=True)
+        pdc_study_id = self.study_types['dia'][0]
+        data = {'study_metadata': self.studies[pdc_study_id],
+                'files': self.files[pdc_study_id],
+                'aliquots': self.aliquots[pdc_study_id],
+                'cases': self.cases[pdc_study_id]}
+        flat_data = io.flatten_metadata(**data)
+
+        # json output should be the same as json.dump
+        io.write_metadata_rows(io.iter_flatten_metadata(**data), f'{work_dir}/flat.json')
+        with open(f'{work_dir}/flat.json', 'r', encoding='utf-8') as inF:
+            self.assertEqual(inF.read(), json.dumps(flat_data, indent=2))
+
+        io.write_metadata_rows(io.iter_flatten_metadata(**data), f'{work_dir}/flat.jsonl', format='jsonl')
+        with open(f'{work_dir}/flat.jsonl', 'r', encoding='utf-8') as inF:
+            self.assertEqual([json.loads(line) for line in inF], flat_data)
+
+        io.write_metadata_rows(iter(flat_data), f'{work_dir}/flat.tsv', format='tsv')
+        with open(f'{work_dir}/flat.tsv', 'r', encoding='utf-8') as inF:
+            tsv_data = io.read_file_metadata(inF, format='tsv')
+        self.assertEqual(tsv_data, [{k: '' if v is None else str(v) for k, v in row.items()}
+                                    for row in flat_data])
+
+        # tsv output should be the same as writing each row with _write_row, so
+        # values with quote characters are not quoted or escaped
+        quoted_rows = flat_data[:2] + [{**flat_data[2], 'file_name': 'sample "A", \'1\'.raw'}]
+        io.write_metadata_rows(iter(quoted_rows), f'{work_dir}/quoted.tsv', format='tsv')
+        target = StringIO()
+        io._write_row(quoted_rows[0].keys(), target)
+        for row in quoted_rows:
+            io._write_row(row.values(), target)
+        with open(f'{work_dir}/quoted.tsv', 'r', encoding='utf-8', newline='') as inF:
+            self.assertEqual(inF.read(), target.getvalue())
+
+        # the partial file should be removed if the keys don't match
+        bad_rows = flat_data[:2] + [{'file_id': 'bad_file'}]
+        with self.assertRaises(KeyError):
+            io.write_metadata_rows(iter(bad_rows), f'{work_dir}/bad.tsv', format='tsv')
+        self.assertFalse(os.path.exists(f'{work_dir}/bad.tsv'))
+
+
+    @unittest.skipUnless(io.pyarrow_available(), 'pyarrow is not installed')
+    def test_write_columnar(self):
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.feather
+
+        work_dir = f'{TEST_DIR}/work/write_metadata_columnar'
+        make_work_dir(work_dir, clear_dir=True)
+        pdc_study_id = self.study_types['dia'][0]
+        data = {'study_metadata': self.studies[pdc_study_id],
+                'files': self.files[pdc_study_id],
+                'aliquots': self.aliquots[pdc_study_id],
+                'cases': self.cases[pdc_study_id]}
+        flat_data = io.flatten_metadata(**data)
+
+        def target_value(key, value):
+            if key in io.INTEGER_COLUMNS and value is not None:
+                return int(value)
+            return value
+
+        targets = {'flat': [{k: target_value(k, v) for k, v in row.items()} for row in flat_data],
+                   'aliquots': [{k: list(v.items()) if isinstance(v, dict) else v for k, v in row.items()}
+                                for row in data['aliquots']]}
+
+        for format, read_table in (('parquet', pyarrow.parquet.read_table),
+                                   ('arrow', pyarrow.feather.read_table)):
+            io.write_metadata_rows(io.iter_flatten_metadata(**data), f'{work_dir}/flat.{format}', format=format)
+            io.write_metadata_file(data['aliquots'], f'{work_dir}/aliquots.{format}', format=format)
+
+            for name, target in targets.items():
+                table = read_table(f'{work_dir}/{name}.{format}')
+                self.assertEqual(table.column_names, list(target[0].keys()))
+                self.assertEqual(table.to_pylist(), target)
+                for column in io.CATEGORICAL_COLUMNS:
+                    if column in table.column_names:
+                        self.assertTrue(pyarrow.types.is_dictionary(table.schema.field(column).type), column)
+
+            schema = read_table(f'{work_dir}/flat.{format}').schema
+            self.assertEqual(schema.field('file_size').type, pyarrow.int64())
+            self.assertEqual(schema.field('year_of_birth').type, pyarrow.int64())
+
+
+    def test_columnar_requires_pyarrow(self):
+        work_dir = f'{TEST_DIR}/work/write_metadata_no_pyarrow'
+        make_work_dir(work_dir, clear_dir=True)
+        pdc_study_id = self.study_types['dia'][0]
+
+        with mock.patch.dict('sys.modules', {'pyarrow': None}):
+            self.assertFalse(io.pyarrow_available())
+            with self.assertRaisesRegex(ImportError, 'pip install pyarrow'):
+                io.write_metadata_file(self.files[pdc_study_id], f'{work_dir}/files.parquet', format='parquet')
+        self.assertFalse(os.path.exists(f'{work_dir}/files.parquet'))
+
+
     def test_missing_case(self):
         for pdc_study_id in self.study_types['dia']:
             data = {'study_metadata': self.studies[pdc_study_id],
@@ -167,6 +318,97 @@ class TestDownloadFile(unittest.TestCase):
             self.assertEqual(os.path.getsize(f'{self.work_dir}/{file["file_name"]}'), file['file_size'])
 
 
+    def test_http_get_digest(self):
+        file = TEST_URLS[0]
+        target_file_name = f'{self.work_dir}/{file["file_name"]}'
+        digest = io.http_get(file['url'], target_file_name)
+        self.assertEqual(digest, (io.md5_sum(target_file_name), os.path.getsize(target_file_name)))
+
+        # the md5 sum should be computed while the file is downloaded
+        with mock.patch.object(io, 'md5_sum', side_effect=AssertionError('File re-read!')):
+            self.assertTrue(io.download_file(file['url'], target_file_name,
+                                             expected_md5=file['md5sum'],
+                                             expected_size=file['file_size']))
+
+
+    def write_partial_file(self, file, ofname, n_bytes, validator):
+        with open(file['path'], 'rb') as inF:
+            data = inF.read(n_bytes)
+        with open(f'{ofname}.part', 'wb') as outF:
+            outF.write(data)
+        with open(f'{ofname}.part.json', 'w', encoding='utf-8') as outF:
+            json.dump({'bytes': n_bytes, 'validator': validator}, outF)
+        if os.path.isfile(ofname):
+            os.remove(ofname)
+
+
+    def test_resume_download(self):
+        file = TEST_URLS[0]
+        target_file_name = f'{self.work_dir}/resume_{file["file_name"]}'
+        response = httpx.head(file['url'])
+        validator = response.headers.get('etag') or response.headers.get('last-modified')
+        self.assertIsNotNone(validator)
+
+        n_bytes = file['file_size'] // 2
+        self.write_partial_file(file, target_file_name, n_bytes, validator)
+        with self.assertLogs(level='INFO') as cm:
+            self.assertTrue(io.download_file(file['url'], target_file_name,
+                                             expected_md5=file['md5sum'],
+                                             expected_size=file['file_size']))
+
+        self.assertTrue(any(f'Resuming download of "{target_file_name}" at byte {n_bytes}' in msg
+                            for msg in cm.output), cm.output)
+        self.assertFalse(os.path.isfile(f'{target_file_name}.part'))
+        self.assertFalse(os.path.isfile(f'{target_file_name}.part.json'))
+
+
+    def test_resume_changed_file(self):
+        file = TEST_URLS[0]
+        target_file_name = f'{self.work_dir}/resume_changed_{file["file_name"]}'
+
+        # a validator which does not match should cause the download to restart
+        self.write_partial_file(file, target_file_name, 10, '"not_a_valid_etag"')
+        with self.assertLogs(level='WARNING') as cm:
+            self.assertTrue(io.download_file(file['url'], target_file_name,
+                                             expected_md5=file['md5sum'],
+                                             expected_size=file['file_size']))
+
+        self.assertTrue(any(f'Server did not resume download of "{target_file_name}"' in msg
+                            for msg in cm.output), cm.output)
+        self.assertFalse(os.path.isfile(f'{target_file_name}.part'))
+
+
+    def test_http_range_size(self):
+        file = TEST_URLS[0]
+        self.assertEqual(io.http_range_size(file['url']), file['file_size'])
+
+
+    def test_segmented_download(self):
+        file = TEST_URLS[0]
+        target_file_name = f'{self.work_dir}/segmented_{file["file_name"]}'
+
+        with mock.patch.object(io, 'SEGMENTED_DOWNLOAD_THRESHOLD', 0), \
+             mock.patch.object(io, 'http_get', side_effect=AssertionError('Used single stream!')):
+            self.assertTrue(io.download_file(file['url'], target_file_name,
+                                             expected_md5=file['md5sum'],
+                                             expected_size=file['file_size'],
+                                             n_segments=3))
+
+        self.assertEqual(io.md5_sum(target_file_name), file['md5sum'])
+        self.assertEqual(os.path.getsize(target_file_name), file['file_size'])
+        self.assertFalse(os.path.isfile(f'{target_file_name}.part'))
+
+
+    def test_segment_ranges(self):
+        for size, n_segments in ((10, 3), (9, 3), (2, 4), (1000, 7)):
+            ranges = io._segment_ranges(size, n_segments)
+            self.assertLessEqual(len(ranges), n_segments)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], size - 1)
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(start, end + 1)
+
+
     def test_bad_md5(self):
         file = TEST_URLS[0]
         target_md5 = io.md5_sum(f'{TEST_DIR}/../Dockerfile')
@@ -230,4 +472,226 @@ class TestDownloadFile(unittest.TestCase):
                                              n_retries=1))
 
         self.assertTrue(any(f'Skipping size check for file "{target_file_name}"' in msg
-                            for msg in cm.output), cm.output)
\ No newline at end of file
+                            for msg in cm.output), cm.output)
+
+
+    def test_download_files(self):
+        work_dir = f'{TEST_DIR}/work/download_files'
+        make_work_dir(work_dir, clear_dir=True)
+
+        files = [{'file_name': file['file_name'], 'url': file['url'],
+                  'md5sum': file['md5sum'], 'file_size': file['file_size']}
+                 for file in TEST_URLS]
+        files.append({'file_name': 'bad_url.txt', 'url': 'https://www.nowwhere.com/this/is/a/bad/url',
+                      'md5sum': None, 'file_size': None})
+
+        with self.assertLogs(level='ERROR') as cm:
+            results = io.download_files(files, output_dir=work_dir, n_jobs=2, n_retries=1)
+
+        self.assertFalse(results.pop('bad_url.txt'))
+        self.assertTrue(any(f'Failed to download file "{work_dir}/bad_url.txt" after 1 attempt(s)' in msg
+                            for msg in cm.output), cm.output)
+
+        for file in TEST_URLS:
+            self.assertTrue(results[file['file_name']])
+            self.assertEqual(io.md5_sum(f'{work_dir}/{file["file_name"]}'), file['md5sum'])
+            self.assertEqual(os.path.getsize(f'{work_dir}/{file["file_name"]}'), file['file_size'])
+
+
+# Data of the file downloaded in segments
+SEGMENTED_DATA = random.Random(0).randbytes(200 * 1024)
+SEGMENTED_MD5 = hashlib.md5(SEGMENTED_DATA).hexdigest()
+
+
+class TestSegmentedDownloads(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = f'{TEST_DIR}/work/segmented_downloads'
+        make_work_dir(cls.work_dir, clear_dir=True)
+        cls.server = LocalFileServer({'file.raw': SEGMENTED_DATA}).start()
+        cls.url = cls.server.url('file.raw')
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+
+    def setUp(self):
+        self.server.max_bytes = None
+
+
+    def download(self, ofname, n_retries=2):
+        with mock.patch.object(io, 'SEGMENTED_DOWNLOAD_THRESHOLD', 0), \
+             mock.patch.object(io, 'SEGMENT_CHUNK_SIZE', 1024):
+            return io.download_file(self.url, ofname, expected_md5=SEGMENTED_MD5,
+                                    expected_size=len(SEGMENTED_DATA),
+                                    n_retries=n_retries, n_segments=4)
+
+
+    def read_state(self, ofname):
+        with open(f'{ofname}.part.json', 'r', encoding='utf-8') as inF:
+            return json.load(inF)
+
+
+    def test_resume_interrupted(self):
+        ofname = f'{self.work_dir}/interrupted.raw'
+
+        # every segment is cut off part way through
+        self.server.max_bytes = 10000
+        with self.assertLogs(level='ERROR'):
+            self.assertFalse(self.download(ofname, n_retries=1))
+        self.assertFalse(os.path.isfile(ofname))
+        self.assertEqual(os.path.getsize(f'{ofname}.part'), len(SEGMENTED_DATA))
+        n_finished = sum(end + 1 - start for start, end in self.read_state(ofname)['ranges'])
+        self.assertGreater(n_finished, 0)
+        self.assertLess(n_finished, len(SEGMENTED_DATA))
+
+        # only the byte ranges which are not finished are downloaded again
+        self.server.max_bytes = None
+        bytes_sent = self.server.bytes_sent
+        with self.assertLogs(level='INFO') as cm:
+            self.assertTrue(self.download(ofname))
+        self.assertTrue(any('Resuming segmented download' in msg for msg in cm.output), cm.output)
+        # plus the single byte requested to get the file size
+        self.assertEqual(self.server.bytes_sent - bytes_sent, len(SEGMENTED_DATA) - n_finished + 1)
+        self.assertEqual(io.md5_sum(ofname), SEGMENTED_MD5)
+        self.assertFalse(os.path.isfile(f'{ofname}.part'))
+        self.assertFalse(os.path.isfile(f'{ofname}.part.json'))
+
+
+    def test_resume_changed_file(self):
+        ofname = f'{self.work_dir}/changed.raw'
+        with open(f'{ofname}.part', 'wb') as outF:
+            outF.write(bytes(len(SEGMENTED_DATA)))
+        with open(f'{ofname}.part.json', 'w', encoding='utf-8') as outF:
+            json.dump({'size': len(SEGMENTED_DATA), 'validator': '"not_a_valid_etag"',
+                       'ranges': [[0, 999]]}, outF)
+
+        with self.assertLogs(level='WARNING') as cm:
+            self.assertFalse(self.download(ofname, n_retries=1))
+        self.assertTrue(any(f'File "{ofname}" changed on the server' in msg for msg in cm.output), cm.output)
+        self.assertFalse(os.path.isfile(f'{ofname}.part'))
+
+        self.assertTrue(self.download(ofname))
+        self.assertEqual(io.md5_sum(ofname), SEGMENTED_MD5)
+
+
+    def test_resume_single_stream(self):
+        ofname = f'{self.work_dir}/single_stream.raw'
+        n_bytes = len(SEGMENTED_DATA) // 3
+        with open(f'{ofname}.part', 'wb') as outF:
+            outF.write(SEGMENTED_DATA[:n_bytes])
+        with open(f'{ofname}.part.json', 'w', encoding='utf-8') as outF:
+            json.dump({'bytes': n_bytes, 'validator': f'"{SEGMENTED_MD5}"'}, outF)
+
+        # an interrupted single stream download is resumed instead of being truncated
+        with mock.patch.object(io, 'segmented_http_get', side_effect=AssertionError('Restarted in segments!')), \
+             self.assertLogs(level='INFO') as cm:
+            self.assertTrue(self.download(ofname))
+        self.assertTrue(any(f'Resuming download of "{ofname}" at byte {n_bytes}' in msg
+                            for msg in cm.output), cm.output)
+        self.assertEqual(io.md5_sum(ofname), SEGMENTED_MD5)
+
+
+# Data of the files served to signed urls
+SIGNED_URL_DATA = b'signed url test data\n' * 100
+
+
+class TestSignedUrls(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = f'{TEST_DIR}/work/signed_urls'
+        # urls which are expired or stale are forbidden
+        cls.server = LocalFileServer({f'file_{i}.raw': SIGNED_URL_DATA for i in range(5)},
+                                     forbidden=lambda path: 'token=stale' in path or
+                                                            io.url_expires_soon(path, margin=0)).start()
+        cls.base_url = cls.server.base_url
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+
+    def setUp(self):
+        make_work_dir(self.work_dir, clear_dir=True)
+        self.server.n_requests = 0
+        self.server.n_forbidden = 0
+
+
+    def signed_url(self, file_name, signed_ago=0, expires=3600):
+        date = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(time.time() - signed_ago))
+        return f'{self.base_url}/{file_name}?X-Amz-Date={date}&X-Amz-Expires={expires}&X-Amz-Signature=abc'
+
+
+    def files(self, n_files, url):
+        return [{'file_name': f'file_{i}.raw', 'url': url(f'file_{i}.raw'),
+                 'md5sum': hashlib.md5(SIGNED_URL_DATA).hexdigest(),
+                 'file_size': len(SIGNED_URL_DATA)} for i in range(n_files)]
+
+
+    def refresher(self, calls):
+        async def refresh_urls(batch):
+            calls.append([file['file_name'] for file in batch])
+            return {file['file_name']: self.signed_url(file['file_name']) for file in batch}
+        return refresh_urls
+
+
+    def test_url_expiry(self):
+        signed = calendar.timegm((2025, 1, 2, 3, 4, 5, 0, 0, 0))
+        self.assertEqual(io.url_expiry('https://bucket.s3.amazonaws.com/a.raw?X-Amz-Algorithm=AWS4-HMAC-SHA256'
+                                       '&X-Amz-Date=20250102T030405Z&X-Amz-Expires=900&X-Amz-Signature=abc'),
+                         signed + 900)
+        self.assertEqual(io.url_expiry('https://bucket.s3.amazonaws.com/a.raw?AWSAccessKeyId=x'
+                                       '&Expires=1735787045&Signature=abc'), 1735787045)
+        self.assertIsNone(io.url_expiry('https://bucket.s3.amazonaws.com/a.raw'))
+        self.assertIsNone(io.url_expiry('s3://pdcdatastore/a.raw'))
+        with self.assertLogs(level='WARNING'):
+            self.assertIsNone(io.url_expiry('https://host/a.raw?X-Amz-Date=yesterday&X-Amz-Expires=900'))
+
+        self.assertTrue(io.url_expires_soon(self.signed_url('a.raw', signed_ago=3600, expires=60)))
+        self.assertTrue(io.url_expires_soon(self.signed_url('a.raw', expires=60)))
+        self.assertFalse(io.url_expires_soon(self.signed_url('a.raw', expires=3600)))
+        self.assertFalse(io.url_expires_soon('https://host/a.raw'))
+
+
+    def test_refresh_expired_urls(self):
+        files = self.files(5, lambda name: self.signed_url(name, signed_ago=3600, expires=60))
+        calls = list()
+        results = io.download_files(files, output_dir=self.work_dir, n_jobs=1,
+                                    refresh_urls=self.refresher(calls))
+
+        self.assertTrue(all(results.values()), results)
+        # every url is refreshed in a single batch before the first download
+        self.assertEqual(calls, [[file['file_name'] for file in files]])
+        self.assertEqual(self.server.n_forbidden, 0)
+
+
+    def test_refresh_forbidden_urls(self):
+        files = self.files(5, lambda name: f'{self.base_url}/{name}?token=stale')
+        calls = list()
+        with self.assertLogs(level='WARNING') as cm:
+            results = io.download_files(files, output_dir=self.work_dir, n_jobs=2,
+                                        refresh_urls=self.refresher(calls))
+
+        self.assertTrue(all(results.values()), results)
+        self.assertEqual(sorted(name for call in calls for name in call),
+                         sorted(file['file_name'] for file in files))
+        self.assertLessEqual(self.server.n_forbidden, 2)
+        self.assertTrue(any('Refreshing signed url' in msg for msg in cm.output), cm.output)
+
+
+    def test_forbidden_without_refresh(self):
+        files = self.files(2, lambda name: f'{self.base_url}/{name}?token=stale')
+        with self.assertLogs(level='ERROR') as cm:
+            results = io.download_files(files, output_dir=self.work_dir, n_jobs=1, n_retries=3)
+
+        self.assertFalse(any(results.values()))
+        # a 403 is not retried
+        self.assertEqual(self.server.n_requests, 2)
+        self.assertTrue(any('The url may have expired' in msg for msg in cm.output), cm.output)
+
+        ofname = f'{self.work_dir}/{files[0]["file_name"]}'
+        self.assertIsNone(io.http_get(files[0]['url'], ofname, n_retries=3))
+        self.assertEqual(self.server.n_requests, 3)
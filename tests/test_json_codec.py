@@ -0,0 +1,58 @@
+
+import unittest
+import json
+import glob
+
+from resources import TEST_DIR
+
+from PDC_client.submodules import json_codec
+
+EDGE_CASES = [{'a': [], 'b': {}, 'c': [1, {'x': None}], 'd': [True, False]},
+              {'unicode': 'café   \U0001f600 \x7f \x01 "quoted" back\\slash /'},
+              {'floats': [0.0, -0.0, 0.1, 1e-4, 1e-5, 1.5e-7, 1e15, 1e16, 1.2345e21, 123.456]},
+              {'nan': float('nan'), 'inf': float('inf'), '-inf': float('-inf')},
+              {'big_int': 2 ** 70, 'small_int': -2 ** 63},
+              {1: 'int key', 'tuple': (1, 2.5e-9, 'three')},
+              'string', 42, None, []]
+
+
+class TestJsonCodec(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.api_data = list()
+        for fname in sorted(glob.glob(f'{TEST_DIR}/resources/data/api/*.json')):
+            with open(fname, 'rb') as inF:
+                cls.api_data.append(inF.read())
+        cls.codecs = [json_codec.get_codec(backend) for backend in json_codec.available_backends()]
+
+
+    def test_backends(self):
+        self.assertEqual(json_codec.available_backends()[-1], 'json')
+        self.assertEqual(json_codec.CODEC.name, json_codec.available_backends()[0])
+        with self.assertRaises(ValueError):
+            json_codec.get_codec('DUMMY')
+
+
+    def test_pretty_is_identical(self):
+        data = [json.loads(text) for text in self.api_data] + EDGE_CASES
+        for codec in self.codecs:
+            for obj in data:
+                self.assertEqual(codec.dumps(obj, pretty=True), json.dumps(obj, indent=2), codec.name)
+
+
+    def test_compact_round_trip(self):
+        data = [json.loads(text) for text in self.api_data] + EDGE_CASES[:3]
+        for codec in self.codecs:
+            for obj in data:
+                text = codec.dumps(obj)
+                self.assertNotIn('\n', text)
+                self.assertEqual(json.loads(text), obj, codec.name)
+
+
+    def test_loads(self):
+        for codec in self.codecs:
+            for text in self.api_data:
+                self.assertEqual(codec.loads(text), json.loads(text), codec.name)
+                self.assertEqual(codec.loads(text.decode('utf-8')), json.loads(text), codec.name)
+            with self.assertRaises(ValueError):
+                codec.loads(b'{"a": ')
@@ -0,0 +1,89 @@
+
+import unittest
+import asyncio
+import time
+from email.utils import formatdate
+
+from PDC_client.submodules.limiter import AdaptiveLimiter, parse_retry_after
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('2'), 2.0)
+        self.assertEqual(parse_retry_after(' 0.5 '), 0.5)
+        self.assertAlmostEqual(parse_retry_after(formatdate(time.time() + 30, usegmt=True)), 30, delta=2)
+        self.assertEqual(parse_retry_after(formatdate(time.time() - 30, usegmt=True)), 0)
+        self.assertIsNone(parse_retry_after('not a date'))
+        self.assertIsNone(parse_retry_after(None))
+
+
+    def test_invalid_limits(self):
+        with self.assertRaises(ValueError):
+            AdaptiveLimiter(initial_limit=0)
+        with self.assertRaises(ValueError):
+            AdaptiveLimiter(initial_limit=10, max_limit=5)
+        with self.assertRaises(ValueError):
+            AdaptiveLimiter(decrease=1)
+
+
+    def test_additive_increase(self):
+        limiter = AdaptiveLimiter(initial_limit=2, max_limit=4)
+
+        async def run():
+            for _ in range(50):
+                await limiter.release(await limiter.acquire())
+
+        asyncio.run(run())
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.n_backoffs, 0)
+
+
+    def test_multiplicative_decrease(self):
+        limiter = AdaptiveLimiter(initial_limit=8, max_limit=8)
+
+        async def request():
+            start = await limiter.acquire()
+            await asyncio.sleep(0.01)
+            await limiter.release(start, overloaded=True)
+
+        async def run():
+            await asyncio.gather(*[request() for _ in range(8)])
+
+        # all the failures are from the same window so the limit is only decreased once
+        asyncio.run(run())
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.n_backoffs, 1)
+
+        # the limit can't go below min_limit
+        for _ in range(5):
+            asyncio.run(run())
+        self.assertEqual(limiter.limit, 1)
+
+
+    def test_peak_in_flight(self):
+        limiter = AdaptiveLimiter(initial_limit=3, max_limit=3)
+
+        async def request():
+            start = await limiter.acquire()
+            self.assertLessEqual(limiter.in_flight, 3)
+            await asyncio.sleep(0.01)
+            await limiter.release(start)
+
+        async def run():
+            await asyncio.gather(*[request() for _ in range(10)])
+
+        asyncio.run(run())
+        self.assertEqual(limiter.peak_in_flight, 3)
+        self.assertEqual(limiter.in_flight, 0)
+
+
+    def test_retry_after(self):
+        limiter = AdaptiveLimiter()
+
+        async def run():
+            await limiter.release(await limiter.acquire(), overloaded=True, retry_after=0.3)
+            start = time.monotonic()
+            await limiter.release(await limiter.acquire())
+            return time.monotonic() - start
+
+        self.assertGreaterEqual(asyncio.run(run()), 0.25)
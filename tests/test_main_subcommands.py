@@ -1,5 +1,7 @@
 
 import os
+import json
+import shutil
 import unittest
 import random
 from csv import DictReader
@@ -9,8 +11,9 @@ from resources import TEST_DIR, setup_functions
 from resources.mock_graphql_server.data import Data
 from resources.data import PDC_TEST_FILE_IDS, TEST_URLS
 
-from PDC_client.submodules.io import is_dia, md5_sum
+from PDC_client.submodules.io import is_dia, md5_sum, pyarrow_available
 from PDC_client.submodules.api import Client
+from PDC_client.submodules.manifest import DownloadManifest, MANIFEST_NAME
 
 
 TEST_PDC_STUDY_ID = 'PDC000504'
@@ -163,6 +166,46 @@ class TestMetadataSubcommand(unittest.TestCase, SkylineAnnotationsTestBase):
         self.assertTrue(os.path.getsize(f'{self.work_dir}/{target_file}'))
 
 
+    def test_flatten_jsonl(self):
+        pdc_study_id = self.get_test_study(dda=False, seed=40)
+        study_id = self.api_data.get_study_id(pdc_study_id)
+
+        prefix = f'{pdc_study_id}_flatten_jsonl_test_'
+        args = ['PDC_client', 'metadata', f'--prefix={prefix}',
+                '--flatten', '--format=jsonl',
+                '-u', TEST_URL, study_id]
+        result = setup_functions.run_command(args, self.work_dir, prefix='default')
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        target_file = f'{self.work_dir}/{prefix}flat.jsonl'
+        self.assertTrue(os.path.exists(target_file),
+                        f"target_file '{target_file}' not found in {self.work_dir}")
+        with open(target_file, 'r', encoding='utf-8') as inF:
+            rows = [json.loads(line) for line in inF]
+        self.assertEqual(len(rows), len(self.api_data.files_per_study[study_id]))
+
+
+    @unittest.skipUnless(pyarrow_available(), 'pyarrow is not installed')
+    def test_flatten_parquet(self):
+        import pyarrow.parquet
+
+        pdc_study_id = self.get_test_study(dda=False, seed=40)
+        study_id = self.api_data.get_study_id(pdc_study_id)
+
+        prefix = f'{pdc_study_id}_flatten_parquet_test_'
+        args = ['PDC_client', 'metadata', f'--prefix={prefix}',
+                '--flatten', '--format=parquet',
+                '-u', TEST_URL, study_id]
+        result = setup_functions.run_command(args, self.work_dir, prefix='default')
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        target_file = f'{self.work_dir}/{prefix}flat.parquet'
+        self.assertTrue(os.path.exists(target_file),
+                        f"target_file '{target_file}' not found in {self.work_dir}")
+        table = pyarrow.parquet.read_table(target_file)
+        self.assertEqual(table.num_rows, len(self.api_data.files_per_study[study_id]))
+
+
     def test_flatten_dda_fails(self):
         pdc_study_id = self.get_test_study(dda=True, seed=3)
         study_id = self.api_data.get_study_id(pdc_study_id)
@@ -185,6 +228,57 @@ class TestMetadataSubcommand(unittest.TestCase, SkylineAnnotationsTestBase):
         self.assertIn(f'Could not retrieve metadata for study: {study_id}', result.stderr)
 
 
+    def test_multiple_studies(self):
+        pdc_study_ids = [self.get_test_study(dda=False, seed=40), self.get_test_study(dda=True, seed=3)]
+        study_ids = [self.api_data.get_study_id(pdc_study_id) for pdc_study_id in pdc_study_ids]
+        invalid_study_id = 'INVALID_STUDY_ID'
+        # the queries for a study_id this long are rejected, so fetching the study raises QueryTooLargeError
+        too_large_study_id = 'X' * 10000
+
+        study_id_file = f'{self.work_dir}/study_ids.txt'
+        with open(study_id_file, 'w', encoding='utf-8') as outF:
+            outF.write(f'# test studies\n{study_ids[1]}\n\n{invalid_study_id}\n{too_large_study_id}\n')
+
+        prefix = 'multiple_studies_'
+        args = ['PDC_client', 'metadata', f'--prefix={prefix}', '--studyIDFile', study_id_file,
+                '-u', TEST_URL, study_ids[0]]
+        result = setup_functions.run_command(args, self.work_dir, prefix='multiple_studies')
+
+        # the failed studies should not stop the other studies from being written
+        self.assertEqual(result.returncode, 1)
+        self.assertIn(f'Could not retrieve metadata for study: {invalid_study_id}', result.stderr)
+        self.assertIn(f"Could not get metadata for study '{too_large_study_id}': QueryTooLargeError",
+                      result.stderr)
+        self.assertIn(f'Failed to get metadata for 2 of 4 studies: {invalid_study_id}, {too_large_study_id}',
+                      result.stderr)
+        self.assertNotIn('Traceback', result.stderr)
+        for pdc_study_id in pdc_study_ids:
+            for name in ('study_metadata', 'files', 'aliquots', 'cases'):
+                target_file = f'{self.work_dir}/{prefix}{pdc_study_id}_{name}.json'
+                self.assertTrue(os.path.isfile(target_file), f"target_file '{target_file}' not found")
+
+
+    def test_write_error(self):
+        pdc_study_ids = [TEST_PDC_STUDY_ID, self.get_test_study(dda=True, seed=3)]
+        study_ids = [self.api_data.get_study_id(pdc_study_id) for pdc_study_id in pdc_study_ids]
+
+        # a directory in place of an output file makes writing the first study fail
+        prefix = 'write_error_'
+        blocked_path = f'{self.work_dir}/{prefix}{pdc_study_ids[0]}_files.json'
+        os.makedirs(blocked_path, exist_ok=True)
+        self.addCleanup(os.rmdir, blocked_path)
+
+        args = ['PDC_client', 'metadata', f'--prefix={prefix}', '-u', TEST_URL] + study_ids
+        result = setup_functions.run_command(args, self.work_dir, prefix='write_error')
+
+        self.assertEqual(result.returncode, 1)
+        self.assertIn(f"Could not write metadata for study '{study_ids[0]}'", result.stderr)
+        self.assertIn(f'Failed to get metadata for 1 of 2 studies: {study_ids[0]}', result.stderr)
+        for name in ('study_metadata', 'files', 'aliquots', 'cases'):
+            target_file = f'{self.work_dir}/{prefix}{pdc_study_ids[1]}_{name}.json'
+            self.assertTrue(os.path.isfile(target_file), f"target_file '{target_file}' not found")
+
+
     def test_skyline_annotations(self):
         test_pdc_study_id = self.SKYLINE_ANNOTATIONS_PDC_STUDY_ID
         study_id = self.api_data.get_study_id(test_pdc_study_id)
@@ -207,6 +301,44 @@ class TestMetadataSubcommand(unittest.TestCase, SkylineAnnotationsTestBase):
         self.assertSkylineAnnotationsEqual(test_annotations_file, self.TARGET_SKYLINE_ANNOTATIONS)
 
 
+class TestSnapshotSubcommand(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = f'{TEST_DIR}/work/snapshot_subcommand'
+        setup_functions.make_work_dir(cls.work_dir, clear_dir=True)
+        cls.api_data = Data()
+        cls.snapshot_dir = f'{TEST_DIR}/work/snapshot_subcommand_snapshots'
+        setup_functions.make_work_dir(cls.snapshot_dir, clear_dir=True)
+
+
+    def test_offline_metadata(self):
+        study_id = self.api_data.get_study_id(TEST_PDC_STUDY_ID)
+
+        args = ['PDC_client', 'snapshot', '-u', TEST_URL, '--snapshotDir', self.snapshot_dir, study_id]
+        result = setup_functions.run_command(args, self.work_dir, prefix='snapshot')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertTrue(os.path.isfile(f'{self.snapshot_dir}/{study_id}.json.gz'))
+
+        for prefix, extra_args in (('online_', ['-u', TEST_URL]),
+                                   ('offline_', ['--offline', '--snapshotDir', self.snapshot_dir])):
+            args = ['PDC_client', 'metadata', f'--prefix={prefix}', '--flatten', '--format=tsv'] + extra_args + [study_id]
+            result = setup_functions.run_command(args, self.work_dir, prefix=prefix.rstrip('_'))
+            self.assertEqual(result.returncode, 0, result.stderr)
+
+        with open(f'{self.work_dir}/online_flat.tsv', 'r', encoding='utf-8') as inF:
+            online_data = inF.read()
+        with open(f'{self.work_dir}/offline_flat.tsv', 'r', encoding='utf-8') as inF:
+            offline_data = inF.read()
+        self.assertEqual(offline_data, online_data)
+
+
+    def test_offline_missing_study(self):
+        args = ['PDC_client', 'studyName', '--offline', '--snapshotDir', self.snapshot_dir, 'DUMMY']
+        result = setup_functions.run_command(args, self.work_dir, prefix='missing_study')
+        self.assertEqual(result.returncode, 1)
+        self.assertIn('No study found matching study_id!', result.stderr)
+
+
 class TestMetadataToSky(unittest.TestCase, SkylineAnnotationsTestBase):
     @classmethod
     def setUpClass(cls):
@@ -309,3 +441,57 @@ class TestFileSubcommands(unittest.TestCase):
             self.assertEqual(os.path.isfile(ofname), True, f'{ofname} does not exist')
             self.assertEqual(os.path.getsize(ofname), int(file['file_size']))
             self.assertEqual(md5_sum(ofname), file['md5sum'])
+
+
+    def test_files(self):
+        if self.mock_server_active:
+            self.skipTest('Not implemented for mock server')
+
+        api_data = Data()
+        study_id = api_data.get_study_id(TEST_PDC_STUDY_ID)
+        output_dir = f'{self.work_dir}/test_files'
+        n_files = 2
+
+        args = ['PDC_client', 'files', '-u', TEST_URL, '-j', '2', '-n', str(n_files),
+                '--outputDir', output_dir, study_id]
+        result = setup_functions.run_command(args, self.work_dir, prefix='test_files')
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn(f'Downloaded {n_files} of {n_files} file(s).', result.stdout)
+        self.assertEqual(len([name for name in os.listdir(output_dir)
+                              if not name.startswith(MANIFEST_NAME)]), n_files)
+
+        # files which were already downloaded should be skipped
+        result = setup_functions.run_command(args, self.work_dir, prefix='test_files_skip')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn(f'{n_files} already downloaded, 0 failed.', result.stdout)
+
+
+    def test_files_manifest(self):
+        if not self.mock_server_active:
+            self.skipTest('Requires mock server urls which can not be downloaded')
+
+        study_id = Data().get_study_id(TEST_PDC_STUDY_ID)
+        with Client(url=TEST_URL) as client:
+            files = client.get_study_raw_files(study_id, n_files=2)
+        output_dir = f'{TEST_DIR}/work/files_manifest'
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+        args = ['PDC_client', 'files', '-u', TEST_URL, '-n', '2', '--outputDir', output_dir, study_id]
+        for attempt in (1, 2):
+            result = setup_functions.run_command(args, self.work_dir, prefix=f'test_files_manifest_{attempt}')
+            self.assertEqual(result.returncode, 1, result.stderr)
+            self.assertIn('Downloaded 0 of 2 file(s). 0 already downloaded, 2 failed.', result.stdout)
+
+        with DownloadManifest(output_dir) as manifest:
+            self.assertEqual(manifest.counts(), {'failed': 2})
+            for file in files:
+                entry = manifest.get(file['file_name'])
+                self.assertEqual((entry['file_id'], entry['md5sum'], entry['attempts']),
+                                 (file['file_id'], file['md5sum'], 2))
+
+        no_manifest_dir = f'{output_dir}/no_manifest'
+        result = setup_functions.run_command(args[:-2] + [no_manifest_dir, '--noManifest', study_id],
+                                             self.work_dir, prefix='test_files_no_manifest')
+        self.assertEqual(result.returncode, 1, result.stderr)
+        self.assertFalse(os.path.exists(f'{no_manifest_dir}/{MANIFEST_NAME}'))
@@ -0,0 +1,154 @@
+
+import os
+import shutil
+import hashlib
+import threading
+import unittest
+from unittest import mock
+
+from resources import TEST_DIR
+from resources.setup_functions import make_work_dir, LocalFileServer
+
+from PDC_client.submodules import io
+from PDC_client.submodules.manifest import DownloadManifest, MANIFEST_NAME
+
+FILE_DATA = {f'file_{i}.raw': f'manifest test file {i}\n'.encode('utf-8') * 500 for i in range(3)}
+
+
+def file_metadata(file_name, url):
+    data = FILE_DATA.get(file_name, b'')
+    return {'file_id': f'id_{file_name}', 'file_name': file_name, 'url': url,
+            'md5sum': hashlib.md5(data).hexdigest(), 'file_size': len(data)}
+
+
+class TestDownloadManifest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = f'{TEST_DIR}/work/download_manifest'
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        make_work_dir(self.work_dir)
+        self.file = file_metadata('file_0.raw', 'https://host/file_0.raw')
+        with open(f'{self.work_dir}/file_0.raw', 'wb') as outF:
+            outF.write(FILE_DATA['file_0.raw'])
+
+
+    def test_state_transitions(self):
+        with DownloadManifest(self.work_dir) as manifest:
+            self.assertEqual(manifest.path, f'{self.work_dir}/{MANIFEST_NAME}')
+            manifest.add([self.file])
+            entry = manifest.get('file_0.raw')
+            self.assertEqual((entry['state'], entry['attempts'], entry['file_id']),
+                             ('pending', 0, 'id_file_0.raw'))
+            self.assertFalse(manifest.is_done(self.file))
+
+            manifest.start('file_0.raw')
+            self.assertEqual(manifest.get('file_0.raw')['state'], 'in-progress')
+            manifest.finish('file_0.raw', False)
+            self.assertEqual(manifest.get('file_0.raw')['state'], 'failed')
+
+            manifest.start('file_0.raw')
+            manifest.finish('file_0.raw', True)
+            entry = manifest.get('file_0.raw')
+            self.assertEqual((entry['state'], entry['attempts']), ('done', 2))
+            self.assertGreaterEqual(entry['seconds'], 0)
+            self.assertTrue(manifest.is_done(self.file))
+            self.assertEqual(manifest.counts(), {'done': 1})
+
+        # the state is kept when the manifest is opened again
+        with DownloadManifest(self.work_dir) as manifest:
+            self.assertTrue(manifest.is_done(self.file))
+            self.assertIsNone(manifest.get('missing.raw'))
+
+
+    def test_changed_file(self):
+        with DownloadManifest(self.work_dir) as manifest:
+            manifest.add([self.file])
+            manifest.mark_done('file_0.raw')
+            self.assertEqual(manifest.get('file_0.raw')['attempts'], 0)
+            self.assertTrue(manifest.is_done(self.file))
+
+            # a file modified after it was downloaded is not done
+            stat = os.stat(f'{self.work_dir}/file_0.raw')
+            os.utime(f'{self.work_dir}/file_0.raw', ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+            self.assertFalse(manifest.is_done(self.file))
+            manifest.mark_done('file_0.raw')
+            self.assertTrue(manifest.is_done(self.file))
+
+            # a new url does not change the state but a new md5 sum does
+            manifest.add([{**self.file, 'url': 'https://host/new_url'}])
+            self.assertTrue(manifest.is_done(self.file))
+            changed = {**self.file, 'md5sum': '0' * 32}
+            manifest.add([changed])
+            self.assertEqual(manifest.get('file_0.raw')['state'], 'pending')
+            self.assertFalse(manifest.is_done(changed))
+
+            os.remove(f'{self.work_dir}/file_0.raw')
+            manifest.add([self.file])
+            self.assertFalse(manifest.is_done(self.file))
+
+
+class TestResumeDownloads(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = f'{TEST_DIR}/work/resume_downloads'
+        shutil.rmtree(cls.work_dir, ignore_errors=True)
+        cls.server = LocalFileServer(FILE_DATA).start()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+
+    def test_resume(self):
+        output_dir = f'{self.work_dir}/output'
+        files = [file_metadata(name, self.server.url(name)) for name in FILE_DATA]
+        files.append(file_metadata('missing.raw', self.server.url('missing.raw')))
+
+        with DownloadManifest(output_dir) as manifest:
+            with self.assertLogs(level='ERROR'):
+                results = io.download_files(files[:2] + files[3:], output_dir=output_dir,
+                                            n_retries=1, manifest=manifest)
+            self.assertEqual(results, {'file_0.raw': True, 'file_1.raw': True, 'missing.raw': False})
+            self.assertEqual(manifest.counts(), {'done': 2, 'failed': 1})
+
+            # simulate a run which was stopped while file_2.raw was being downloaded
+            manifest.add(files)
+            manifest.start('file_2.raw')
+
+        # after a restart only files which are not done are downloaded and done files are not read again
+        with DownloadManifest(output_dir) as manifest, \
+             mock.patch.object(io, 'md5_sum', side_effect=AssertionError('File re-read!')):
+            download = [file for file in files if not manifest.is_done(file)]
+            self.assertEqual([file['file_name'] for file in download], ['file_2.raw', 'missing.raw'])
+
+            with self.assertLogs(level='ERROR'):
+                results = io.download_files(download, output_dir=output_dir,
+                                            n_retries=1, manifest=manifest)
+            self.assertEqual(results, {'file_2.raw': True, 'missing.raw': False})
+            self.assertEqual(manifest.get('file_2.raw')['attempts'], 2)
+            self.assertEqual(manifest.get('missing.raw')['attempts'], 2)
+            self.assertEqual(manifest.get('file_0.raw')['attempts'], 1)
+            self.assertEqual(manifest.counts(), {'done': 3, 'failed': 1})
+
+
+    def test_updated_off_event_loop(self):
+        output_dir = f'{self.work_dir}/threads'
+        files = [file_metadata(name, self.server.url(name)) for name in FILE_DATA]
+        threads = list()
+
+        def record_thread(f):
+            def wrapper(*args, **kwargs):
+                threads.append(threading.current_thread())
+                return f(*args, **kwargs)
+            return wrapper
+
+        with DownloadManifest(output_dir) as manifest:
+            with mock.patch.object(manifest, 'start', record_thread(manifest.start)), \
+                 mock.patch.object(manifest, 'finish', record_thread(manifest.finish)):
+                results = io.download_files(files, output_dir=output_dir, n_retries=1, manifest=manifest)
+            self.assertTrue(all(results.values()))
+            self.assertEqual(manifest.counts(), {'done': len(files)})
+
+        # the manifest commits and syncs are run in worker threads instead of the event loop thread
+        self.assertEqual(len(threads), 2 * len(files))
+        self.assertNotIn(threading.main_thread(), threads)
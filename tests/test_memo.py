@@ -0,0 +1,146 @@
+
+import unittest
+import asyncio
+import time
+from unittest import mock
+
+from PDC_client.submodules.memo import QueryMemo
+
+
+class Fetcher():
+    ''' Fake request which counts how many times it was sent. '''
+
+    def __init__(self, data, delay=0.01):
+        self.data = data
+        self.delay = delay
+        self.n_calls = 0
+
+
+    async def __call__(self):
+        self.n_calls += 1
+        await asyncio.sleep(self.delay)
+        if isinstance(self.data, Exception):
+            raise self.data
+        return self.data
+
+
+class TestQueryMemo(unittest.TestCase):
+    def test_invalid_args(self):
+        with self.assertRaises(ValueError):
+            QueryMemo(max_size=-1)
+        with self.assertRaises(ValueError):
+            QueryMemo(ttl=0)
+
+
+    def test_hits_and_misses(self):
+        memo = QueryMemo()
+        fetch = Fetcher({'data': {'x': [1, 2.5, 'a']}})
+
+        async def run():
+            first = await memo.get('q', fetch)
+            second = await memo.get('q', fetch)
+            return first, second
+
+        first, second = asyncio.run(run())
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+        self.assertEqual(fetch.n_calls, 1)
+        self.assertEqual((memo.n_hits, memo.n_misses), (1, 1))
+
+
+    def test_results_are_copies(self):
+        memo = QueryMemo()
+        fetch = Fetcher({'data': {'x': [1]}})
+
+        async def run():
+            first = await memo.get('q', fetch)
+            first['data']['x'].append(2)
+            return await memo.get('q', fetch)
+
+        self.assertEqual(asyncio.run(run()), {'data': {'x': [1]}})
+
+
+    def test_single_flight(self):
+        memo = QueryMemo()
+        fetch = Fetcher({'data': 1}, delay=0.1)
+
+        async def run():
+            return await asyncio.gather(*[memo.get('q', fetch) for _ in range(10)])
+
+        results = asyncio.run(run())
+        self.assertEqual(results, [{'data': 1}] * 10)
+        self.assertEqual(fetch.n_calls, 1)
+        self.assertEqual((memo.n_hits, memo.n_misses), (9, 1))
+
+
+    def test_failures_not_stored(self):
+        memo = QueryMemo()
+        failed = Fetcher(None)
+        errors = Fetcher({'errors': [{'message': 'bad query'}]})
+
+        async def run():
+            for _ in range(2):
+                self.assertIsNone(await memo.get('failed', failed))
+                await memo.get('errors', errors)
+
+        asyncio.run(run())
+        self.assertEqual(failed.n_calls, 2)
+        self.assertEqual(errors.n_calls, 2)
+        self.assertEqual(len(memo), 0)
+
+
+    def test_exception_shared(self):
+        memo = QueryMemo()
+        fetch = Fetcher(RuntimeError('failed'), delay=0.05)
+
+        async def run():
+            return await asyncio.gather(memo.get('q', fetch), memo.get('q', fetch),
+                                        return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        self.assertEqual(fetch.n_calls, 1)
+
+
+    def test_cancelled_request_resent(self):
+        memo = QueryMemo()
+        fetch = Fetcher({'data': 1}, delay=0.1)
+
+        async def run():
+            first = asyncio.create_task(memo.get('q', fetch))
+            await asyncio.sleep(0.01)
+            second = asyncio.create_task(memo.get('q', fetch))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            return await second
+
+        self.assertEqual(asyncio.run(run()), {'data': 1})
+        self.assertEqual(fetch.n_calls, 2)
+
+
+    def test_lru_eviction(self):
+        memo = QueryMemo(max_size=2)
+        fetch = Fetcher({'data': 1}, delay=0)
+
+        async def run():
+            for key in ('a', 'b', 'a', 'c', 'a', 'b'):
+                await memo.get(key, fetch)
+
+        asyncio.run(run())
+        # 'b' is evicted when 'c' is added because 'a' was used more recently
+        self.assertEqual(fetch.n_calls, 4)
+        self.assertEqual(len(memo), 2)
+
+
+    def test_ttl(self):
+        memo = QueryMemo(ttl=10)
+        fetch = Fetcher({'data': 1}, delay=0)
+
+        async def run():
+            await memo.get('q', fetch)
+            await memo.get('q', fetch)
+            with mock.patch('time.monotonic', return_value=time.monotonic() + 11):
+                await memo.get('q', fetch)
+
+        asyncio.run(run())
+        self.assertEqual(fetch.n_calls, 2)
@@ -8,6 +8,7 @@ import re
 import time
 import httpx
 from copy import deepcopy
+from unittest import mock
 
 from resources import TEST_DIR
 from resources.setup_functions import make_work_dir
@@ -15,6 +16,7 @@ from resources.mock_graphql_server.data import Data
 from resources.mock_graphql_server.server import server_is_running
 
 from PDC_client.submodules import api
+from PDC_client.submodules.paging import DEFAULT_INITIAL_PAGE_SIZE
 
 TEST_URL = 'http://127.0.0.1:5000/graphql'
 PDC_URL = api.BASE_URL
@@ -211,6 +213,37 @@ class TestRawRequests(TestGraphQLServerBase):
         self.assertIsNone(test_data)
 
 
+    def test_file_aliquot_batch_query(self):
+        study_id = self.api_data.get_study_id(self.TEST_PDC_STUDY_ID)
+        random.seed(-1)
+        file_ids = random.sample(list(self.api_data.index_study_file_ids[study_id]), 5)
+        query = api.Client._file_aliquot_batch_query(file_ids)
+
+        pdc_data, test_data = self.get_paired_data(query)
+        self.assertEqual(len(pdc_data['data']), len(file_ids))
+        self.assertEqual(len(test_data['data']), len(file_ids))
+
+        for i, file_id in enumerate(file_ids):
+            pdc_file = pdc_data['data'][f'f{i}']
+            test_file = test_data['data'][f'f{i}']
+            self.assertEqual(len(pdc_file), 1)
+            self.assertEqual(len(test_file), 1)
+            self.assertEqual(pdc_file[0]['file_id'], file_id)
+            self.assertEqual(test_file[0]['file_id'], file_id)
+            pdc_ids = {aliquot['aliquot_id'] for aliquot in pdc_file[0]['aliquots']}
+            test_ids = {aliquot['aliquot_id'] for aliquot in test_file[0]['aliquots']}
+            self.assertEqual(pdc_ids, test_ids)
+
+
+    def test_invalid_file_aliquot_batch_query(self):
+        query = api.Client._file_aliquot_batch_query(['INVALID_FILE_ID', 'INVALID_FILE_ID_2'])
+
+        pdc_data, test_data = self.get_paired_data(query)
+        for alias in ('f0', 'f1'):
+            self.assertIsNone(pdc_data['data'][alias])
+            self.assertIsNone(test_data['data'][alias])
+
+
     def test_study_case_query(self):
         study_id = self.api_data.get_study_id(self.TEST_PDC_STUDY_ID)
         limit = 10
@@ -471,6 +504,40 @@ class TestRawRequests(TestGraphQLServerBase):
         self.assertEqual(len(pdc_response.json()['data']['filesPerStudy']), 0)
 
 
+    def test_file_url_batch_query(self):
+        study_id = self.api_data.get_study_id(self.TEST_PDC_STUDY_ID)
+        random.seed(3)
+        file_ids = random.sample(sorted(self.api_data.index_study_file_ids[study_id]), 3)
+        files = [{'file_name': self.api_data.file_metadata[file_id]['file_name'],
+                  'data_category': self.api_data.file_metadata[file_id]['data_category']}
+                 for file_id in file_ids]
+        query = api.Client._file_url_batch_query(study_id, files)
+
+        pdc_response = self.post(PDC_URL, query)
+        test_response = self.post(TEST_URL, query)
+        self.assertEqual(pdc_response.status_code, 200)
+        self.assertEqual(test_response.status_code, 200)
+        self.assertNotIn('errors', test_response.json(), msg=test_response.json().get('errors'))
+
+        for i, file_id in enumerate(file_ids):
+            for data in (pdc_response.json()['data'], test_response.json()['data']):
+                self.assertIn(file_id, [file['file_id'] for file in data[f'f{i}']])
+                self.assertTrue(all('url' in file['signedUrl'] for file in data[f'f{i}']))
+
+
+    def test_invalid_file_url_batch_query(self):
+        files = [{'file_name': 'NA', 'data_category': 'NA'}] * 2
+        query = api.Client._file_url_batch_query('INVALID_STUDY_ID', files)
+
+        pdc_response = self.post(PDC_URL, query)
+        test_response = self.post(TEST_URL, query)
+        self.assertEqual(pdc_response.status_code, 200)
+        self.assertEqual(test_response.status_code, 200)
+        for data in (pdc_response.json(), test_response.json()):
+            self.assertIn('errors', data)
+            self.assertFalse(any((data.get('data') or {}).get(alias) for alias in ('f0', 'f1')))
+
+
 class TestClient(TestGraphQLServerBase):
     '''
     Test the client functions that call the API.
@@ -628,4 +695,378 @@ class TestClient(TestGraphQLServerBase):
             self.assertIn('url', test_data)
             pdc_data['url'] = ''
             test_data['url'] = ''
-            self.assertDictEqual(pdc_data, test_data)
\ No newline at end of file
+            self.assertDictEqual(pdc_data, test_data)
+
+class TestErrorInjection(TestGraphQLServerBase):
+    '''
+    Test that Client backs off and recovers when the server returns errors.
+    '''
+
+    INJECT_ERRORS_URL = TEST_URL.replace('/graphql', '/inject_errors')
+
+    def inject_errors(self, **kwargs):
+        response = httpx.post(self.INJECT_ERRORS_URL, json=kwargs)
+        self.assertEqual(response.status_code, 200)
+
+
+    def setUp(self):
+        self.study_id = self.api_data.get_study_id(self.TEST_PDC_STUDY_ID)
+        with api.Client(url=TEST_URL) as client:
+            self.target_cases = client.get_study_cases(self.study_id, page_limit=5)
+        self.assertIsNotNone(self.target_cases)
+
+
+    def tearDown(self):
+        self.inject_errors(count=0)
+
+
+    def test_backoff_on_429(self):
+        limiter = api.AdaptiveLimiter(initial_limit=8, max_limit=8)
+        self.inject_errors(count=3, status_code=429, retry_after=1)
+
+        start = time.monotonic()
+        with api.Client(url=TEST_URL, limiter=limiter) as client:
+            cases = client.get_study_cases(self.study_id, page_limit=5)
+
+        self.assertEqual(cases, self.target_cases)
+        self.assertGreaterEqual(time.monotonic() - start, 1)
+        self.assertGreaterEqual(limiter.n_backoffs, 1)
+        self.assertLess(limiter.limit, 8)
+        self.assertEqual(limiter.in_flight, 0)
+
+
+    def test_backoff_on_5xx(self):
+        limiter = api.AdaptiveLimiter(initial_limit=8, max_limit=8)
+        self.inject_errors(count=2, status_code=503)
+
+        with api.Client(url=TEST_URL, limiter=limiter) as client:
+            cases = client.get_study_cases(self.study_id, page_limit=5)
+
+        self.assertEqual(cases, self.target_cases)
+        self.assertGreaterEqual(limiter.n_backoffs, 1)
+
+
+    def test_backoff_on_timeout(self):
+        limiter = api.AdaptiveLimiter(initial_limit=4, max_limit=4)
+        self.inject_errors(count=1, delay=2)
+
+        with api.Client(url=TEST_URL, timeout=0.5, limiter=limiter) as client:
+            cases = client.get_study_cases(self.study_id, page_limit=5)
+
+        self.assertEqual(cases, self.target_cases)
+        self.assertEqual(limiter.n_backoffs, 1)
+
+
+    def test_retry_counters(self):
+        policy = api.RetryPolicy(base_delay=0.1)
+        self.inject_errors(count=2, status_code=503)
+
+        with api.Client(url=TEST_URL, retry_policy=policy,
+                        limiter=api.AdaptiveLimiter(initial_limit=1, max_limit=1)) as client:
+            cases = client.get_study_cases(self.study_id, page_limit=5)
+
+        self.assertEqual(cases, self.target_cases)
+        self.assertEqual(policy.n_retries, 2)
+        self.assertEqual(policy.n_failures, 0)
+        self.assertGreater(policy.backoff_seconds, 0)
+
+
+    def test_fatal_error(self):
+        policy = api.RetryPolicy()
+        self.inject_errors(count=1, status_code=400)
+
+        with self.assertLogs(level='ERROR'):
+            with api.Client(url=TEST_URL, retry_policy=policy) as client:
+                self.assertIsNone(client.get_study_cases(self.study_id, page_limit=5))
+
+        self.assertEqual(policy.n_retries, 0)
+        self.assertEqual(policy.n_failures, 1)
+
+
+class TestPaginatedIterators(TestGraphQLServerBase):
+    '''
+    Test the aiter_* methods which yield records as pages arrive.
+    '''
+
+    # study with enough cases for several pages
+    TEST_PDC_STUDY_ID = 'PDC000504'
+
+    INJECT_ERRORS_URL = TEST_URL.replace('/graphql', '/inject_errors')
+
+    def setUp(self):
+        self.study_id = self.api_data.get_study_id(self.TEST_PDC_STUDY_ID)
+        with api.Client(url=TEST_URL) as client:
+            self.target_cases = client.get_study_cases(self.study_id, page_limit=5)
+        self.assertIsNotNone(self.target_cases)
+        self.assertGreater(len(self.target_cases), 10)
+
+
+    def tearDown(self):
+        httpx.post(self.INJECT_ERRORS_URL, json={'count': 0})
+
+
+    @staticmethod
+    async def collect(records, n=None):
+        ret = list()
+        async for record in records:
+            ret.append(record)
+            if n is not None and len(ret) >= n:
+                break
+        return ret
+
+
+    def test_aiter_study_cases(self):
+        with api.Client(url=TEST_URL) as client:
+            cases = client.gather(self.collect(client.aiter_study_cases(self.study_id, page_limit=5)))[0]
+        self.assertEqual(cases, self.target_cases)
+
+
+    def test_unordered(self):
+        with api.Client(url=TEST_URL) as client:
+            cases = client.gather(
+                self.collect(client.aiter_study_cases(self.study_id, page_limit=5, ordered=False))
+            )[0]
+        self.assertEqual(len(cases), len(self.target_cases))
+        key = lambda case: case['case_id']
+        self.assertEqual(sorted(cases, key=key), sorted(self.target_cases, key=key))
+
+
+    def test_prefetch_window(self):
+        limiter = api.AdaptiveLimiter(initial_limit=20, max_limit=20)
+        with api.Client(url=TEST_URL, limiter=limiter) as client:
+            cases = client.gather(
+                self.collect(client.aiter_study_cases(self.study_id, page_limit=2, prefetch=2))
+            )[0]
+        self.assertEqual(cases, self.target_cases)
+        self.assertLessEqual(limiter.peak_in_flight, 2)
+
+
+    def test_early_stop(self):
+        limiter = api.AdaptiveLimiter(initial_limit=4, max_limit=4)
+        with api.Client(url=TEST_URL, limiter=limiter) as client:
+            cases = client.gather(
+                self.collect(client.aiter_study_cases(self.study_id, page_limit=5), n=7)
+            )[0]
+        self.assertEqual(cases, self.target_cases[:7])
+        self.assertEqual(limiter.in_flight, 0)
+
+
+    def test_page_error(self):
+        async def consume(client):
+            records = client.aiter_study_cases(self.study_id, page_limit=5, prefetch=1)
+            first = await anext(records)
+            httpx.post(self.INJECT_ERRORS_URL, json={'count': 1, 'status_code': 400})
+            with self.assertRaises(api.PaginatedDataError):
+                await self.collect(records)
+            return first
+
+        with self.assertLogs(level='ERROR'):
+            with api.Client(url=TEST_URL) as client:
+                first = client.gather(consume(client))[0]
+        self.assertEqual(first, self.target_cases[0])
+
+
+    def test_aiter_cases_samples_aliquots(self):
+        with api.Client(url=TEST_URL) as client:
+            ordered, unordered = client.gather(
+                self.collect(client.aiter_cases_samples_aliquots(self.study_id, page_limit=5)),
+                self.collect(client.aiter_cases_samples_aliquots(self.study_id, page_limit=5, ordered=False)))
+
+        self.assertGreater(len(ordered), 0)
+        self.assertEqual({case['case_id'] for case in ordered},
+                         {case['case_id'] for case in self.target_cases})
+        key = lambda case: case['case_id']
+        self.assertEqual(sorted(ordered, key=key), sorted(unordered, key=key))
+
+
+    def test_adaptive_page_size(self):
+        queries = list()
+
+        class CountingClient(api.Client):
+            async def _get(self, query):
+                queries.append(query)
+                return await super()._get(query)
+
+        # the mock server responds much faster than target_latency, so the page size doubles after each page
+        page_size = api.AdaptivePageSize(initial_size=2, min_size=1, max_size=8, target_latency=10)
+        page_sizes = {'caseDemographicsPerStudy': page_size}
+        with CountingClient(url=TEST_URL, page_sizes=page_sizes) as client:
+            cases = client.gather(
+                self.collect(client.aiter_study_cases(self.study_id, prefetch=1))
+            )[0]
+            # each endpoint has its own page size
+            client.gather(self.collect(client.aiter_cases_samples_aliquots(self.study_id)))
+
+        self.assertEqual(cases, self.target_cases)
+        self.assertEqual(page_size.size, 8)
+        self.assertEqual(set(page_sizes), {'caseDemographicsPerStudy', 'casesSamplesAliquots'})
+        self.assertEqual([int(re.search(r'limit: (\d+)', query).group(1)) for query in queries[:4]],
+                         [2, 4, 8, 8])
+        self.assertEqual(int(re.search(r'limit: (\d+)', queries[4]).group(1)),
+                         DEFAULT_INITIAL_PAGE_SIZE)
+
+
+    def test_cached_page_size(self):
+        queries = list()
+
+        class CountingClient(api.Client):
+            async def _get(self, query):
+                queries.append(query)
+                return await super()._get(query)
+
+        # cached pages are requested with a fixed size so the queries match between runs
+        work_dir = f'{TEST_DIR}/work/cached_page_size'
+        make_work_dir(work_dir, clear_dir=True)
+        page_size = api.AdaptivePageSize(initial_size=2, min_size=1, max_size=8, target_latency=10)
+        for _ in range(2):
+            with CountingClient(url=TEST_URL, cache=api.ResponseCache(work_dir),
+                                page_sizes={'caseDemographicsPerStudy': page_size}) as client:
+                cases = client.gather(
+                    self.collect(client.aiter_study_cases(self.study_id, prefetch=1))
+                )[0]
+            self.assertEqual(cases, self.target_cases)
+
+        self.assertEqual(page_size.size, 2)
+        self.assertEqual(len(queries) % 2, 0)
+        self.assertEqual(queries[:len(queries) // 2], queries[len(queries) // 2:])
+        self.assertTrue(all(int(re.search(r'limit: (\d+)', query).group(1)) == 2 for query in queries))
+
+
+class TestRecords(TestGraphQLServerBase):
+    '''
+    Test that the records=True option returns the same metadata as the default dicts.
+    '''
+
+    def test_records(self):
+        study_id = self.api_data.get_study_id(self.TEST_PDC_STUDY_ID)
+        with api.Client(url=TEST_URL) as client:
+            files, file_records, cases, case_records = client.gather(
+                client.async_get_study_raw_files(study_id),
+                client.async_get_study_raw_files(study_id, records=True),
+                client.async_get_study_cases(study_id),
+                client.async_get_study_cases(study_id, records=True))
+            file_ids = [file.file_id for file in file_records]
+            aliquots, aliquot_records = client.gather(
+                client.async_get_study_samples(study_id, file_ids=file_ids),
+                client.async_get_study_samples(study_id, file_ids=file_ids, records=True))
+
+        for dicts, records, record_type in ((files, file_records, api.FileRecord),
+                                            (cases, case_records, api.CaseRecord),
+                                            (aliquots, aliquot_records, api.AliquotRecord)):
+            self.assertGreater(len(records), 0)
+            for record in records:
+                self.assertIsInstance(record, record_type)
+            self.assertEqual([record.to_dict() for record in records], dicts)
+
+
+class TestQueryMemo(TestGraphQLServerBase):
+    TEST_PDC_STUDY_ID = 'PDC000504'
+
+    def test_repeated_queries(self):
+        study_id = self.api_data.get_study_id(self.TEST_PDC_STUDY_ID)
+        with api.Client(url=TEST_URL) as client:
+            target = client.get_study_metadata(study_id=study_id)
+            n_requests = client.memo.n_misses
+
+            with mock.patch.object(client.client, 'get', wraps=client.client.get) as get:
+                concurrent = client.gather(*[client.async_get_study_metadata(study_id=study_id)
+                                             for _ in range(5)])
+                repeated = client.get_study_metadata(study_id=study_id)
+                get.assert_not_called()
+
+            self.assertEqual(concurrent, [target] * 5)
+            self.assertEqual(repeated, target)
+            self.assertEqual(client.memo.n_misses, n_requests)
+            self.assertGreaterEqual(client.memo.n_hits, 6)
+
+
+    def test_single_flight(self):
+        study_id = self.api_data.get_study_id(self.TEST_PDC_STUDY_ID)
+        with api.Client(url=TEST_URL) as client:
+            target = client.get_study_cases(study_id, page_limit=5)
+
+        with api.Client(url=TEST_URL) as client:
+            with mock.patch.object(client.client, 'get', wraps=client.client.get) as get:
+                results = client.gather(*[client.async_get_study_cases(study_id, page_limit=5)
+                                          for _ in range(4)])
+                # each page is only requested once
+                self.assertEqual(get.call_count, -(-len(target) // 5))
+
+        self.assertEqual(results, [target] * 4)
+
+
+    def test_signed_urls_not_memoized(self):
+        study_id = self.api_data.get_study_id(self.TEST_PDC_STUDY_ID)
+        with api.Client(url=TEST_URL, cache=None) as client:
+            files = client.get_study_raw_files(study_id, n_files=1)
+            file_id = files[0]['file_id']
+            client.get_file_url(file_id)
+
+            with mock.patch.object(client.client, 'post', wraps=client.client.post) as post, \
+                 mock.patch.object(client.client, 'get', wraps=client.client.get) as get:
+                self.assertEqual(client.get_study_raw_files(study_id, n_files=1), files)
+                self.assertEqual(post.call_count, 1)
+
+                # the file metadata is memoized but the signed url is requested again
+                self.assertIsNotNone(client.get_file_url(file_id))
+                self.assertEqual(post.call_count, 2)
+                get.assert_not_called()
+
+
+class TestHttp2(TestGraphQLServerBase):
+    TEST_PDC_STUDY_ID = 'PDC000504'
+
+    def test_fallback_to_http1(self):
+        with api.Client(url=TEST_URL) as client:
+            target = client.get_study_id(self.TEST_PDC_STUDY_ID)
+
+        # The mock server does not negotiate HTTP/2
+        with api.Client(url=TEST_URL, http2=api.http2_available()) as client:
+            self.assertEqual(client.get_study_id(self.TEST_PDC_STUDY_ID), target)
+        self.assertEqual(dict(client.http_versions), {'HTTP/1.1': 1})
+
+
+    def test_h2_not_installed(self):
+        with mock.patch.object(api, 'http2_available', return_value=False):
+            with self.assertLogs(api.LOGGER, level='WARNING'):
+                client = api.Client(url=TEST_URL, http2=True)
+        with client:
+            self.assertFalse(client.http2)
+            self.assertIsNotNone(client.get_study_id(self.TEST_PDC_STUDY_ID))
+
+
+class TestFileUrls(TestGraphQLServerBase):
+    TEST_PDC_STUDY_ID = 'PDC000504'
+
+    def test_get_file_urls(self):
+        study_id = self.api_data.get_study_id(self.TEST_PDC_STUDY_ID)
+        with api.Client(url=TEST_URL, cache=None) as client:
+            files = client.get_study_raw_files(study_id)
+            target = {file['file_id']: file['url'] for file in files}
+
+            with mock.patch.object(client.client, 'post', wraps=client.client.post) as post:
+                urls = client.gather(client.async_get_file_urls(study_id, files))[0]
+                self.assertEqual(urls, target)
+
+                # signed urls expire, so the query is sent again instead of using the memo
+                client.gather(client.async_get_file_urls(study_id, files))
+                self.assertEqual(post.call_count, 2)
+
+
+    def test_split_batch(self):
+        study_id = self.api_data.get_study_id(self.TEST_PDC_STUDY_ID)
+        with api.Client(url=TEST_URL) as client:
+            files = client.get_study_raw_files(study_id, n_files=4)
+            target = {file['file_id']: file['url'] for file in files}
+
+            inject_errors_url = TEST_URL.replace('/graphql', '/inject_errors')
+            httpx.post(inject_errors_url, json={'count': 1, 'status_code': 413})
+            try:
+                with self.assertLogs(level='INFO') as cm:
+                    urls = client.gather(client.async_get_file_urls(study_id, files))[0]
+            finally:
+                httpx.post(inject_errors_url, json={'count': 0})
+
+        self.assertEqual(urls, target)
+        self.assertTrue(any('Query for 4 files too large. Splitting batch.' in msg
+                            for msg in cm.output), cm.output)
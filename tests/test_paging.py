@@ -0,0 +1,59 @@
+
+import unittest
+
+from PDC_client.submodules.paging import AdaptivePageSize
+
+
+class TestAdaptivePageSize(unittest.TestCase):
+    def test_invalid_sizes(self):
+        with self.assertRaises(ValueError):
+            AdaptivePageSize(initial_size=0)
+        with self.assertRaises(ValueError):
+            AdaptivePageSize(initial_size=100, max_size=50)
+        with self.assertRaises(ValueError):
+            AdaptivePageSize(target_latency=0)
+        with self.assertRaises(ValueError):
+            AdaptivePageSize(max_step=1)
+
+
+    def test_grow(self):
+        page_size = AdaptivePageSize(initial_size=100, max_size=1000, target_latency=2)
+        page_size.update(100, 0.5)
+        self.assertEqual(page_size.size, 200)
+        for _ in range(10):
+            page_size.update(page_size.size, 0.01)
+        self.assertEqual(page_size.size, 1000)
+
+
+    def test_shrink(self):
+        page_size = AdaptivePageSize(initial_size=100, min_size=10, target_latency=2)
+        page_size.update(100, 2.5)
+        self.assertEqual(page_size.size, 80)
+        for _ in range(10):
+            page_size.update(page_size.size, 60)
+        self.assertEqual(page_size.size, 10)
+
+
+    def test_target_reached(self):
+        page_size = AdaptivePageSize(initial_size=10, target_latency=1)
+        # the server returns 250 records per second
+        for _ in range(10):
+            page_size.update(page_size.size, page_size.size / 250)
+        self.assertEqual(page_size.size, 250)
+
+
+    def test_short_page(self):
+        page_size = AdaptivePageSize(initial_size=400, target_latency=2)
+        # a short last page should not collapse the page size
+        page_size.update(3, 0.1)
+        self.assertEqual(page_size.size, 200)
+        page_size.update(0, 0.1)
+        self.assertEqual(page_size.size, 200)
+
+
+    def test_failed(self):
+        page_size = AdaptivePageSize(initial_size=100, min_size=30)
+        page_size.failed()
+        self.assertEqual(page_size.size, 50)
+        page_size.failed()
+        self.assertEqual(page_size.size, 30)
@@ -0,0 +1,59 @@
+
+import unittest
+import json
+import sys
+from collections.abc import Mapping
+
+from resources.data import FILE_METADATA, SAMPLE_METADATA, CASE_METADATA
+
+from PDC_client.submodules.records import FileRecord, AliquotRecord, CaseRecord
+
+
+class TestRecords(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.data = dict()
+        for name, fname in (('files', FILE_METADATA), ('aliquots', SAMPLE_METADATA), ('cases', CASE_METADATA)):
+            with open(fname, 'r', encoding='utf-8') as inF:
+                cls.data[name] = [row for rows in json.load(inF).values() for row in rows]
+        # only use files with all the keys returned by Client
+        cls.data['files'] = [dict(file, url=f"s3://pdcdatastore/{file['file_location']}")
+                             for file in cls.data['files'] if 'file_location' in file]
+
+
+    def test_round_trip(self):
+        for name, record_type in (('files', FileRecord), ('aliquots', AliquotRecord), ('cases', CaseRecord)):
+            for row in self.data[name]:
+                record = record_type.from_dict(row)
+                self.assertEqual(record.to_dict(), row)
+                self.assertEqual(dict(record), row)
+                self.assertEqual(list(record.keys()), list(record_type.KEYS))
+
+
+    def test_mapping_interface(self):
+        row = self.data['files'][0]
+        record = FileRecord.from_dict(row)
+        self.assertIsInstance(record, Mapping)
+        self.assertEqual(record['file_id'], row['file_id'])
+        self.assertEqual(record.file_id, row['file_id'])
+        self.assertEqual(len(record), len(row))
+        self.assertIn('md5sum', record)
+        self.assertNotIn('DUMMY', record)
+        self.assertIsNone(record.get('DUMMY'))
+        self.assertEqual(record.get('md5sum'), row['md5sum'])
+        with self.assertRaises(KeyError):
+            record['DUMMY']
+        self.assertEqual(dict(record.items()), row)
+        self.assertEqual(sorted(record.values(), key=str), sorted(row.values(), key=str))
+
+        # keys which are not fields should not be accessible through __getitem__
+        with self.assertRaises(KeyError):
+            record['to_dict']
+
+
+    def test_slots(self):
+        record = CaseRecord.from_dict(self.data['cases'][0])
+        self.assertFalse(hasattr(record, '__dict__'))
+        with self.assertRaises(AttributeError):
+            record.extra = 1
+        self.assertLess(sys.getsizeof(record), sys.getsizeof(record.to_dict()))
@@ -0,0 +1,90 @@
+
+import unittest
+import asyncio
+import time
+import socket
+
+import httpx
+
+from PDC_client.submodules import retry
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_classify(self):
+        policy = retry.RetryPolicy()
+        request = httpx.Request('GET', 'http://127.0.0.1:5000/graphql')
+        for status_code, outcome in ((200, retry.SUCCESS), (500, retry.RETRY), (503, retry.RETRY),
+                                     (429, retry.RETRY), (408, retry.RETRY), (400, retry.FATAL),
+                                     (404, retry.FATAL), (301, retry.FATAL)):
+            self.assertEqual(policy.classify(response=httpx.Response(status_code)), outcome, status_code)
+
+        for error, outcome in ((httpx.ReadTimeout('', request=request), retry.RETRY),
+                               (httpx.ConnectTimeout('', request=request), retry.RETRY),
+                               (httpx.PoolTimeout('', request=request), retry.RETRY),
+                               (httpx.RemoteProtocolError('', request=request), retry.RETRY),
+                               (httpx.ConnectError('', request=request), retry.RETRY)):
+            self.assertEqual(policy.classify(error=error), outcome, type(error).__name__)
+
+        # only connection errors caused by an unknown host are fatal
+        dns_error = httpx.ConnectError('[Errno -2] Name or service not known', request=request)
+        dns_error.__cause__ = socket.gaierror(-2, 'Name or service not known')
+        self.assertTrue(retry.is_dns_error(dns_error))
+        self.assertEqual(policy.classify(error=dns_error), retry.FATAL)
+        refused_error = httpx.ConnectError('[Errno 111] Connection refused', request=request)
+        refused_error.__cause__ = ConnectionRefusedError(111, 'Connection refused')
+        self.assertFalse(retry.is_dns_error(refused_error))
+        self.assertEqual(policy.classify(error=refused_error), retry.RETRY)
+
+
+    def test_real_connect_errors(self):
+        async def run(url):
+            async with httpx.AsyncClient() as client:
+                try:
+                    await client.get(url)
+                except httpx.ConnectError as e:
+                    return e
+            return None
+
+        # reserved top level domain which never resolves
+        self.assertTrue(retry.is_dns_error(asyncio.run(run('http://no-such-host.invalid/'))))
+        # nothing listens on port 1
+        self.assertFalse(retry.is_dns_error(asyncio.run(run('http://127.0.0.1:1/'))))
+
+
+    def test_delay(self):
+        policy = retry.RetryPolicy(base_delay=1, max_delay=4)
+        for attempt in range(1, 6):
+            delays = [policy.delay(attempt) for _ in range(100)]
+            self.assertGreaterEqual(min(delays), 0)
+            self.assertLessEqual(max(delays), min(4, 2 ** (attempt - 1)))
+        self.assertGreaterEqual(policy.delay(1, retry_after=10), 10)
+
+
+    def test_backoff(self):
+        policy = retry.RetryPolicy(max_attempts=3, base_delay=0.01)
+
+        async def run():
+            start = time.monotonic()
+            attempt = 1
+            while await policy.backoff(attempt, start):
+                attempt += 1
+            return attempt
+
+        self.assertEqual(asyncio.run(run()), 3)
+        self.assertEqual(policy.n_retries, 2)
+        self.assertEqual(policy.n_failures, 1)
+        self.assertGreaterEqual(policy.backoff_seconds, 0)
+        self.assertLessEqual(policy.backoff_seconds, 0.03)
+
+
+    def test_deadline(self):
+        policy = retry.RetryPolicy(max_attempts=100, base_delay=10, deadline=1)
+
+        async def run():
+            return await policy.backoff(1, time.monotonic(), retry_after=5)
+
+        start = time.monotonic()
+        self.assertFalse(asyncio.run(run()))
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(policy.n_retries, 0)
+        self.assertEqual(policy.n_failures, 1)
@@ -0,0 +1,144 @@
+
+import os
+import stat
+import time
+import asyncio
+import unittest
+import threading
+from unittest import mock
+
+import httpx
+
+from resources import TEST_DIR, setup_functions
+from resources.mock_graphql_server.data import Data
+
+from PDC_client.submodules import server
+from PDC_client.submodules.api import Client, QueryTooLargeError
+
+TEST_URL = 'http://127.0.0.1:5000/graphql'
+TEST_PDC_STUDY_ID = 'PDC000504'
+
+
+class TestClientServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = f'{TEST_DIR}/work/server'
+        setup_functions.make_work_dir(cls.work_dir, clear_dir=True)
+        cls.api_data = Data()
+        cls.study_id = cls.api_data.get_study_id(TEST_PDC_STUDY_ID)
+
+        cls.socket_path = f'{cls.work_dir}/pdc.sock'
+        cls.server = server.ClientServer(cls.socket_path)
+        cls.thread = threading.Thread(target=lambda: asyncio.run(cls.server.serve()))
+        cls.thread.start()
+
+        start = time.monotonic()
+        while not server.server_running(cls.socket_path):
+            if time.monotonic() - start > 10:
+                raise RuntimeError('Server did not start!')
+            time.sleep(0.05)
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        cls.thread.join()
+
+
+    def test_stopped_server_cleanup(self):
+        socket_path = f'{self.work_dir}/stopped.sock'
+        other = server.ClientServer(socket_path)
+        thread = threading.Thread(target=lambda: asyncio.run(other.serve()))
+        thread.start()
+        while not server.server_running(socket_path):
+            time.sleep(0.05)
+
+        # a second server can not use the same socket
+        self.assertFalse(asyncio.run(server.ClientServer(socket_path).serve()))
+
+        other.stop()
+        thread.join()
+        self.assertFalse(os.path.exists(socket_path))
+        self.assertFalse(server.server_running(socket_path))
+
+
+    def test_remote_client(self):
+        def get_data(client):
+            data = {'study_id': client.get_study_id(TEST_PDC_STUDY_ID),
+                    'metadata': client.get_study_metadata(study_id=self.study_id),
+                    'files': client.get_study_raw_files(self.study_id, n_files=5),
+                    'cases': client.get_study_cases(self.study_id)}
+            data['samples'] = client.get_study_samples(self.study_id,
+                                                       file_ids=[f['file_id'] for f in data['files']])
+            return data
+
+        with Client(url=TEST_URL) as client:
+            target = get_data(client)
+
+        n_requests = self.server.n_requests
+        with server.RemoteClient(self.socket_path, url=TEST_URL) as client:
+            remote = get_data(client)
+
+        self.assertEqual(remote, target)
+        self.assertGreater(self.server.n_requests, n_requests)
+        self.assertEqual(list(self.server.clients), [(TEST_URL, True)])
+
+
+    def test_socket_mode(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.socket_path).st_mode), 0o600)
+
+
+    def test_one_connection(self):
+        def get_data(client):
+            return client.gather(client.async_get_study_id(TEST_PDC_STUDY_ID),
+                                 client.async_get_study_metadata(study_id=self.study_id),
+                                 client.async_get_study_raw_files(self.study_id, n_files=5),
+                                 client.async_get_study_cases(self.study_id, page_limit=5))
+
+        with Client(url=TEST_URL) as client:
+            target = get_data(client)
+
+        n_connections = self.server.n_connections
+        with server.RemoteClient(self.socket_path, url=TEST_URL) as client:
+            # concurrent requests share the connection and each gets its own response
+            self.assertEqual(get_data(client), target)
+            self.assertEqual(client.get_study_id(TEST_PDC_STUDY_ID), self.study_id)
+        self.assertEqual(self.server.n_connections, n_connections + 1)
+
+
+    def test_no_local_transport(self):
+        # the server sends the requests, so a RemoteClient has no HTTP client or request stats of its own
+        with mock.patch.object(Client, '_log_request_stats') as log_request_stats:
+            with server.RemoteClient(self.socket_path, url=TEST_URL, max_connections=2) as client:
+                self.assertEqual(client.get_study_id(TEST_PDC_STUDY_ID), self.study_id)
+                for name in ('client', 'limiter', 'memo'):
+                    self.assertFalse(hasattr(client, name), name)
+                self.assertIsNone(client.cache)
+        log_request_stats.assert_not_called()
+
+
+    def test_query_too_large(self):
+        inject_errors_url = TEST_URL.replace('/graphql', '/inject_errors')
+        self.assertEqual(httpx.post(inject_errors_url, json={'count': 1, 'status_code': 413}).status_code, 200)
+        try:
+            with server.RemoteClient(self.socket_path, url=TEST_URL) as client:
+                with self.assertRaises(QueryTooLargeError):
+                    client.gather(client._post('{ allPrograms { program_id } }'))
+        finally:
+            httpx.post(inject_errors_url, json={'count': 0})
+
+
+    def test_no_server(self):
+        with server.RemoteClient(f'{self.work_dir}/missing.sock', url=TEST_URL) as client:
+            self.assertIsNone(client.get_study_id(TEST_PDC_STUDY_ID))
+
+
+    def test_subcommand_uses_server(self):
+        n_requests = self.server.n_requests
+        args = ['PDC_client', 'studyID', '-u', TEST_URL, TEST_PDC_STUDY_ID]
+        env = {**os.environ, 'PDC_CLIENT_SOCKET': self.socket_path}
+        result = setup_functions.run_command(args, self.work_dir, prefix='study_id', env=env)
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), self.study_id)
+        self.assertGreater(self.server.n_requests, n_requests)
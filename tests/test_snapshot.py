@@ -0,0 +1,135 @@
+
+import unittest
+import asyncio
+import copy
+from unittest import mock
+
+from resources import TEST_DIR
+from resources.setup_functions import make_work_dir
+from resources.mock_graphql_server.data import Data
+
+from PDC_client.submodules import snapshot
+from PDC_client.submodules.api import Client
+
+TEST_URL = 'http://127.0.0.1:5000/graphql'
+TEST_PDC_STUDY_ID = 'PDC000504'
+
+
+class TestSnapshot(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = f'{TEST_DIR}/work/snapshot'
+        make_work_dir(cls.work_dir, clear_dir=True)
+        cls.api_data = Data()
+        cls.study_id = cls.api_data.get_study_id(TEST_PDC_STUDY_ID)
+
+        async def take_snapshot():
+            async with Client(url=TEST_URL) as client:
+                return await snapshot.async_take_snapshot(client, cls.study_id)
+
+        cls.snapshot = asyncio.run(take_snapshot())
+        snapshot.SnapshotStore(cls.work_dir).save(cls.snapshot)
+
+
+    def test_store(self):
+        self.assertIsNotNone(self.snapshot)
+        for key in snapshot.SNAPSHOT_KEYS:
+            self.assertIsNotNone(self.snapshot[key], key)
+
+        store = snapshot.SnapshotStore(self.work_dir)
+        self.assertEqual(store.study_ids(), [self.study_id])
+        for key in (self.study_id, TEST_PDC_STUDY_ID, self.snapshot['study_submitter_id']):
+            self.assertEqual(store.load(key), self.snapshot)
+        self.assertIsNone(store.load('DUMMY'))
+
+
+    def test_study_versions(self):
+        work_dir = f'{TEST_DIR}/work/snapshot_versions'
+        make_work_dir(work_dir, clear_dir=True)
+        other_versions = [study['study_id'] for study in self.snapshot['study']
+                          if study['study_id'] != self.study_id]
+
+        # a second version of the same study with a different file list
+        version_2 = copy.deepcopy(self.snapshot)
+        version_2['study_id'] = 'VERSION_2'
+        version_2['file'] = version_2['file'][:1]
+
+        store = snapshot.SnapshotStore(work_dir)
+        store.save(self.snapshot)
+        store.save(version_2)
+
+        store = snapshot.SnapshotStore(work_dir)
+        self.assertEqual(store.study_ids(), sorted([self.study_id, 'VERSION_2']))
+        self.assertEqual(store.load(self.study_id), self.snapshot)
+        self.assertEqual(store.load('VERSION_2'), version_2)
+        self.assertEqual(store.load(TEST_PDC_STUDY_ID), version_2)
+        for study_id in other_versions:
+            self.assertIsNone(store.load(study_id))
+
+        with snapshot.OfflineClient(store) as client:
+            files = client.get_study_raw_files(self.study_id)
+            self.assertEqual(len(files), len(self.snapshot['file']))
+            self.assertEqual(len(client.get_study_raw_files('VERSION_2')), 1)
+            for study_id in other_versions:
+                self.assertIsNone(client.get_study_raw_files(study_id))
+
+
+    def test_json_codec(self):
+        # the index and snapshot files are decoded with the shared json codec
+        with mock.patch.object(snapshot.json_codec, 'loads', wraps=snapshot.json_codec.loads) as loads:
+            store = snapshot.SnapshotStore(self.work_dir)
+            self.assertEqual(store.load(TEST_PDC_STUDY_ID), self.snapshot)
+        self.assertEqual(loads.call_count, 2)
+
+        # truncated snapshot files are reported instead of raising
+        work_dir = f'{TEST_DIR}/work/snapshot_truncated'
+        make_work_dir(work_dir, clear_dir=True)
+        store = snapshot.SnapshotStore(work_dir)
+        path = store.save(self.snapshot)
+        with open(path, 'rb') as inF:
+            data = inF.read()
+        with open(path, 'wb') as outF:
+            outF.write(data[:len(data) // 2])
+        with self.assertLogs(level='ERROR'):
+            self.assertIsNone(snapshot.SnapshotStore(work_dir).load(TEST_PDC_STUDY_ID))
+
+
+    def test_offline_client(self):
+        with Client(url=TEST_URL) as client:
+            online = {'study_id': client.get_study_id(TEST_PDC_STUDY_ID),
+                      'study_name': client.get_study_name(self.study_id),
+                      'metadata': client.get_study_metadata(study_id=self.study_id),
+                      'versions': client.get_study_metadata(pdc_study_id=TEST_PDC_STUDY_ID, only_latest=False),
+                      'files': client.get_study_raw_files(self.study_id, n_files=5, use_s3_path=True),
+                      'cases': client.get_study_cases(self.study_id)}
+            file_ids = [f['file_id'] for f in online['files']]
+            online['samples'] = client.get_study_samples(self.study_id, file_ids=file_ids)
+
+        # any request which reaches the network should fail the test
+        with mock.patch('httpx.AsyncClient.send', side_effect=AssertionError('Network request!')):
+            with snapshot.OfflineClient(snapshot.SnapshotStore(self.work_dir)) as client:
+                offline = {'study_id': client.get_study_id(TEST_PDC_STUDY_ID),
+                           'study_name': client.get_study_name(self.study_id),
+                           'metadata': client.get_study_metadata(study_id=self.study_id),
+                           'versions': client.get_study_metadata(pdc_study_id=TEST_PDC_STUDY_ID,
+                                                                 only_latest=False),
+                           'files': client.get_study_raw_files(self.study_id, n_files=5, use_s3_path=True),
+                           'cases': client.get_study_cases(self.study_id),
+                           'samples': client.get_study_samples(self.study_id, file_ids=file_ids)}
+                self.assertIsNone(client.get_study_metadata(study_id='DUMMY'))
+
+        for key, value in online.items():
+            self.assertIsNotNone(value, key)
+            if key == 'samples':
+                value = sorted(value, key=lambda x: x['aliquot_id'])
+                offline[key] = sorted(offline[key], key=lambda x: x['aliquot_id'])
+            self.assertEqual(offline[key], value, key)
+
+
+    def test_offline_aiter_study_cases(self):
+        async def collect(client):
+            return [case async for case in client.aiter_study_cases(self.study_id)]
+
+        with snapshot.OfflineClient(snapshot.SnapshotStore(self.work_dir)) as client:
+            cases = client.gather(collect(client))[0]
+        self.assertEqual(cases, self.snapshot['case'])
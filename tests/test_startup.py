@@ -0,0 +1,86 @@
+
+import sys
+import re
+import unittest
+import subprocess
+
+from resources import TEST_DIR, setup_functions
+
+MODULES_PREFIX = 'LOADED_MODULES:'
+IMPORT_TIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def import_times(stderr: str) -> dict:
+    ''' Parse the output of python -X importtime into a dict of module: cumulative time in us. '''
+    times = dict()
+    for line in stderr.splitlines():
+        if match := IMPORT_TIME_RE.search(line):
+            times[match.group(4)] = int(match.group(2))
+    return times
+
+
+def run_importtime(args: list, wd: str):
+    '''
+    Run the PDC_client main function with args under python -X importtime.
+
+    Returns
+    -------
+    result: subprocess.CompletedProcess
+    times: dict
+        The cumulative import time of each module timed by -X importtime.
+    modules: set
+        The names of every module in sys.modules when the command exited.
+        -X importtime does not time submodules imported with "from package import submodule",
+        so this is used to check which modules were imported.
+    '''
+    command = [sys.executable, '-X', 'importtime', '-c',
+               'import sys, atexit; '
+               f'atexit.register(lambda: print("{MODULES_PREFIX}", *sys.modules, file=sys.stderr)); '
+               'from PDC_client.main import main; main()'] + args
+    result = subprocess.run(command, cwd=wd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            text=True, check=False)
+
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith(MODULES_PREFIX):
+            modules = set(line.split()[1:])
+    return result, import_times(result.stderr), modules
+
+
+class TestStartup(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = f'{TEST_DIR}/work/startup'
+        setup_functions.make_work_dir(cls.work_dir, clear_dir=True)
+
+
+    def test_main_import_time(self):
+        result, times, modules = run_importtime(['--help'], self.work_dir)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+        # The import time depends on the machine, so only which modules are imported is checked.
+        # Importing httpx and asyncio at startup takes several times longer than the rest of main.
+        self.assertIn('PDC_client.main', times)
+        for module in ('httpx', 'asyncio', 'subprocess', 'PDC_client.submodules.io',
+                       'PDC_client.submodules.json_codec', 'orjson', 'msgspec'):
+            self.assertNotIn(module, modules)
+
+
+    def test_metadataToSky_imports(self):
+        metadata_file = f'{TEST_DIR}/resources/data/output/PDC000504_flat.json'
+        result, _, modules = run_importtime(['metadataToSky', metadata_file], self.work_dir)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+        self.assertIn('PDC_client.submodules.io', modules)
+        for module in ('httpx', 'asyncio', 'subprocess', 'PDC_client.submodules.api'):
+            self.assertNotIn(module, modules)
+
+
+    def test_studyID_imports(self):
+        snapshot_dir = f'{self.work_dir}/empty_snapshot'
+        result, _, modules = run_importtime(['studyID', '--offline', '--snapshotDir', snapshot_dir,
+                                             'PDC000000'], self.work_dir)
+        self.assertEqual(result.returncode, 1, result.stderr)
+
+        self.assertIn('PDC_client.submodules.api', modules)
+        self.assertNotIn('PDC_client.submodules.io', modules)
@@ -0,0 +1,166 @@
+
+import os
+import stat
+import shutil
+import hashlib
+import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+from resources import TEST_DIR
+from resources.setup_functions import make_work_dir, LocalFileServer
+
+from PDC_client.submodules import io
+from PDC_client.submodules import store as store_module
+from PDC_client.submodules.store import FileStore
+
+FILE_DATA = b'content addressed store test data\n' * 1000
+FILE_MD5 = hashlib.md5(FILE_DATA).hexdigest()
+
+
+class TestFileStore(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = f'{TEST_DIR}/work/file_store'
+        # the store has subdirectories which make_work_dir does not remove
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        make_work_dir(self.work_dir)
+        self.source = f'{self.work_dir}/source.raw'
+        with open(self.source, 'wb') as outF:
+            outF.write(FILE_DATA)
+
+
+    def read(self, path):
+        with open(path, 'rb') as inF:
+            return inF.read()
+
+
+    def test_invalid_args(self):
+        with self.assertRaises(ValueError):
+            FileStore(f'{self.work_dir}/store', methods=())
+        with self.assertRaises(ValueError):
+            FileStore(f'{self.work_dir}/store', methods=('symlink',))
+        with self.assertRaises(ValueError):
+            FileStore(f'{self.work_dir}/store').path('not_an_md5')
+
+
+    def test_hardlink(self):
+        store = FileStore(f'{self.work_dir}/store')
+        source_mode = os.stat(self.source).st_mode
+        self.assertNotIn(FILE_MD5, store)
+        self.assertTrue(store.add(self.source, FILE_MD5))
+        self.assertIn(FILE_MD5, store)
+        self.assertEqual(store.path(FILE_MD5), f'{self.work_dir}/store/{FILE_MD5[:2]}/{FILE_MD5}')
+
+        # the added file is not linked to the store and its mode is not changed
+        self.assertFalse(os.path.samefile(self.source, store.path(FILE_MD5)))
+        self.assertEqual(os.stat(self.source).st_mode, source_mode)
+        self.assertEqual(os.stat(store.path(FILE_MD5)).st_mode & 0o777, 0o444)
+        self.assertEqual(os.listdir(f'{self.work_dir}/store/{FILE_MD5[:2]}'), [FILE_MD5])
+
+        # adding the same file again does nothing
+        self.assertTrue(store.add(self.source, FILE_MD5))
+        self.assertEqual(store.n_added, 1)
+
+        ofname = f'{self.work_dir}/materialized.raw'
+        self.assertTrue(store.materialize(FILE_MD5, ofname, size=len(FILE_DATA)))
+        self.assertTrue(os.path.samefile(ofname, store.path(FILE_MD5)))
+        self.assertEqual(os.stat(ofname).st_mode & stat.S_IWUSR, 0)
+        self.assertEqual(store.n_materialized, {'hardlink': 1})
+        self.assertEqual(store.bytes_materialized, len(FILE_DATA))
+
+
+    def test_copy(self):
+        for methods in (('reflink', 'copy'), ('copy',)):
+            store = FileStore(f'{self.work_dir}/store_{len(methods)}', methods=methods)
+            self.assertTrue(store.add(self.source, FILE_MD5))
+
+            ofname = f'{self.work_dir}/copy_{len(methods)}.raw'
+            self.assertTrue(store.materialize(FILE_MD5, ofname))
+            self.assertFalse(os.path.samefile(ofname, store.path(FILE_MD5)))
+            self.assertEqual(self.read(ofname), FILE_DATA)
+            self.assertEqual(sum(store.n_materialized.values()), 1)
+            self.assertFalse(any(name.endswith('.tmp') for name in os.listdir(self.work_dir)))
+
+
+    def test_concurrent_add(self):
+        store = FileStore(f'{self.work_dir}/store', methods=('copy',))
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda _: store.add(self.source, FILE_MD5), range(8)))
+        self.assertTrue(all(results))
+        self.assertEqual(self.read(store.path(FILE_MD5)), FILE_DATA)
+        self.assertEqual(os.listdir(f'{self.work_dir}/store/{FILE_MD5[:2]}'), [FILE_MD5])
+
+
+    def test_copy_file_range_fallback(self):
+        ofname = f'{self.work_dir}/fallback.raw'
+        with mock.patch.object(store_module.os, 'copy_file_range', side_effect=OSError('not supported')):
+            store_module.copy_file(self.source, ofname)
+        self.assertEqual(self.read(ofname), FILE_DATA)
+
+
+    def test_missing_and_wrong_size(self):
+        store = FileStore(f'{self.work_dir}/store')
+        ofname = f'{self.work_dir}/missing.raw'
+        self.assertFalse(store.materialize(FILE_MD5, ofname))
+        self.assertFalse(os.path.exists(ofname))
+
+        store.add(self.source, FILE_MD5)
+        with self.assertLogs(level='WARNING'):
+            self.assertFalse(store.materialize(FILE_MD5, ofname, size=len(FILE_DATA) + 1))
+        self.assertFalse(os.path.exists(ofname))
+
+
+class TestDownloadWithStore(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = f'{TEST_DIR}/work/download_store'
+        shutil.rmtree(cls.work_dir, ignore_errors=True)
+        make_work_dir(cls.work_dir)
+        cls.server = LocalFileServer({'file.raw': FILE_DATA}).start()
+        cls.url = cls.server.url('file.raw')
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+
+    def test_download_files(self):
+        store = FileStore(f'{self.work_dir}/store_files')
+        files = [{'file_name': 'file.raw', 'url': self.url, 'md5sum': FILE_MD5, 'file_size': len(FILE_DATA)}]
+
+        for study in ('study_1', 'study_2'):
+            os.makedirs(f'{self.work_dir}/{study}')
+
+        # a file which is not in the store is only looked up in it once
+        n_requests = self.server.n_requests
+        with mock.patch.object(store, 'materialize', wraps=store.materialize) as materialize:
+            results = io.download_files(files, output_dir=f'{self.work_dir}/study_1', store=store)
+        self.assertEqual(results, {'file.raw': True})
+        self.assertEqual(materialize.call_count, 1)
+        self.assertEqual(self.server.n_requests, n_requests + 1)
+        self.assertIn(FILE_MD5, store)
+
+        # the same file in another study is not downloaded again
+        results = io.download_files(files, output_dir=f'{self.work_dir}/study_2', store=store)
+        self.assertEqual(results, {'file.raw': True})
+        self.assertEqual(self.server.n_requests, n_requests + 1)
+        self.assertEqual(sum(store.n_materialized.values()), 1)
+        self.assertEqual(io.md5_sum(f'{self.work_dir}/study_2/file.raw'), FILE_MD5)
+
+
+    def test_download_file(self):
+        store = FileStore(f'{self.work_dir}/store_file')
+        ofname = f'{self.work_dir}/single.raw'
+
+        n_requests = self.server.n_requests
+        self.assertTrue(io.download_file(self.url, ofname, expected_md5=FILE_MD5, store=store))
+        os.remove(ofname)
+        self.assertTrue(io.download_file(self.url, ofname, expected_md5=FILE_MD5, store=store))
+        self.assertEqual(self.server.n_requests, n_requests + 1)
+
+        # files which do not match their md5 sum are not added
+        with self.assertLogs(level='ERROR'):
+            self.assertFalse(io.download_file(self.url, f'{self.work_dir}/bad.raw',
+                                              expected_md5='0' * 32, store=store))
+        self.assertNotIn('0' * 32, store)